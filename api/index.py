@@ -8,435 +8,2711 @@ import json
 import os
 import re
 import time
+import zlib
+import hashlib
+import math
+import mmap
+import heapq
+import bisect
+import atexit
 import random
+import signal
+import socket
+import struct
+import socketserver
+import mimetypes
+import tempfile
+import importlib
+import itertools
+import threading
+import contextvars
+from array import array
+from datetime import date, timedelta
+from collections import OrderedDict, deque, namedtuple
 from urllib.parse import parse_qs, urlparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from http.server import BaseHTTPRequestHandler
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-import requests
-from requests.adapters import HTTPAdapter
-import urllib3
-urllib3.disable_warnings()
+
+class _LazyModule:
+    """首次访问属性时才导入模块，缩短 Serverless 冷启动；只在出错时才求值的 except 子句不会触发导入"""
+
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load is not None:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+def _on_requests_loaded(module):
+    import urllib3
+    urllib3.disable_warnings()
+
+
+requests = _LazyModule("requests", on_load=_on_requests_loaded)
+sqlite3 = _LazyModule("sqlite3")
+# concurrent.futures 会连带导入 logging
+concurrent_futures = _LazyModule("concurrent.futures")
 
 # ==========================================
 # 全局配置
 # ==========================================
 
-SESSION = requests.Session()
-SESSION.headers.update({
-    "Accept": "application/json, text/plain, */*",
-    "Accept-Language": "zh-CN,zh;q=0.9",
-    "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15"
-})
-SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
-SESSION.mount("http://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+class _LazySession:
+    """首次使用时才创建 requests.Session 与连接池
+
+    属性访问转发给真实会话；测试/压测脚本直接给 SESSION.get 赋值时覆盖的是本对象上的属性。
+    """
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _create(self):
+        session = requests.Session()
+        session.headers.update({
+            "Accept": "application/json, text/plain, */*",
+            "Accept-Language": "zh-CN,zh;q=0.9",
+            "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15"
+        })
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20))
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20))
+        return session
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create()
+        return self._session
+
+    def __getattr__(self, attr):
+        return getattr(self.session, attr)
+
+
+SESSION = _LazySession()
 
-CACHE = {}
 CACHE_TTL = 60  # 默认缓存60秒
+FUND_INFO_TTL = 30
  # 热门/板块等弱实时数据使用更长缓存，降低上游压力
 FUND_HOT_TTL = 10 * 60
 FUND_DETAIL_PART_TTL = 6 * 60 * 60
+FUND_DETAIL_TTL = 60
 SECTOR_STREAK_TTL = 10 * 60
-SECTOR_STREAK_ITEM_TTL = 30 * 60
 SECTOR_FUNDS_TTL = 15 * 60
+SECTOR_LIST_TTL = 5 * 60
+MARKET_INDICES_TTL = 30
+NEWS_TTL = 5 * 60
+FUND_INDEX_TTL = 24 * 60 * 60  # 本地基金检索索引刷新周期
+FUND_SEARCH_LIMIT = 20
+SECTOR_HISTORY_DAYS = 20  # 板块收盘价保留的交易日数，需覆盖最长连涨/连跌
+# 历史净值：每只基金一个列式文件（CACHE_DIR/nav/<代码>.nav），首次全量拉取，之后按日追加
+NAV_HISTORY_SYNC_TTL = 30 * 60  # 检查新净值的周期，休市期间按交易日历延长
+NAV_HISTORY_PAGE_SIZE = 20  # 增量同步拉取的最近净值条数，接不上已存序列时重新全量拉取
+NAV_HISTORY_DEFAULT_POINTS = 500  # 区间查询默认返回的最多点数，超过时降采样
+NAV_HISTORY_MAX_POINTS = 5000
+NAV_HISTORY_MAX_OPEN = 256  # 同时保持内存映射的基金文件数
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SINGLE_FLIGHT_TIMEOUT = 20  # 等待同 key 回源结果的最长时间，需大于上游超时
+# 软过期后仍可返回旧值的窗口 = ttl * 倍数，期间后台刷新
+CACHE_STALE_RATIO = float(os.getenv("CACHE_STALE_RATIO", "4"))
+# 本地持久化缓存目录，Serverless 环境仅 /tmp 可写
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "yangxiaoji-cache"))
+DISK_CACHE_ENABLED = os.getenv("DISK_CACHE", "1") != "0"
+DISK_CACHE_MIN_TTL = int(os.getenv("DISK_CACHE_MIN_TTL", "300"))  # 仅落盘长 TTL 数据
+DISK_CACHE_MAX_ENTRIES = int(os.getenv("DISK_CACHE_MAX_ENTRIES", "20000"))
+# 进程间共享缓存：本地 unix socket 守护进程，serve 多进程模式自动启动，也可单独运行后以该变量指定
+SHARED_CACHE_SOCKET = os.getenv("SHARED_CACHE_SOCKET", "")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "50000"))
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SHARED_CACHE_TIMEOUT = 1.0  # 单次读写超时（秒）
+SHARED_CACHE_RETRY = 5  # 守护进程不可用时，本进程回退为独立缓存的时长（秒）
 EASTMONEY_UT = "fa5fd1943c7b386f172d6893dbfba10b"
+BULK_ESTIMATE_CHUNK = 50  # 批量估值接口单次最多查询的基金数
+STOCK_QUOTE_TTL = 10  # 个股实时涨跌缓存（秒）
+STOCK_QUOTE_BATCH_WINDOW = 0.02  # 合并并发个股行情请求的等待窗口（秒）
+ULIST_MAX_SECIDS = 100  # ulist.np/get 单次最多查询的证券数
+PORTFOLIO_MAX_HOLDINGS = 5000  # 单次估值最多持仓条数
+REQUEST_MAX_BODY = 2 * 1024 * 1024  # POST 请求体上限（字节）
+PAYLOAD_CACHE_ENTRIES = 512  # 已序列化响应体的缓存条数
+GZIP_MIN_BYTES = 1024  # 小于该长度的响应不压缩
+MULTI_MAX_REQUESTS = 10  # 组合请求单次最多子请求数
+# 实时推送：每个代码一个共享轮询，按订阅者扇出
+LIVE_POLL_INTERVAL = 15  # 交易时段轮询间隔（秒）
+LIVE_IDLE_POLL_INTERVAL = 5 * 60  # 非交易时段轮询间隔（秒）
+LIVE_HEARTBEAT = 15
+LIVE_EVENT_LOG = 2000  # 保留用于断线续传的事件条数
+LIVE_MAX_TOPICS = 50  # 单个连接最多订阅的代码数
+LIVE_MAX_DURATION = int(os.getenv("LIVE_MAX_DURATION", "280"))  # 单次连接时长，需小于函数最长执行时间
+LIVE_IDLE_EXIT = 60  # 无订阅者多久后停止轮询线程
 TIANTIAN_API_BASE = os.getenv(
     "TIANTIAN_API_BASE",
     "https://tiantian-fund-api.vercel.app/api/action"
 )
+# 交易日历：休市时行情类缓存延长到下一次开盘，净值类在晚间净值发布窗口内按较短周期刷新
+MARKET_CALENDAR_FILE = os.getenv(
+    "MARKET_CALENDAR_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_holidays.json")
+)
+NAV_PUBLISH_WINDOW = (16 * 60, 23 * 60 + 30)  # 交易日净值发布时段（北京时间分钟）
+NAV_PUBLISH_TTL = 10 * 60
+MARKET_CLOSE_GRACE = 5  # 收盘后仍按盘中 ttl 缓存的分钟数，等收盘集合竞价等数据落定后再延长到下一次开盘
+MARKET_OFFHOURS_MAX_TTL = 3 * 24 * 60 * 60
+BROWSER_MAX_AGE = 60 * 60  # Cache-Control 中 max-age/s-maxage 的上限
+# 缓存预热：到期前 lead 时间内主动刷新热点 key
+WARM_INTERVAL = int(os.getenv("WARM_INTERVAL", "10"))  # 常驻模式的轮询间隔（秒）
+WARM_LEAD_RATIO = 0.2  # 剩余新鲜时间低于 ttl 的该比例即刷新
+WARM_JITTER = 0.3  # lead 时间随机放大比例，错开同 TTL key 的刷新
+WARM_BUDGET = int(os.getenv("WARM_BUDGET", "40"))  # 单轮预热最多消耗的上游请求数
+WARM_TOP_FUNDS = int(os.getenv("WARM_TOP_FUNDS", "50"))  # 预热访问量最高的基金数
+TRAFFIC_HALF_LIFE = 30 * 60  # 基金访问计数的衰减半衰期（秒）
+TRAFFIC_MAX_KEYS = 2000
+CRON_SECRET = os.getenv("CRON_SECRET", "")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # 配置后 module=metrics 需携带 Bearer 令牌
+# 延迟直方图分桶上界（秒）
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 请求追踪：debug=trace 时在响应中附带调用瀑布；采样模式把最慢的 N 条写入本地文件
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_SLOWEST_N = int(os.getenv("TRACE_SLOWEST_N", "20"))
+TRACE_FILE_MAX_BYTES = 2 * 1024 * 1024  # 超过后轮转为 .1
+TRACE_MAX_SPANS = 2000  # 单次请求最多记录的 span 数
+# 自托管服务（python api/index.py serve）：多进程经 SO_REUSEPORT 共享端口
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("PORT", "8000"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0"))  # 0 表示按 CPU 核数
+SERVE_QUEUE_SIZE = int(os.getenv("SERVE_QUEUE_SIZE", "1024"))  # listen 队列长度
+SERVE_MAX_CONNECTIONS = int(os.getenv("SERVE_MAX_CONNECTIONS", "256"))  # 单进程同时处理的连接数
+SERVE_KEEPALIVE_TIMEOUT = 15  # 空闲 keep-alive 连接的超时（秒）
+SERVE_DRAIN_TIMEOUT = int(os.getenv("SERVE_DRAIN_TIMEOUT", "25"))  # SIGTERM 后等待处理中请求的上限
+SERVE_STATIC_MAX_BYTES = 1024 * 1024  # 超过该大小的静态文件不进内存缓存
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public")
+# 上游地址改写（压测/回放桩）："host=base,..."，host 为 * 时改写为 base/<host><path>
+UPSTREAM_OVERRIDES = dict(
+    item.split("=", 1) for item in os.getenv("UPSTREAM_OVERRIDES", "").split(",") if "=" in item
+)
+# 冷启动时后台预先与主要上游建立 TLS 连接；Vercel 上默认开启，serve 模式在各工作进程中执行
+UPSTREAM_PREWARM = os.getenv("UPSTREAM_PREWARM", "1" if os.getenv("VERCEL") else "0") == "1"
+UPSTREAM_PREWARM_HOSTS = tuple(
+    host for host in os.getenv(
+        "UPSTREAM_PREWARM_HOSTS",
+        "fundgz.1234567.com.cn,tiantian-fund-api.vercel.app,push2.eastmoney.com,fundf10.eastmoney.com"
+    ).split(",") if host
+)
+# 共享上游线程池与单主机并发上限（HTTPAdapter 每主机连接池为 20）
+UPSTREAM_MAX_WORKERS = int(os.getenv("UPSTREAM_MAX_WORKERS", "32"))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "256"))
+UPSTREAM_HOST_MAX_WAITERS = int(os.getenv("UPSTREAM_HOST_MAX_WAITERS", "64"))
+UPSTREAM_HOST_WAIT_TIMEOUT = 10
+UPSTREAM_HOST_DEFAULT_LIMIT = 6
+# 对冲请求：主源超过其 p95 延迟仍未返回时启动备源
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.2
+HEDGE_MAX_DELAY = 3.0
+BREAKER_FAILURE_THRESHOLD = 5  # 连续失败次数达到阈值后熔断
+BREAKER_COOLDOWN = 30  # 熔断冷却时间（秒）
+UPSTREAM_HOST_LIMITS = {
+    "push2.eastmoney.com": 10,
+    "push2his.eastmoney.com": 12,
+    "fundgz.1234567.com.cn": 10,
+    "fundf10.eastmoney.com": 8,
+    urlparse(TIANTIAN_API_BASE).hostname: 12,
+}
 
 
-def get_cache(key, ttl=None):
-    if key in CACHE:
-        data, ts = CACHE[key]
-        if time.time() - ts < (ttl or CACHE_TTL):
-            return data
-        del CACHE[key]
-    return None
+# ==========================================
+# 运行指标
+# ==========================================
 
+class Histogram:
+    """固定分桶的延迟直方图，各桶独立计数，输出时再累加"""
 
-def set_cache(key, data, ttl=None):
-    CACHE[key] = (data, time.time())
-    # 清理过期缓存
-    now = time.time()
-    expired = [k for k, (_, ts) in list(CACHE.items()) if now - ts > CACHE_TTL * 5]
-    for k in expired[:10]:  # 每次最多清理10个
-        CACHE.pop(k, None)
+    __slots__ = ("counts", "sum", "count")
 
+    def __init__(self):
+        self.counts = [0] * (len(METRICS_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
 
-def _safe_json(resp):
-    try:
-        return resp.json()
-    except (ValueError, json.JSONDecodeError):
-        return None
+    def observe(self, value):
+        self.counts[bisect.bisect_left(METRICS_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
 
 
-def _tiantian_action(action_name, params=None, timeout=8):
-    request_params = {"action_name": action_name}
-    if params:
-        request_params.update(params)
-    try:
-        resp = SESSION.get(
-            TIANTIAN_API_BASE,
-            params=request_params,
-            timeout=timeout,
-            verify=False
-        )
-    except requests.RequestException as e:
-        return None, str(e)
-    data = _safe_json(resp)
-    if data is None:
-        return None, "上游返回非JSON"
-    if isinstance(data, dict):
-        err_code = data.get("ErrCode")
-        if err_code not in (None, 0, "0", ""):
-            return None, data.get("ErrMsg") or "上游返回错误"
-    return data, None
+_METRIC_PATH_NUMBERS = re.compile(r"\d{3,}")
+_METRIC_ROUTE_MODULES = {"fund", "market", "sector", "news", "portfolio", "multi", "live", "warm", "metrics"}
+# ROUTE_TTLS 之外的已知端点（不缓存或不带 action）
+_METRIC_EXTRA_ROUTES = {("portfolio", "value"), ("multi", ""), ("live", ""), ("warm", ""), ("metrics", "")}
 
 
-def _fetch_fund_gz(code):
-    url = f"https://fundgz.1234567.com.cn/js/{code}.js"
-    try:
-        resp = SESSION.get(url, timeout=5, verify=False)
-        match = re.search(r'jsonpgz\((.*)\)', resp.text)
-        if not match:
-            return None, "未找到基金"
-        data = json.loads(match.group(1))
-        return {
-            "code": data.get("fundcode", code),
-            "name": data.get("name", ""),
-            "nav": data.get("dwjz", ""),
-            "nav_date": data.get("jzrq", ""),
-            "estimate_nav": data.get("gsz", ""),
-            "estimate_change": data.get("gszzl", "0"),
-            "estimate_time": data.get("gztime", ""),
-        }, None
-    except (requests.RequestException, ValueError, json.JSONDecodeError) as e:
-        return None, str(e)
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
 
-# ==========================================
-# 板块配置 - 完整的板块列表
-# ==========================================
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
 
-SECTOR_LIST = [
-    # 科技
-    {"name": "人工智能", "code": "BK000217", "category": "科技"},
-    {"name": "半导体", "code": "BK000054", "category": "科技"},
-    {"name": "云计算", "code": "BK000266", "category": "科技"},
-    {"name": "5G概念", "code": "BK000291", "category": "科技"},
-    {"name": "光模块", "code": "BK000651", "category": "科技"},
-    {"name": "算力", "code": "BK000601", "category": "科技"},
-    {"name": "生成式AI", "code": "BK000369", "category": "科技"},
-    {"name": "消费电子", "code": "BK000089", "category": "科技"},
-    # 新能源
-    {"name": "新能源汽车", "code": "BK000225", "category": "新能源"},
-    {"name": "光伏", "code": "BK000146", "category": "新能源"},
-    {"name": "锂电池", "code": "BK000295", "category": "新能源"},
-    {"name": "储能", "code": "BK000230", "category": "新能源"},
-    {"name": "氢能源", "code": "BK000227", "category": "新能源"},
-    {"name": "风电", "code": "BK000147", "category": "新能源"},
-    {"name": "绿色电力", "code": "BK1036", "category": "新能源"},
-    {"name": "电网设备", "code": "BK0920", "category": "新能源"},
-    # 医药健康
-    {"name": "医药", "code": "BK000090", "category": "医药健康"},
-    {"name": "医疗器械", "code": "BK000095", "category": "医药健康"},
-    {"name": "创新药", "code": "BK000315", "category": "医药健康"},
-    {"name": "中药", "code": "BK000091", "category": "医药健康"},
-    # 金融
-    {"name": "银行", "code": "BK000121", "category": "金融"},
-    {"name": "证券", "code": "BK000128", "category": "金融"},
-    {"name": "保险", "code": "BK000127", "category": "金融"},
-    # 消费
-    {"name": "食品饮料", "code": "BK000074", "category": "消费"},
-    {"name": "白酒", "code": "BK000076", "category": "消费"},
-    {"name": "家用电器", "code": "BK000066", "category": "消费"},
-    {"name": "汽车整车", "code": "BK000069", "category": "消费"},
-    # 工业制造
-    {"name": "机器人", "code": "BK000234", "category": "工业制造"},
-    {"name": "人形机器人", "code": "BK000581", "category": "工业制造"},
-    {"name": "自动驾驶", "code": "BK000279", "category": "工业制造"},
-    {"name": "智能驾驶", "code": "BK000461", "category": "工业制造"},
-    {"name": "国防军工", "code": "BK000156", "category": "工业制造"},
-    {"name": "低空经济", "code": "BK000521", "category": "工业制造"},
-    {"name": "商业航天", "code": "BK1132", "category": "工业制造"},
-    # 周期资源
-    {"name": "煤炭", "code": "BK000177", "category": "周期资源"},
-    {"name": "钢铁", "code": "BK000043", "category": "周期资源"},
-    {"name": "有色金属", "code": "BK000047", "category": "周期资源"},
-    {"name": "贵金属", "code": "BK000050", "category": "周期资源"},
-    {"name": "房地产", "code": "BK000105", "category": "周期资源"},
-    # 其他
-    {"name": "可控核聚变", "code": "BK1133", "category": "其他"},
-    {"name": "交通运输", "code": "BK000112", "category": "其他"},
-]
 
-SECTOR_ALIAS_MAP = {
-    "酿酒": "BK000076",
-    "光伏设备": "BK000146",
-    "电网设备": "BK0920",
-}
+class MetricsRegistry:
+    """进程内指标：上游延迟/错误、按 key 前缀的缓存事件、按路由的处理延迟
 
+    热路径只做一次加锁的计数累加；渲染 Prometheus 文本时才汇总其他组件的 stats()。
+    """
 
-def _map_sector_to_theme_code(sector_name):
-    if not sector_name:
-        return ""
-    for item in SECTOR_LIST:
-        if item["name"] in sector_name:
-            return item["code"]
-    for key, code in SECTOR_ALIAS_MAP.items():
-        if key in sector_name:
-            return code
-    return ""
+    CACHE_EVENTS = ("hit", "stale", "miss", "set", "evict", "shared")
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._upstream = {}  # (host, action) -> [Histogram, errors, timeouts, rejected]
+        self._cache = {}  # prefix -> {event: count}
+        self._routes = {}  # route -> [Histogram, failures]
+        self.started_at = time.time()
 
-# ==========================================
-# 基金模块
-# ==========================================
+    def observe_upstream(self, host, action, seconds, outcome="ok"):
+        with self._lock:
+            entry = self._upstream.get((host, action))
+            if entry is None:
+                entry = self._upstream[(host, action)] = [Histogram(), 0, 0, 0]
+            if outcome == "rejected":
+                entry[3] += 1
+                return
+            entry[0].observe(seconds)
+            if outcome == "error":
+                entry[1] += 1
+            elif outcome == "timeout":
+                entry[2] += 1
 
-def fund_search(keyword):
-    """搜索基金 - 只返回场外基金"""
-    cache_key = f"search:{keyword}"
-    cached = get_cache(cache_key)
-    if cached:
-        return cached
-    
-    # 排除的类别：高端理财、场内基金(ETF/LOF除外)、货币基金等不支持详情查询的
-    EXCLUDE_CATEGORIES = {"高端理财", "私募", "银行理财", "信托", "保险", "券商理财"}
-
-    def _is_money_fund(category: str, ftype: str, name: str) -> bool:
-        """货币基金识别：名称/分类/类型任一命中即剔除。"""
-        category = category or ""
-        ftype = ftype or ""
-        name = name or ""
-        if "货币" in category or "货币" in ftype or "货币" in name:
-            return True
-        if "现金" in category or "现金" in ftype or "现金" in name:
-            return True
-        return False
-    
-    data, err = _tiantian_action(
-        "fundSearch",
-        {"m": "1", "key": keyword, "pageindex": "0", "pagesize": "50"},
-        timeout=6
-    )
-    if not data:
-        return {"success": False, "message": f"搜索失败: {err or '上游不可用'}"}
+    def cache_event(self, key, event):
+        prefix = key.split(":", 1)[0]
+        with self._lock:
+            counts = self._cache.get(prefix)
+            if counts is None:
+                counts = self._cache[prefix] = dict.fromkeys(self.CACHE_EVENTS, 0)
+            counts[event] += 1
 
-    results = []
-    if data.get("Datas"):
-        for item in data["Datas"]:
-            fund_base = item.get("FundBaseInfo") or {}
-            category = item.get("CATEGORYDESC", "")
-            ftype = fund_base.get("FTYPE", "")
-            code = item.get("CODE", "")
+    @staticmethod
+    def route_name(module, action):
+        """路由标签只取已知端点，未知 action 归入 <module>.other，避免任意参数撑爆时序数量"""
+        module = module or "fund"
+        action = action or ""
+        if module not in _METRIC_ROUTE_MODULES:
+            return "other"
+        if (module, action) not in ROUTE_TTLS and (module, action) not in _METRIC_EXTRA_ROUTES:
+            return f"{module}.other"
+        return f"{module}.{action}" if action else module
 
-            # 只保留场外基金：有 FundBaseInfo 且不在排除类别
-            if not fund_base:
-                continue
-            if category in EXCLUDE_CATEGORIES:
-                continue
-            # 只保留6位代码的基金
-            if not code or len(code) != 6:
-                continue
+    def observe_route(self, route, seconds, ok):
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = [Histogram(), 0]
+            entry[0].observe(seconds)
+            if not ok:
+                entry[1] += 1
 
-            if _is_money_fund(category, ftype, item.get("NAME", "")):
-                continue
+    @staticmethod
+    def _histogram_lines(name, labels, hist):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(METRICS_BUCKETS, hist.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {hist.count}')
+        suffix = _labels(**labels) if labels else ""
+        lines.append(f"{name}_sum{suffix} {hist.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {hist.count}")
+        return lines
 
-            results.append({
-                "code": code,
-                "name": item.get("NAME", ""),
-                "type": ftype,
-                "category": category
-            })
+    def render(self):
+        """Prometheus 文本格式（0.0.4）"""
+        with self._lock:
+            # 锁内复制一份快照，生成文本时不再持锁
+            upstream = [
+                (key, _copy_histogram(entry[0]), entry[1], entry[2], entry[3])
+                for key, entry in self._upstream.items()
+            ]
+            cache = {prefix: dict(counts) for prefix, counts in self._cache.items()}
+            routes = [(route, _copy_histogram(entry[0]), entry[1]) for route, entry in self._routes.items()]
 
-            if len(results) >= 20:
-                break
+        lines = [
+            "# HELP yxj_upstream_request_duration_seconds 上游请求耗时",
+            "# TYPE yxj_upstream_request_duration_seconds histogram",
+        ]
+        for (host, action), hist, _, _, _ in upstream:
+            lines += self._histogram_lines("yxj_upstream_request_duration_seconds", {"host": host, "action": action}, hist)
+        lines += ["# HELP yxj_upstream_failures_total 上游失败次数", "# TYPE yxj_upstream_failures_total counter"]
+        for (host, action), _, errors, timeouts, rejected in upstream:
+            for kind, value in (("error", errors), ("timeout", timeouts), ("rejected", rejected)):
+                lines.append(f"yxj_upstream_failures_total{_labels(host=host, action=action, kind=kind)} {value}")
 
-    result = {"success": True, "data": results}
-    set_cache(cache_key, result)
-    return result
+        lines += ["# HELP yxj_cache_events_total 按 key 前缀的缓存事件", "# TYPE yxj_cache_events_total counter"]
+        for prefix, counts in sorted(cache.items()):
+            for event, value in counts.items():
+                lines.append(f"yxj_cache_events_total{_labels(prefix=prefix, event=event)} {value}")
+        cache_stats = CACHE.stats()
+        lines += [
+            "# TYPE yxj_cache_entries gauge", f"yxj_cache_entries {cache_stats['entries']}",
+            "# TYPE yxj_cache_bytes gauge", f"yxj_cache_bytes {cache_stats['bytes']}",
+            "# TYPE yxj_payload_cache_hits_total counter", f"yxj_payload_cache_hits_total {PAYLOADS.hits}",
+            "# TYPE yxj_payload_cache_misses_total counter", f"yxj_payload_cache_misses_total {PAYLOADS.misses}",
+        ]
+        if SHARED_CACHE is not None:
+            lines += ["# HELP yxj_shared_cache_requests_total 进程间共享缓存读取", "# TYPE yxj_shared_cache_requests_total counter"]
+            for result, value in (("hit", SHARED_CACHE.hits), ("miss", SHARED_CACHE.misses), ("error", SHARED_CACHE.errors)):
+                lines.append(f"yxj_shared_cache_requests_total{_labels(result=result)} {value}")
 
+        lines += [
+            "# HELP yxj_http_request_duration_seconds 路由处理耗时",
+            "# TYPE yxj_http_request_duration_seconds histogram",
+        ]
+        for route, hist, _ in routes:
+            lines += self._histogram_lines("yxj_http_request_duration_seconds", {"route": route}, hist)
+        lines += ["# TYPE yxj_http_request_failures_total counter"]
+        for route, _, failures in routes:
+            lines.append(f"yxj_http_request_failures_total{_labels(route=route)} {failures}")
 
-def fund_info(code):
-    """获取单只基金信息"""
-    cache_key = f"info:{code}"
-    cached = get_cache(cache_key, ttl=30)
-    if cached:
-        return cached
-    fund_data, err = _fetch_fund_gz(code)
-    if fund_data:
-        result = {"success": True, "data": fund_data}
-        set_cache(cache_key, result, ttl=30)
-        return result
+        upstream_stats = UPSTREAM.stats()
+        lines += ["# TYPE yxj_upstream_queue_depth gauge", f"yxj_upstream_queue_depth {upstream_stats['queued']}"]
+        lines += ["# TYPE yxj_upstream_host_waiting gauge"]
+        for host, slot in upstream_stats["hosts"].items():
+            lines.append(f"yxj_upstream_host_waiting{_labels(host=host)} {slot['waiting']}")
+        lines += [
+            "# TYPE yxj_upstream_inline_tasks_total counter", f"yxj_upstream_inline_tasks_total {upstream_stats['inline']}",
+        ]
+        queue_wait, host_waits = UPSTREAM.wait_histograms()
+        lines += [
+            "# HELP yxj_upstream_queue_wait_seconds 上游线程池排队等待时间",
+            "# TYPE yxj_upstream_queue_wait_seconds histogram",
+        ]
+        lines += self._histogram_lines("yxj_upstream_queue_wait_seconds", {}, queue_wait)
+        lines += [
+            "# HELP yxj_upstream_host_wait_seconds 等待上游主机并发名额的时间",
+            "# TYPE yxj_upstream_host_wait_seconds histogram",
+        ]
+        for host, hist in sorted(host_waits.items()):
+            lines += self._histogram_lines("yxj_upstream_host_wait_seconds", {"host": host}, hist)
+        lines += ["# HELP yxj_breaker_open 熔断状态（closed=0, half_open=0.5, open=1）", "# TYPE yxj_breaker_open gauge"]
+        for name, breaker in list(BREAKERS.items()):
+            value = {"closed": 0, "half_open": 0.5, "open": 1}[breaker.state]
+            lines.append(f"yxj_breaker_open{_labels(upstream=name)} {value}")
+        live_stats = LIVE_HUB.stats()
+        lines += [
+            "# TYPE yxj_live_subscribers gauge", f"yxj_live_subscribers {live_stats['subscribers']}",
+            "# TYPE yxj_process_uptime_seconds gauge", f"yxj_process_uptime_seconds {time.time() - self.started_at:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
 
-    last_error = err or "估值数据为空"
 
-    # 兜底：使用基金详情接口获取基础信息
-    detail_data, detail_err = _tiantian_action(
-        "fundMNDetailInformation",
-        {"FCODE": code},
-        timeout=6
-    )
-    if detail_data:
-        datas = detail_data.get("Datas") or {}
-        if datas:
-            result = {
-                "success": True,
-                "data": {
-                    "code": datas.get("FCODE", code),
-                    "name": datas.get("SHORTNAME", "") or datas.get("FULLNAME", ""),
-                    "nav": datas.get("DWJZ", ""),
-                    "nav_date": datas.get("FSRQ", ""),
-                    "estimate_nav": "",
-                    "estimate_change": "",
-                    "estimate_time": "",
-                }
-            }
-            set_cache(cache_key, result, ttl=30)
-            return result
-    if detail_err:
-        last_error = detail_err
+def _copy_histogram(hist):
+    copy = Histogram()
+    copy.counts = list(hist.counts)
+    copy.sum = hist.sum
+    copy.count = hist.count
+    return copy
 
-    return {"success": False, "message": f"获取失败: {last_error}"}
 
+METRICS = MetricsRegistry()
 
-def _fetch_fund_year_change(code):
-    cache_key = f"fund_year_change:{code}"
-    cached = get_cache(cache_key, ttl=FUND_DETAIL_PART_TTL)
-    if cached is not None:
-        return cached
-    inc_data, _ = _tiantian_action(
-        "fundMNPeriodIncrease",
-        {"FCODE": code},
-        timeout=6
-    )
-    if inc_data:
-        for item in inc_data.get("Datas", []):
-            title = item.get("title") or item.get("Title") or ""
-            if title in ("1N", "近1年", "Y"):
-                value = item.get("syl", "")
-                set_cache(cache_key, value, ttl=FUND_DETAIL_PART_TTL)
-                return value
-    set_cache(cache_key, "", ttl=FUND_DETAIL_PART_TTL)
-    return ""
 
+# ==========================================
+# 请求追踪
+# ==========================================
 
-def _fetch_fund_sectors(code):
-    cache_key = f"fund_sectors:{code}"
-    cached = get_cache(cache_key, ttl=FUND_DETAIL_PART_TTL)
-    if cached is not None:
-        return cached
-    search_data, _ = _tiantian_action(
-        "fundSearch",
-        {"m": "1", "key": code},
-        timeout=6
-    )
-    if search_data and search_data.get("Datas"):
-        zt_info = search_data["Datas"][0].get("ZTJJInfo", [])
-        if zt_info:
-            result = [{"name": zt.get("TTYPENAME", ""), "code": zt.get("TTYPE", "")} for zt in zt_info[:3]]
-            set_cache(cache_key, result, ttl=FUND_DETAIL_PART_TTL)
-            return result
-    set_cache(cache_key, [], ttl=FUND_DETAIL_PART_TTL)
-    return []
+_TRACE = contextvars.ContextVar("trace", default=None)
+_SPAN = contextvars.ContextVar("span", default=None)
 
 
-def _fetch_stock_changes(codes):
-    if not codes:
-        return {}
-    secids = []
-    for code in codes:
-        if not code:
-            continue
-        market = "1" if str(code).startswith(("6", "9")) else "0"
-        secids.append(f"{market}.{code}")
-    if not secids:
-        return {}
-    try:
-        url = "https://push2.eastmoney.com/api/qt/ulist.np/get"
-        params = {
-            "secids": ",".join(secids),
-            "fields": "f12,f14,f3",
-            "fltt": "2",
-            "invt": "2"
-        }
-        resp = SESSION.get(url, params=params, timeout=6, verify=False)
-        data = _safe_json(resp) or {}
-        diff = data.get("data", {}).get("diff", [])
-        result = {}
-        for item in diff:
-            code = item.get("f12")
-            change = item.get("f3")
-            if code is not None:
-                result[code] = change
-        return result
-    except requests.RequestException:
-        return {}
+class Trace:
+    """单次请求的 span 记录
 
+    当前 trace 与父 span 放在 contextvars 中，UPSTREAM.submit 在追踪开启时复制上下文，
+    线程池扇出的任务因此挂在发起它的 span 下。未开启时各埋点只有一次 ContextVar.get。
+    """
 
-def _fetch_fund_stocks(code):
-    cache_key = f"fund_stocks:{code}"
-    cached = get_cache(cache_key, ttl=FUND_DETAIL_PART_TTL)
-    if cached is not None:
-        return cached
-    stocks = []
-    try:
-        stocks_url = f"https://fundf10.eastmoney.com/FundArchivesDatas.aspx?type=jjcc&code={code}&topline=10"
-        stocks_resp = SESSION.get(
-            stocks_url,
-            timeout=8,
-            verify=False,
-            headers={"Referer": "https://fundf10.eastmoney.com/"}
-        )
-        table_pattern = r'<tr[^>]*>.*?<td[^>]*>(\d+)</td>.*?<td[^>]*>(\d{6})</td>.*?<td[^>]*><a[^>]*>([^<]+)</a></td>.*?<td[^>]*>([^<]*)</td>'
-        for match in re.finditer(table_pattern, stocks_resp.text, re.DOTALL):
-            stocks.append({
-                "rank": match.group(1),
-                "code": match.group(2),
-                "name": match.group(3).strip(),
-                "ratio": match.group(4).strip() + "%",
-                "change": ""
-            })
-        if not stocks:
-            simple_pattern = r'<a[^>]*>(\d{6})</a>.*?<a[^>]*>([^<]+)</a>.*?(\d+\.\d+)%'
-            for match in re.finditer(simple_pattern, stocks_resp.text, re.DOTALL):
-                stocks.append({
-                    "code": match.group(1),
-                    "name": match.group(2).strip(),
-                    "ratio": match.group(3) + "%",
-                    "change": ""
-                })
-    except requests.RequestException:
-        return []
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
 
-    changes = _fetch_stock_changes([s.get("code") for s in stocks])
-    for s in stocks:
-        if s.get("code") in changes:
-            s["change"] = changes.get(s["code"])
-    result = stocks[:10]
-    set_cache(cache_key, result, ttl=FUND_DETAIL_PART_TTL)
-    return result
+    def start(self, name, kind, attrs):
+        span = {"id": 0, "parent": _SPAN.get(), "name": name, "kind": kind,
+                "start": time.perf_counter() - self.t0, "ms": None}
+        span.update(attrs)
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return None
+            span["id"] = len(self.spans) + 1
+            self.spans.append(span)
+        return span, _SPAN.set(span["id"])
 
+    def total_ms(self):
+        return round((time.perf_counter() - self.t0) * 1000, 1)
 
-def fund_detail(code):
-    """获取基金详细信息，包含重仓股"""
-    cache_key = f"detail:{code}"
-    cached = get_cache(cache_key, ttl=60)
-    if cached:
-        return cached
-
-    info_result = fund_info(code)
-    if not info_result.get("success"):
-        return info_result
-    
-    fund_data = info_result["data"].copy()
-    detail_data, _ = _tiantian_action(
-        "fundMNDetailInformation",
-        {"FCODE": code},
-        timeout=6
+    def tree(self):
+        """按 parent 组装为嵌套结构，时间单位为毫秒"""
+        with self._lock:
+            spans = [dict(span) for span in self.spans]
+        nodes = {}
+        roots = []
+        for span in spans:
+            span["start_ms"] = round(span.pop("start") * 1000, 1)
+            span["ms"] = round(span["ms"] * 1000, 1) if span["ms"] is not None else None
+            span["children"] = []
+            nodes[span["id"]] = span
+        for span in spans:
+            parent = nodes.get(span.pop("parent"))
+            (parent["children"] if parent else roots).append(span)
+            span.pop("id")
+        for span in spans:
+            if not span["children"]:
+                del span["children"]
+        return {"total_ms": self.total_ms(), "dropped": self.dropped, "spans": roots}
+
+
+def _trace_start(name, kind, **attrs):
+    """开始一个 span；未追踪时返回 None"""
+    trace = _TRACE.get()
+    if trace is None:
+        return None
+    return trace.start(name, kind, attrs)
+
+
+def _trace_end(handle, **attrs):
+    if handle is None:
+        return
+    span, token = handle
+    span["ms"] = time.perf_counter() - _TRACE.get().t0 - span["start"]
+    span.update(attrs)
+    _SPAN.reset(token)
+
+
+def _trace_event(name, kind, **attrs):
+    """记录瞬时事件（如缓存命中）"""
+    handle = _trace_start(name, kind, **attrs)
+    if handle is not None:
+        handle[0]["ms"] = 0.0
+        _SPAN.reset(handle[1])
+
+
+class TraceSampler:
+    """采样追踪：保留最慢的 TRACE_SLOWEST_N 条，新进入榜单的追加写入轮转文件"""
+
+    def __init__(self, path, slowest_n=TRACE_SLOWEST_N):
+        self.path = path
+        self.slowest_n = slowest_n
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+    def offer(self, route, params, trace):
+        total = trace.total_ms()
+        with self._lock:
+            if len(self._heap) >= self.slowest_n and total <= self._heap[0]:
+                return
+            if len(self._heap) >= self.slowest_n:
+                heapq.heapreplace(self._heap, total)
+            else:
+                heapq.heappush(self._heap, total)
+        record = {
+            "ts": round(time.time(), 3),
+            "route": route,
+            "params": {key: value[0] for key, value in params.items()},
+            "trace": trace.tree()
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with self._lock:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > TRACE_FILE_MAX_BYTES:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+
+# ==========================================
+# 缓存引擎
+# ==========================================
+
+def _estimate_size(value):
+    """粗略估算缓存值占用字节数，用于容量预算"""
+    if isinstance(value, str):
+        return 49 + len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return 33 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 56 + sum(_estimate_size(v) for v in value)
+    return 28
+
+
+class TTLCache:
+    """有界 LRU + TTL 缓存
+
+    - peek/set 均为 O(1)（过期清理按堆顶摊销）
+    - 条目数与字节预算超限时按 LRU 淘汰
+    - 过期由最小堆驱动，无需全表扫描
+    - 软 TTL 过期后条目保留到硬过期，供 peek 读取旧值
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, default_ttl=CACHE_TTL, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.on_evict = on_evict
+        # key -> [data, ts, ttl, expires_at, size]
+        self._data = OrderedDict()
+        self._expiry = []
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def peek(self, key):
+        """读取未硬过期的条目，返回 (data, age, ttl)；不存在返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            data, ts, entry_ttl, expires_at, _ = entry
+            if now >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            age = now - ts
+            if age < entry_ttl:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return data, age, entry_ttl
+
+    def remaining(self, key):
+        """条目剩余的新鲜时间（秒，已软过期为负），不存在返回 None；不计入命中统计"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            return entry[1] + entry[2] - time.time()
+
+    def set(self, key, data, ttl=None, stale_ttl=0, ts=None):
+        now = time.time()
+        ts = ts or now
+        ttl = ttl or self.default_ttl
+        expires_at = ts + ttl + (stale_ttl or 0)
+        if expires_at <= now:
+            return
+        size = _estimate_size(key) + _estimate_size(data)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = [data, ts, ttl, expires_at, size]
+            self._bytes += size
+            heapq.heappush(self._expiry, (expires_at, key))
+            self._purge_expired(now)
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[4]
+
+    def _purge_expired(self, now):
+        # 堆中可能残留已覆盖/已删除条目的旧记录，弹出时与当前条目比对
+        heap = self._expiry
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = self._data.get(key)
+            if entry is not None and entry[3] == expires_at:
+                self._remove(key)
+                self.expirations += 1
+        # 旧记录过多时重建堆，防止堆无限增长
+        if len(heap) > 2 * len(self._data) + 64:
+            self._expiry = [(entry[3], k) for k, entry in self._data.items()]
+            heapq.heapify(self._expiry)
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            key, entry = self._data.popitem(last=False)
+            self._bytes -= entry[4]
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key)
+
+
+class DiskCache:
+    """SQLite 持久化缓存层，冷启动时从本地文件预热
+
+    - 读：内存未命中时回读磁盘（read-through）
+    - 写：先进入待写缓冲，由后台线程批量落盘（write-behind）
+    - 超过条目上限时按过期时间淘汰并增量回收文件空间
+    """
+
+    def __init__(self, path, max_entries=DISK_CACHE_MAX_ENTRIES, flush_interval=1.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._writer = None
+        self._disabled = False
+        self._writes_since_compact = 0
+
+    def _connect(self):
+        if self._conn is None and not self._disabled:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    "key TEXT PRIMARY KEY, value TEXT, ts REAL, ttl REAL, expires_at REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires_at)")
+                self._conn = conn
+            except (sqlite3.Error, OSError):
+                # 只读文件系统等情况下关闭磁盘层，不影响内存缓存
+                self._disabled = True
+        return self._conn
+
+    def get(self, key):
+        """返回 (data, ts, ttl, expires_at)，不存在或已过期返回 None"""
+        now = time.time()
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            row = pending
+        else:
+            with self._lock:
+                conn = self._connect()
+                if conn is None:
+                    return None
+                try:
+                    row = conn.execute(
+                        "SELECT value, ts, ttl, expires_at FROM cache WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error:
+                    return None
+            if row is None:
+                return None
+        value, ts, ttl, expires_at = row
+        if expires_at <= now:
+            return None
+        try:
+            return json.loads(value), ts, ttl, expires_at
+        except ValueError:
+            return None
+
+    def set(self, key, data, ts, ttl, expires_at):
+        if self._disabled:
+            return
+        try:
+            value = json.dumps(data, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        with self._pending_lock:
+            self._pending[key] = (value, ts, ttl, expires_at)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="disk-cache-writer", daemon=True)
+                self._writer.start()
+        self._wakeup.set()
+
+    def flush(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO cache (key, value, ts, ttl, expires_at) VALUES (?, ?, ?, ?, ?)",
+                        [(k,) + v for k, v in batch.items()]
+                    )
+                self._writes_since_compact += len(batch)
+                if self._writes_since_compact >= max(100, self.max_entries // 10):
+                    self._compact(conn)
+            except sqlite3.Error:
+                pass
+
+    def compact(self):
+        with self._lock:
+            conn = self._connect()
+            if conn is not None:
+                try:
+                    self._compact(conn)
+                except sqlite3.Error:
+                    pass
+
+    def _compact(self, conn):
+        self._writes_since_compact = 0
+        with conn:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            overflow = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)",
+                    (overflow,)
+                )
+        conn.execute("PRAGMA incremental_vacuum")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # 攒一小段时间再批量写入
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+# ==========================================
+# 进程间共享缓存
+# ==========================================
+
+def _send_frame(sock, header, body=b""):
+    """帧格式：头长度、体长度（各 4 字节）+ JSON 头 + 原始体"""
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(struct.pack("!II", len(head), len(body)) + head + body)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock):
+    """返回 (header, body)，对端关闭返回 None"""
+    prefix = _recv_exact(sock, 8)
+    if prefix is None:
+        return None
+    head_len, body_len = struct.unpack("!II", prefix)
+    head = _recv_exact(sock, head_len)
+    body = _recv_exact(sock, body_len) if body_len else b""
+    if head is None or body is None:
+        return None
+    return json.loads(head), body
+
+
+class SharedCacheStore:
+    """守护进程内的存储：值为 JSON 字节，另维护回源租约实现跨进程 single-flight
+
+    lease：key 在 ttl 内有新值时直接返回；否则无人回源则授予租约，有人回源则等待其 set/release。
+    持有者进程退出时租约在 SINGLE_FLIGHT_TIMEOUT 后过期，由下一个等待方接手。
+    """
+
+    def __init__(self, max_entries=SHARED_CACHE_MAX_ENTRIES, max_bytes=SHARED_CACHE_MAX_BYTES):
+        self.cache = TTLCache(max_entries=max_entries, max_bytes=max_bytes)
+        self._leases = {}  # key -> (过期时间, 租约编号)
+        self._failed = {}  # key -> (租约编号, 错误信息)
+        self._tokens = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def dispatch(self, header, body):
+        op = header.get("op")
+        key = header.get("key", "")
+        if op == "get":
+            return self._entry(key)
+        if op == "set":
+            ts, ttl, stale_ttl = header["ts"], header["ttl"], header["stale_ttl"]
+            self.cache.set(key, (body, stale_ttl), ttl=ttl, stale_ttl=stale_ttl, ts=ts)
+            with self._cond:
+                self._leases.pop(key, None)
+                self._failed.pop(key, None)
+                self._cond.notify_all()
+            return {"ok": True}, b""
+        if op == "lease":
+            return self._lease(key, header.get("ttl") or CACHE_TTL, header.get("wait", SINGLE_FLIGHT_TIMEOUT))
+        if op == "release":
+            with self._cond:
+                lease = self._leases.pop(key, None)
+                if lease is not None and header.get("error"):
+                    self._failed[key] = (lease[1], header["error"])
+                self._cond.notify_all()
+            return {"ok": True}, b""
+        if op == "stats":
+            with self._cond:
+                leases = len(self._leases)
+            return dict(self.cache.stats(), leases=leases), b""
+        return {"error": f"未知操作: {op}"}, b""
+
+    def _entry(self, key, max_age=None):
+        entry = self.cache.peek(key)
+        if entry is None:
+            return {"found": False}, b""
+        (body, stale_ttl), age, ttl = entry
+        if max_age is not None and age >= min(max_age, ttl):
+            return {"found": False}, b""
+        return {"found": True, "ts": time.time() - age, "ttl": ttl, "stale_ttl": stale_ttl}, body
+
+    def _lease(self, key, ttl, wait):
+        deadline = time.time() + min(wait, SINGLE_FLIGHT_TIMEOUT)
+        waited = None
+        with self._cond:
+            while True:
+                header, body = self._entry(key, max_age=ttl)
+                if header["found"]:
+                    return header, body
+                failed = self._failed.get(key)
+                if waited is not None and failed is not None and failed[0] == waited:
+                    return {"found": False, "error": failed[1]}, b""
+                now = time.time()
+                lease = self._leases.get(key)
+                if lease is None or lease[0] <= now:
+                    self._leases[key] = (now + SINGLE_FLIGHT_TIMEOUT, next(self._tokens))
+                    self._failed.pop(key, None)
+                    return {"found": False, "lease": True}, b""
+                if now >= deadline:
+                    return {"found": False, "lease": False}, b""
+                waited = lease[1]
+                self._cond.wait(min(deadline, lease[0]) - now)
+
+
+class _SharedCacheHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        store = self.server.store
+        while True:
+            try:
+                frame = _recv_frame(self.request)
+            except (OSError, ValueError, struct.error):
+                return
+            if frame is None:
+                return
+            header, body = store.dispatch(*frame)
+            try:
+                _send_frame(self.request, header, body)
+            except OSError:
+                return
+
+
+class SharedCacheServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, path, store=None):
+        self.store = store or SharedCacheStore()
+        if os.path.exists(path):
+            os.unlink(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        super().__init__(path, _SharedCacheHandler)
+
+
+def run_shared_cache(path):
+    """运行共享缓存守护进程，SIGTERM/SIGINT 时退出"""
+    server = SharedCacheServer(path)
+
+    def _stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class SharedCache:
+    """共享缓存客户端，每个线程一条长连接
+
+    接口与 DiskCache 对齐：get 返回 (data, ts, ttl, expires_at)。
+    连不上守护进程时所有操作立即返回未命中，SHARED_CACHE_RETRY 秒后再尝试连接；
+    单次调用超时或连接中断只丢弃当前线程的连接。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._down_until = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _call(self, header, body=b"", timeout=SHARED_CACHE_TIMEOUT):
+        if time.time() < self._down_until:
+            return None
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(SHARED_CACHE_TIMEOUT)
+                sock.connect(self.path)
+            except OSError:
+                # 只有连不上守护进程时才整体回退为独立缓存
+                self.errors += 1
+                sock.close()
+                self._down_until = time.time() + SHARED_CACHE_RETRY
+                return None
+            self._local.sock = sock
+        try:
+            sock.settimeout(timeout)
+            _send_frame(sock, header, body)
+            frame = _recv_frame(sock)
+            if frame is None:
+                raise ConnectionError("共享缓存连接已关闭")
+            return frame
+        except (OSError, ValueError, struct.error):
+            # 超时后连接上可能残留旧响应，只丢弃本线程的连接，下次调用重连
+            self.errors += 1
+            sock.close()
+            self._local.sock = None
+            return None
+
+    @staticmethod
+    def _decode(frame):
+        header, body = frame
+        if not header.get("found"):
+            return None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        ts, ttl = header["ts"], header["ttl"]
+        return data, ts, ttl, ts + ttl + header["stale_ttl"]
+
+    def get(self, key):
+        frame = self._call({"op": "get", "key": key})
+        stored = self._decode(frame) if frame else None
+        if stored is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return stored
+
+    def set(self, key, data, ts, ttl, expires_at):
+        try:
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        except (TypeError, ValueError):
+            return
+        self._call({"op": "set", "key": key, "ts": ts, "ttl": ttl, "stale_ttl": expires_at - ts - ttl}, body)
+
+    def lease(self, key, ttl):
+        """跨进程回源租约，返回 (是否取得租约, 已有的新值)
+
+        其他进程回源失败时抛出 RuntimeError；守护进程不可用或等待超时返回 (False, None)，由调用方自行回源。
+        """
+        frame = self._call(
+            {"op": "lease", "key": key, "ttl": ttl, "wait": SINGLE_FLIGHT_TIMEOUT},
+            timeout=SINGLE_FLIGHT_TIMEOUT + SHARED_CACHE_TIMEOUT
+        )
+        if frame is None:
+            return False, None
+        header = frame[0]
+        if header.get("error"):
+            raise RuntimeError(header["error"])
+        return bool(header.get("lease")), self._decode(frame)
+
+    def release(self, key, error=None):
+        self._call({"op": "release", "key": key, "error": error})
+
+    def stats(self):
+        frame = self._call({"op": "stats"})
+        return frame[0] if frame else None
+
+
+CACHE = TTLCache(on_evict=lambda key: METRICS.cache_event(key, "evict"))
+DISK_CACHE = DiskCache(os.path.join(CACHE_DIR, "cache.sqlite3")) if DISK_CACHE_ENABLED else None
+if DISK_CACHE is not None:
+    atexit.register(DISK_CACHE.flush)
+SHARED_CACHE = SharedCache(SHARED_CACHE_SOCKET) if SHARED_CACHE_SOCKET else None
+
+
+def _fill_cache(key, stored):
+    """把共享缓存/磁盘中读到的条目回填内存，返回 (data, age, ttl)"""
+    data, ts, ttl, expires_at = stored
+    CACHE.set(key, data, ttl=ttl, stale_ttl=expires_at - ts - ttl, ts=ts)
+    return data, time.time() - ts, ttl
+
+
+def _peek_cache(key):
+    """内存 → 进程间共享缓存 → 磁盘，命中下层时回填上层；返回 (data, age, ttl)"""
+    entry = CACHE.peek(key)
+    if entry is not None:
+        return entry
+    if SHARED_CACHE is not None:
+        stored = SHARED_CACHE.get(key)
+        if stored is not None:
+            METRICS.cache_event(key, "shared")
+            return _fill_cache(key, stored)
+    if DISK_CACHE is not None:
+        stored = DISK_CACHE.get(key)
+        if stored is not None:
+            if SHARED_CACHE is not None:
+                SHARED_CACHE.set(key, *stored)
+            return _fill_cache(key, stored)
+    return None
+
+
+def get_cache(key, ttl=None):
+    entry = _peek_cache(key)
+    if entry is None:
+        METRICS.cache_event(key, "miss")
+        _trace_event(key, "cache", result="miss")
+        return None
+    data, age, entry_ttl = entry
+    if age < min(ttl or CACHE_TTL, entry_ttl):
+        METRICS.cache_event(key, "hit")
+        _trace_event(key, "cache", result="hit", age=round(age, 1))
+        return data
+    METRICS.cache_event(key, "miss")
+    _trace_event(key, "cache", result="miss")
+    return None
+
+
+def set_cache(key, data, ttl=None, stale_ttl=0):
+    ttl = ttl or CACHE_TTL
+    METRICS.cache_event(key, "set")
+    ts = time.time()
+    CACHE.set(key, data, ttl=ttl, stale_ttl=stale_ttl, ts=ts)
+    if SHARED_CACHE is not None:
+        SHARED_CACHE.set(key, data, ts, ttl, ts + ttl + (stale_ttl or 0))
+    if DISK_CACHE is not None and ttl >= DISK_CACHE_MIN_TTL:
+        DISK_CACHE.set(key, data, ts, ttl, ts + ttl + (stale_ttl or 0))
+
+
+# ==========================================
+# 回源合并（single-flight）
+# ==========================================
+
+class SingleFlight:
+    """同一 key 同时只有一个回源请求，其余调用方等待并共享结果/异常"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=SINGLE_FLIGHT_TIMEOUT):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent_futures.Future()
+        if not leader:
+            # 超时抛出 TimeoutError，回源异常原样抛给每个等待方
+            return future.result(timeout=timeout)
+        try:
+            result = fn()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do_many(self, keys, fn, timeout=SINGLE_FLIGHT_TIMEOUT):
+        """多个 key 一次回源：只为尚无人回源的 key 调用 fn(这些 key)，fn 返回 {key: 结果}
+
+        其余 key 等待已有回源（含 do 发起的同 key 回源）的结果；返回 {key: 结果}，
+        fn 未给出或等待失败的 key 不在返回值中。
+        """
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._calls.get(key)
+                if future is None:
+                    owned[key] = self._calls[key] = concurrent_futures.Future()
+                else:
+                    waiting[key] = future
+        results = {}
+        try:
+            loaded = fn(list(owned)) if owned else {}
+            for key, future in owned.items():
+                future.set_result(loaded.get(key))
+                if loaded.get(key) is not None:
+                    results[key] = loaded[key]
+        except Exception as e:
+            for future in owned.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for key in owned:
+                    self._calls.pop(key, None)
+        for key, future in waiting.items():
+            try:
+                result = future.result(timeout=timeout)
+            except Exception:
+                continue
+            if result is not None:
+                results[key] = result
+        return results
+
+
+SINGLE_FLIGHT = SingleFlight()
+
+
+_REFRESH_EXECUTOR = None  # 首次后台刷新时创建
+_REFRESHING = set()
+_REFRESHING_LOCK = threading.Lock()
+
+
+def _is_cacheable(result):
+    if isinstance(result, dict):
+        return bool(result.get("success"))
+    return result is not None
+
+
+def _mark_stale(data, age):
+    """旧值返回前标记数据年龄（秒），不修改缓存中的对象"""
+    if isinstance(data, dict):
+        data = dict(data)
+        data["_stale"] = True
+        data["_age"] = round(age)
+    return data
+
+
+def _load_and_store(cache_key, ttl, loader, stale_ttl):
+    """回源并写缓存；启用共享缓存时先取跨进程租约，同一 key 只由一个进程回源"""
+    if SHARED_CACHE is None:
+        return _load_local(cache_key, ttl, loader, stale_ttl)
+    leased, stored = SHARED_CACHE.lease(cache_key, ttl)
+    if stored is not None:
+        _trace_event(cache_key, "cache", result="shared")
+        return _fill_cache(cache_key, stored)[0]
+    if not leased:
+        # 守护进程不可用或等待超时，本进程自行回源
+        return _load_local(cache_key, ttl, loader, stale_ttl)
+    try:
+        result = _load_local(cache_key, ttl, loader, stale_ttl)
+    except Exception as e:
+        SHARED_CACHE.release(cache_key, str(e) or type(e).__name__)
+        raise
+    if not _is_cacheable(result):
+        # 失败结果不共享，等待方接手回源
+        SHARED_CACHE.release(cache_key)
+    return result
+
+
+def _load_local(cache_key, ttl, loader, stale_ttl):
+    result = loader()
+    if _is_cacheable(result):
+        set_cache(cache_key, result, ttl=ttl, stale_ttl=stale_ttl)
+    return result
+
+
+def _refresh_executor():
+    global _REFRESH_EXECUTOR
+    with _REFRESHING_LOCK:
+        if _REFRESH_EXECUTOR is None:
+            _REFRESH_EXECUTOR = concurrent_futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+        return _REFRESH_EXECUTOR
+
+
+def _schedule_refresh(cache_key, ttl, loader, stale_ttl):
+    with _REFRESHING_LOCK:
+        if cache_key in _REFRESHING:
+            return
+        _REFRESHING.add(cache_key)
+
+    def _refresh():
+        try:
+            SINGLE_FLIGHT.do(cache_key, lambda: _load_and_store(cache_key, ttl, loader, stale_ttl))
+        except Exception:
+            # 后台刷新失败保留旧值，等待下次请求重试
+            pass
+        finally:
+            with _REFRESHING_LOCK:
+                _REFRESHING.discard(cache_key)
+
+    _refresh_executor().submit(_refresh)
+
+
+def _cached_call(cache_key, ttl, loader, stale_ttl=None, data_class=None):
+    """读缓存，未命中时经 single-flight 回源并写缓存
+
+    软过期（ttl）后、硬过期（ttl + stale_ttl）前直接返回旧值并后台刷新。
+    data_class 不为空时 ttl 按交易时段换算（见 MarketCalendar.ttl），旧值窗口仍按原 ttl 计算。
+    loader 返回失败结果（success=False 或 None）时不写缓存。
+    """
+    if stale_ttl is None:
+        stale_ttl = ttl * CACHE_STALE_RATIO
+    if data_class:
+        ttl = MARKET_CALENDAR.ttl(data_class, ttl)
+    entry = _peek_cache(cache_key)
+    if entry is not None:
+        data, age, entry_ttl = entry
+        if age < min(ttl, entry_ttl):
+            METRICS.cache_event(cache_key, "hit")
+            _trace_event(cache_key, "cache", result="hit", age=round(age, 1))
+            _CACHED_RESULT.set(data)
+            return data
+        if stale_ttl:
+            METRICS.cache_event(cache_key, "stale")
+            _trace_event(cache_key, "cache", result="stale", age=round(age, 1))
+            _schedule_refresh(cache_key, ttl, loader, stale_ttl)
+            return _mark_stale(data, age)
+    METRICS.cache_event(cache_key, "miss")
+    span = _trace_start(cache_key, "cache", result="miss")
+    try:
+        data = _cached_load(cache_key, ttl, loader, stale_ttl)
+    finally:
+        _trace_end(span)
+    _CACHED_RESULT.set(data)
+    return data
+
+
+def _cached_load(cache_key, ttl, loader, stale_ttl):
+
+    def _load():
+        # 排队期间可能已有其他请求写入缓存（不再重复计入命中统计）
+        entry = _peek_cache(cache_key)
+        if entry is not None and entry[1] < min(ttl, entry[2]):
+            return entry[0]
+        return _load_and_store(cache_key, ttl, loader, stale_ttl)
+
+    return SINGLE_FLIGHT.do(cache_key, _load)
+
+
+# ==========================================
+# 交易日历与缓存时效
+# ==========================================
+
+class MarketCalendar:
+    """A 股交易日历（周末 + 本地节假日文件）与交易时段
+
+    按数据类别换算有效缓存时长：
+    - realtime：估值、指数、个股涨跌，盘中（含前后 MARKET_CLOSE_GRACE 分钟）用原 ttl，休市（午休/收盘/节假日）到下一次开盘
+    - nav：含净值的数据，同 realtime，但交易日晚间净值发布窗口内每 NAV_PUBLISH_TTL 刷新
+    - daily：按日变化的排行、连涨连跌等，同 realtime
+    """
+
+    SESSIONS = ((9 * 60 + 30, 11 * 60 + 30), (13 * 60, 15 * 60))
+
+    def __init__(self, path):
+        self.path = path
+        self._holidays = None
+
+    def _load(self):
+        holidays = set()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            for year, days in stored.items():
+                if year.isdigit():
+                    holidays.update(int(day.replace("-", "")) for day in days)
+        except (OSError, ValueError, AttributeError):
+            # 日历缺失时只按周末判断
+            pass
+        self._holidays = holidays
+
+    def is_trading_day(self, day):
+        """day 为 date"""
+        if self._holidays is None:
+            self._load()
+        return day.weekday() < 5 and day.year * 10000 + day.month * 100 + day.day not in self._holidays
+
+    @staticmethod
+    def _cst(timestamp):
+        """(北京时间日期, 当日分钟数, 当日零点对应的时间戳)"""
+        cst = timestamp + 8 * 3600
+        midnight = cst - cst % 86400
+        return date(1970, 1, 1) + timedelta(days=int(cst // 86400)), (cst % 86400) / 60, midnight - 8 * 3600
+
+    def is_open(self, timestamp=None, margin=0):
+        """是否处于连续交易时段，margin 为前后放宽的分钟数"""
+        day, minute, _ = self._cst(timestamp or time.time())
+        if not self.is_trading_day(day):
+            return False
+        return any(start - margin <= minute < end + margin for start, end in self.SESSIONS)
+
+    def next_open(self, timestamp=None):
+        """下一个交易时段开始的时间戳（当前处于交易时段时为其后的时段）"""
+        timestamp = timestamp or time.time()
+        day, minute, midnight = self._cst(timestamp)
+        if self.is_trading_day(day):
+            for start, _ in self.SESSIONS:
+                if minute < start:
+                    return midnight + start * 60
+        for offset in range(1, 31):
+            day += timedelta(days=1)
+            if self.is_trading_day(day):
+                return midnight + offset * 86400 + self.SESSIONS[0][0] * 60
+        return timestamp + MARKET_OFFHOURS_MAX_TTL
+
+    def ttl(self, data_class, base, timestamp=None):
+        timestamp = timestamp or time.time()
+        if self.is_open(timestamp, margin=MARKET_CLOSE_GRACE):
+            return base
+        until = self.next_open(timestamp) - timestamp
+        if data_class == "nav":
+            day, minute, midnight = self._cst(timestamp)
+            if self.is_trading_day(day) and minute >= self.SESSIONS[-1][1]:
+                window_start, window_end = NAV_PUBLISH_WINDOW
+                if minute < window_start:
+                    until = midnight + window_start * 60 - timestamp
+                elif minute < window_end:
+                    return max(base, NAV_PUBLISH_TTL)
+        return int(max(base, min(until, MARKET_OFFHOURS_MAX_TTL)))
+
+
+MARKET_CALENDAR = MarketCalendar(MARKET_CALENDAR_FILE)
+
+
+# ==========================================
+# 上游并发控制
+# ==========================================
+
+class UpstreamBusy(Exception):
+    """单主机排队过长或等待超时；_http_get 转为 requests.ConnectionError，按上游失败处理
+
+    不直接继承 requests.RequestException，以免导入本模块时就加载 requests。
+    """
+
+
+class _HostSlot:
+    __slots__ = ("semaphore", "waiters", "acquired", "rejected", "wait", "wait_max")
+
+    def __init__(self, limit):
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.waiters = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.wait = Histogram()  # 取得并发名额前的等待时间
+        self.wait_max = 0.0
+
+
+class UpstreamExecutor:
+    """进程级共享的上游执行器
+
+    - 所有扇出任务复用一个线程池，不再每个请求新建/销毁线程
+    - 每个上游主机一个信号量，限制同时在途的请求数与排队长度
+    - 等待结果时由调用线程代跑尚未开始的任务，嵌套扇出不会占满线程池而死锁
+    - 线程池积压超过 UPSTREAM_MAX_QUEUE 时任务直接在调用线程执行（背压）
+    """
+
+    def __init__(self, max_workers=UPSTREAM_MAX_WORKERS, max_queue=UPSTREAM_MAX_QUEUE):
+        self.max_queue = max_queue
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._tasks = {}
+        self._queued = 0
+        self.submitted = 0
+        self.inline = 0
+        self.queue_wait = Histogram()  # 任务从提交到开始执行的等待时间（不含背压时直接执行的任务）
+        self.queue_wait_max = 0.0
+
+    # ---- 任务调度 ----
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent_futures.Future()
+        if _TRACE.get() is not None:
+            fn = _traced_task(fn)
+        task = (fn, args, kwargs, time.perf_counter())
+        with self._lock:
+            self.submitted += 1
+            overloaded = self._queued >= self.max_queue
+            if not overloaded:
+                self._queued += 1
+                self._tasks[future] = task
+        if overloaded:
+            with self._lock:
+                self.inline += 1
+            self._execute(future, task)
+        else:
+            self._executor().submit(self._run_queued, future)
+        return future
+
+    def _executor(self):
+        # 首次提交任务时才创建线程池
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = concurrent_futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="upstream"
+                    )
+        return self._pool
+
+    def run_pending(self, future):
+        """任务尚未被线程池取走时在当前线程执行"""
+        self._run_queued(future)
+
+    def wait(self, futures, timeout=None):
+        """等待一组任务完成；尚未被线程池取走的任务由当前线程直接执行"""
+        futures = list(futures)
+        for future in futures:
+            self._run_queued(future)
+        concurrent_futures.wait(futures, timeout=timeout)
+        return futures
+
+    def map(self, fn, items):
+        futures = [self.submit(fn, item) for item in items]
+        self.wait(futures)
+        return [future.result() for future in futures]
+
+    def _run_queued(self, future):
+        with self._lock:
+            task = self._tasks.pop(future, None)
+            if task is None:
+                return
+            self._queued -= 1
+            waited = time.perf_counter() - task[3]
+            self.queue_wait.observe(waited)
+            self.queue_wait_max = max(self.queue_wait_max, waited)
+        self._execute(future, task)
+
+    @staticmethod
+    def _execute(future, task):
+        fn, args, kwargs, _ = task
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    # ---- 单主机限流 ----
+
+    def _host(self, host):
+        slot = self._hosts.get(host)
+        if slot is None:
+            with self._lock:
+                slot = self._hosts.get(host)
+                if slot is None:
+                    limit = UPSTREAM_HOST_LIMITS.get(host, UPSTREAM_HOST_DEFAULT_LIMIT)
+                    slot = self._hosts[host] = _HostSlot(limit)
+        return slot
+
+    @contextmanager
+    def host_slot(self, host):
+        slot = self._host(host)
+        with self._lock:
+            if slot.waiters >= UPSTREAM_HOST_MAX_WAITERS:
+                slot.rejected += 1
+                raise UpstreamBusy(f"上游排队过长: {host}")
+            slot.waiters += 1
+        start = time.perf_counter()
+        acquired = slot.semaphore.acquire(timeout=UPSTREAM_HOST_WAIT_TIMEOUT)
+        waited = time.perf_counter() - start
+        with self._lock:
+            slot.waiters -= 1
+            if acquired:
+                slot.acquired += 1
+                slot.wait.observe(waited)
+                slot.wait_max = max(slot.wait_max, waited)
+            else:
+                slot.rejected += 1
+        if not acquired:
+            raise UpstreamBusy(f"等待上游连接超时: {host}")
+        try:
+            yield
+        finally:
+            slot.semaphore.release()
+
+    def wait_histograms(self):
+        """(线程池排队等待直方图, {主机: 并发名额等待直方图}) 的快照"""
+        with self._lock:
+            return (
+                _copy_histogram(self.queue_wait),
+                {host: _copy_histogram(slot.wait) for host, slot in self._hosts.items()},
+            )
+
+    def stats(self):
+        with self._lock:
+            dequeued = self.submitted - self.inline - self._queued
+            return {
+                "submitted": self.submitted,
+                "inline": self.inline,
+                "queued": self._queued,
+                "queue_wait_avg_ms": round(self.queue_wait.sum / dequeued * 1000, 2) if dequeued else 0,
+                "queue_wait_max_ms": round(self.queue_wait_max * 1000, 2),
+                "hosts": {
+                    host: {
+                        "waiting": slot.waiters,
+                        "acquired": slot.acquired,
+                        "rejected": slot.rejected,
+                        "wait_avg_ms": round(slot.wait.sum / slot.acquired * 1000, 2) if slot.acquired else 0,
+                        "wait_max_ms": round(slot.wait_max * 1000, 2),
+                    }
+                    for host, slot in self._hosts.items()
+                },
+            }
+
+
+def _traced_task(fn):
+    """在提交方的上下文中执行任务，并记录排队等待与执行耗时"""
+    context = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def _run(*args, **kwargs):
+        # 任务图节点以节点名标记，其余取函数名
+        if isinstance(getattr(fn, "__self__", None), TaskGraph):
+            name = f"node:{args[0]}"
+        else:
+            name = getattr(fn, "__name__", "task")
+
+        def _inner():
+            span = _trace_start(name, "task", queue_ms=round((time.perf_counter() - submitted) * 1000, 1))
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _trace_end(span)
+        return context.run(_inner)
+
+    return _run
+
+
+UPSTREAM = UpstreamExecutor()
+
+
+def _override_upstream(url, parsed, host):
+    """按 UPSTREAM_OVERRIDES 改写上游地址；并发名额与指标仍按原主机计"""
+    base = UPSTREAM_OVERRIDES.get(host)
+    if base is None:
+        base = UPSTREAM_OVERRIDES.get("*")
+        if base is None:
+            return url
+        base = f"{base.rstrip('/')}/{host}"
+    rewritten = base.rstrip("/") + parsed.path
+    return f"{rewritten}?{parsed.query}" if parsed.query else rewritten
+
+
+def _http_get(url, **kwargs):
+    """上游 GET 统一出口，按主机占用并发名额并记录耗时
+
+    指标的 action 取天天基金的 action_name，其他主机取路径（长数字替换为 :n，避免基金代码撑爆标签）。
+    """
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    action = (kwargs.get("params") or {}).get("action_name") or _METRIC_PATH_NUMBERS.sub(":n", parsed.path)
+    if UPSTREAM_OVERRIDES:
+        url = _override_upstream(url, parsed, host)
+    span = _trace_start(action, "http", host=host)
+    start = time.perf_counter()
+    try:
+        with UPSTREAM.host_slot(host):
+            resp = SESSION.get(url, **kwargs)
+    except UpstreamBusy as e:
+        METRICS.observe_upstream(host, action, 0, "rejected")
+        _trace_end(span, error=str(e))
+        raise requests.ConnectionError(str(e)) from e
+    except requests.Timeout as e:
+        METRICS.observe_upstream(host, action, time.perf_counter() - start, "timeout")
+        _trace_end(span, error=f"timeout: {e}")
+        raise
+    except requests.RequestException as e:
+        METRICS.observe_upstream(host, action, time.perf_counter() - start, "error")
+        _trace_end(span, error=str(e))
+        raise
+    outcome = "error" if resp.status_code >= 400 else "ok"
+    METRICS.observe_upstream(host, action, time.perf_counter() - start, outcome)
+    if span is not None:
+        _trace_end(span, status=resp.status_code, bytes=len(resp.content))
+    return resp
+
+
+def prewarm_upstream(hosts=UPSTREAM_PREWARM_HOSTS):
+    """后台导入 requests、创建会话，并向 hosts 并行发一次 HEAD 请求，建立的 TLS 连接留在连接池中供首批请求复用
+
+    参数与各处 _http_get 一致（verify=False），取到的是同一个连接池；失败静默忽略。
+    """
+
+    def _connect(host):
+        try:
+            SESSION.head(f"https://{host}/", timeout=5, verify=False, allow_redirects=False)
+        except Exception:
+            pass
+
+    def _run():
+        SESSION.session
+        if UPSTREAM_OVERRIDES:
+            return
+        threads = [threading.Thread(target=_connect, args=(host,), daemon=True) for host in hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+    thread = threading.Thread(target=_run, name="upstream-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+# ==========================================
+# 回源容错：对冲请求与熔断
+# ==========================================
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却期内跳过该上游；冷却结束放行一次探测"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.failure_threshold:
+            return "closed"
+        if time.time() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+
+class LatencyTracker:
+    """记录最近 N 次成功请求耗时，用于计算对冲等待时间"""
+
+    def __init__(self, size=100):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+BREAKERS = {}
+LATENCIES = {}
+_RESILIENCE_LOCK = threading.Lock()
+
+
+def _breaker(name):
+    with _RESILIENCE_LOCK:
+        if name not in BREAKERS:
+            BREAKERS[name] = CircuitBreaker(name)
+            LATENCIES[name] = LatencyTracker()
+        return BREAKERS[name]
+
+
+def _is_valid_result(result):
+    if isinstance(result, dict):
+        return bool(result.get("success"))
+    return result is not None
+
+
+class FallbackChain:
+    """按顺序尝试多个上游，取最先返回的有效结果
+
+    - 前一个上游失败立即启动下一个；超过其 p95 延迟仍未返回则并行启动下一个（对冲）
+    - 每个上游独立熔断，熔断期间直接跳过；上游正常响应但该代码无数据（结果带 missing）不计为失败
+    - 全部失败时返回最后一个失败结果
+    """
+
+    def __init__(self, name, attempts):
+        self.name = name
+        self.attempts = attempts
+        for upstream, _ in attempts:
+            _breaker(upstream)
+
+    def _hedge_delay(self, upstream):
+        tracker = LATENCIES[upstream]
+        if len(tracker) < 20:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, tracker.percentile(95)))
+
+    @staticmethod
+    def _attempt(upstream, fn, args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            BREAKERS[upstream].record_failure()
+            raise
+        if _is_valid_result(result):
+            BREAKERS[upstream].record_success()
+            LATENCIES[upstream].record(time.perf_counter() - start)
+        elif isinstance(result, dict) and result.get("missing"):
+            BREAKERS[upstream].record_success()
+        else:
+            BREAKERS[upstream].record_failure()
+        return result
+
+    def _next_allowed(self, start):
+        """从 start 起第一个熔断器放行的上游下标；只在真正发起请求时才占用半开探测名额"""
+        for index in range(start, len(self.attempts)):
+            if BREAKERS[self.attempts[index][0]].allow():
+                return index
+        return len(self.attempts)
+
+    def run(self, *args):
+        last_result = None
+        pending = set()
+        next_index = 0
+        current = None
+        launch_next = True
+        while True:
+            if launch_next and next_index < len(self.attempts):
+                index = self._next_allowed(next_index)
+                if index < len(self.attempts):
+                    current, fn = self.attempts[index]
+                    pending.add(UPSTREAM.submit(self._attempt, current, fn, args))
+                next_index = index + 1
+            if not pending:
+                break
+            timeout = None
+            if next_index < len(self.attempts):
+                timeout = self._hedge_delay(current)
+            else:
+                # 不再对冲：仍在排队的任务由当前线程执行，避免线程池饱和时空等
+                for future in pending:
+                    UPSTREAM.run_pending(future)
+            done, pending = concurrent_futures.wait(
+                pending, timeout=timeout, return_when=concurrent_futures.FIRST_COMPLETED
+            )
+            # 超时（对冲）或已完成的都失败时，启动下一个上游
+            launch_next = True
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"success": False, "message": str(e)}
+                if _is_valid_result(result):
+                    return result
+                last_result = result
+        if current is None:
+            return {"success": False, "message": "上游暂不可用（熔断中）"}
+        return last_result or {"success": False, "message": "上游返回为空"}
+
+
+# ==========================================
+# 请求内任务图
+# ==========================================
+
+class TaskGraph:
+    """请求内的小型依赖图执行器
+
+    无依赖节点在 t=0 同时启动，依赖全部完成后立即启动后继；
+    节点函数按 deps 顺序接收依赖结果，依赖失败则后继直接失败。
+    run() 返回 {name: 结果或异常}，timings() 给出各节点耗时与关键路径。
+    """
+
+    def __init__(self):
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, deps=()):
+        self._nodes[name] = (fn, tuple(deps))
+        return self
+
+    def run(self):
+        self._t0 = time.perf_counter()
+        self._done = {name: concurrent_futures.Future() for name in self._nodes}
+        self._tasks = []
+        self._spans = {}
+        self._remaining = {name: set(deps) for name, (_, deps) in self._nodes.items()}
+        for name, deps in list(self._remaining.items()):
+            if not deps:
+                self._launch(name)
+        pending = set(self._done.values())
+        while pending:
+            # 线程池繁忙时由当前线程执行尚未开始的节点
+            with self._lock:
+                tasks = list(self._tasks)
+            for task in tasks:
+                UPSTREAM.run_pending(task)
+            _, pending = concurrent_futures.wait(pending, return_when=concurrent_futures.FIRST_COMPLETED)
+        results = {}
+        for name, future in self._done.items():
+            error = future.exception()
+            results[name] = error if error is not None else future.result()
+        return results
+
+    def _launch(self, name):
+        task = UPSTREAM.submit(self._run_node, name)
+        with self._lock:
+            self._tasks.append(task)
+
+    def _run_node(self, name):
+        fn, deps = self._nodes[name]
+        start = time.perf_counter()
+        error = result = None
+        try:
+            args = [self._done[dep].result() for dep in deps]
+            result = fn(*args)
+        except Exception as e:
+            error = e
+        # 先记录耗时再完成 future，run() 返回后 timings() 不会漏掉最后一个节点
+        with self._lock:
+            self._spans[name] = (start - self._t0, time.perf_counter() - self._t0)
+        if error is not None:
+            self._done[name].set_exception(error)
+        else:
+            self._done[name].set_result(result)
+        ready = []
+        with self._lock:
+            for child, waiting in self._remaining.items():
+                if name in waiting:
+                    waiting.discard(name)
+                    if not waiting:
+                        ready.append(child)
+        for child in ready:
+            self._launch(child)
+
+    def timings(self):
+        """各节点起止（毫秒，相对 t=0）及关键路径"""
+        with self._lock:
+            spans = dict(self._spans)
+        nodes = {
+            name: {"start": round(start * 1000), "ms": round((end - start) * 1000)}
+            for name, (start, end) in spans.items()
+        }
+        path = []
+        current = max(spans, key=lambda n: spans[n][1], default=None)
+        while current is not None:
+            path.append(current)
+            deps = [d for d in self._nodes[current][1] if d in spans]
+            current = max(deps, key=lambda d: spans[d][1], default=None)
+        total = max((end for _, end in spans.values()), default=0)
+        return {"nodes": nodes, "critical_path": path[::-1], "total_ms": round(total * 1000)}
+
+
+def _safe_json(resp):
+    try:
+        return resp.json()
+    except (ValueError, json.JSONDecodeError):
+        return None
+
+
+def _tiantian_action(action_name, params=None, timeout=8):
+    span = _trace_start(f"tiantian:{action_name}", "action")
+    try:
+        data, err = _tiantian_request(action_name, params, timeout)
+    finally:
+        _trace_end(span)
+    if span is not None and err:
+        span[0]["error"] = err
+    return data, err
+
+
+def _tiantian_request(action_name, params, timeout):
+    request_params = {"action_name": action_name}
+    if params:
+        request_params.update(params)
+    try:
+        resp = _http_get(
+            TIANTIAN_API_BASE,
+            params=request_params,
+            timeout=timeout,
+            verify=False
+        )
+    except requests.RequestException as e:
+        return None, str(e)
+    data = _safe_json(resp)
+    if data is None:
+        return None, "上游返回非JSON"
+    if isinstance(data, dict):
+        err_code = data.get("ErrCode")
+        if err_code not in (None, 0, "0", ""):
+            return None, data.get("ErrMsg") or "上游返回错误"
+    return data, None
+
+
+def _fetch_fund_gz(code):
+    url = f"https://fundgz.1234567.com.cn/js/{code}.js"
+    try:
+        resp = _http_get(url, timeout=5, verify=False)
+        match = re.search(r'jsonpgz\((.*)\)', resp.text)
+        if not match:
+            return None, "未找到基金"
+        if not match.group(1).strip():
+            # jsonpgz(); 表示该基金没有估值（如货币、QDII），上游本身正常
+            return {}, "暂无估值数据"
+        data = json.loads(match.group(1))
+        return {
+            "code": data.get("fundcode", code),
+            "name": data.get("name", ""),
+            "nav": data.get("dwjz", ""),
+            "nav_date": data.get("jzrq", ""),
+            "estimate_nav": data.get("gsz", ""),
+            "estimate_change": data.get("gszzl", "0"),
+            "estimate_time": data.get("gztime", ""),
+        }, None
+    except (requests.RequestException, ValueError, json.JSONDecodeError) as e:
+        return None, str(e)
+
+
+# ==========================================
+# 板块配置 - 完整的板块列表
+# ==========================================
+
+SECTOR_LIST = [
+    # 科技
+    {"name": "人工智能", "code": "BK000217", "category": "科技"},
+    {"name": "半导体", "code": "BK000054", "category": "科技"},
+    {"name": "云计算", "code": "BK000266", "category": "科技"},
+    {"name": "5G概念", "code": "BK000291", "category": "科技"},
+    {"name": "光模块", "code": "BK000651", "category": "科技"},
+    {"name": "算力", "code": "BK000601", "category": "科技"},
+    {"name": "生成式AI", "code": "BK000369", "category": "科技"},
+    {"name": "消费电子", "code": "BK000089", "category": "科技"},
+    # 新能源
+    {"name": "新能源汽车", "code": "BK000225", "category": "新能源"},
+    {"name": "光伏", "code": "BK000146", "category": "新能源"},
+    {"name": "锂电池", "code": "BK000295", "category": "新能源"},
+    {"name": "储能", "code": "BK000230", "category": "新能源"},
+    {"name": "氢能源", "code": "BK000227", "category": "新能源"},
+    {"name": "风电", "code": "BK000147", "category": "新能源"},
+    {"name": "绿色电力", "code": "BK1036", "category": "新能源"},
+    {"name": "电网设备", "code": "BK0920", "category": "新能源"},
+    # 医药健康
+    {"name": "医药", "code": "BK000090", "category": "医药健康"},
+    {"name": "医疗器械", "code": "BK000095", "category": "医药健康"},
+    {"name": "创新药", "code": "BK000315", "category": "医药健康"},
+    {"name": "中药", "code": "BK000091", "category": "医药健康"},
+    # 金融
+    {"name": "银行", "code": "BK000121", "category": "金融"},
+    {"name": "证券", "code": "BK000128", "category": "金融"},
+    {"name": "保险", "code": "BK000127", "category": "金融"},
+    # 消费
+    {"name": "食品饮料", "code": "BK000074", "category": "消费"},
+    {"name": "白酒", "code": "BK000076", "category": "消费"},
+    {"name": "家用电器", "code": "BK000066", "category": "消费"},
+    {"name": "汽车整车", "code": "BK000069", "category": "消费"},
+    # 工业制造
+    {"name": "机器人", "code": "BK000234", "category": "工业制造"},
+    {"name": "人形机器人", "code": "BK000581", "category": "工业制造"},
+    {"name": "自动驾驶", "code": "BK000279", "category": "工业制造"},
+    {"name": "智能驾驶", "code": "BK000461", "category": "工业制造"},
+    {"name": "国防军工", "code": "BK000156", "category": "工业制造"},
+    {"name": "低空经济", "code": "BK000521", "category": "工业制造"},
+    {"name": "商业航天", "code": "BK1132", "category": "工业制造"},
+    # 周期资源
+    {"name": "煤炭", "code": "BK000177", "category": "周期资源"},
+    {"name": "钢铁", "code": "BK000043", "category": "周期资源"},
+    {"name": "有色金属", "code": "BK000047", "category": "周期资源"},
+    {"name": "贵金属", "code": "BK000050", "category": "周期资源"},
+    {"name": "房地产", "code": "BK000105", "category": "周期资源"},
+    # 其他
+    {"name": "可控核聚变", "code": "BK1133", "category": "其他"},
+    {"name": "交通运输", "code": "BK000112", "category": "其他"},
+]
+
+SECTOR_ALIAS_MAP = {
+    "酿酒": "BK000076",
+    "光伏设备": "BK000146",
+    "电网设备": "BK0920",
+}
+
+
+def _map_sector_to_theme_code(sector_name):
+    if not sector_name:
+        return ""
+    for item in SECTOR_LIST:
+        if item["name"] in sector_name:
+            return item["code"]
+    for key, code in SECTOR_ALIAS_MAP.items():
+        if key in sector_name:
+            return code
+    return ""
+
+
+# ==========================================
+# 基金模块
+# ==========================================
+
+# 排除的类别：高端理财、场内基金(ETF/LOF除外)、货币基金等不支持详情查询的
+EXCLUDE_CATEGORIES = {"高端理财", "私募", "银行理财", "信托", "保险", "券商理财"}
+
+
+def _is_money_fund(category: str, ftype: str, name: str) -> bool:
+    """货币基金识别：名称/分类/类型任一命中即剔除。"""
+    category = category or ""
+    ftype = ftype or ""
+    name = name or ""
+    if "货币" in category or "货币" in ftype or "货币" in name:
+        return True
+    if "现金" in category or "现金" in ftype or "现金" in name:
+        return True
+    return False
+
+
+class FundSearchIndex:
+    """场外基金全集的内存检索索引（构建时已剔除货币基金与排除类别）
+
+    - 代码、拼音首字母、全拼：排序数组 + 二分做前缀查找
+    - 名称：双字倒排索引求交后校验子串
+    排名：代码精确 > 代码前缀 > 首字母精确 > 首字母前缀 > 名称前缀 > 全拼前缀 > 名称包含
+    """
+
+    def __init__(self, funds, built_at=None):
+        self.built_at = built_at or time.time()
+        self.funds = [
+            f for f in funds
+            if len(f["code"]) == 6
+            and f["category"] not in EXCLUDE_CATEGORIES
+            and not _is_money_fund(f["category"], f["type"], f["name"])
+        ]
+        self._code_keys = sorted((f["code"], i) for i, f in enumerate(self.funds))
+        self._initials_keys = sorted((f["initials"], i) for i, f in enumerate(self.funds) if f["initials"])
+        self._pinyin_keys = sorted((f["pinyin"], i) for i, f in enumerate(self.funds) if f["pinyin"])
+        self._bigrams = {}
+        for i, f in enumerate(self.funds):
+            name = f["name"]
+            for gram in {name[j:j + 2] for j in range(len(name) - 1)}:
+                self._bigrams.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.funds)
+
+    @staticmethod
+    def _prefix(keys, prefix):
+        start = bisect.bisect_left(keys, (prefix,))
+        end = bisect.bisect_left(keys, (prefix + "\uffff",))
+        return keys[start:end]
+
+    def _name_matches(self, keyword):
+        if len(keyword) < 2:
+            return [i for i, f in enumerate(self.funds) if keyword in f["name"]]
+        postings = [self._bigrams.get(keyword[j:j + 2], ()) for j in range(len(keyword) - 1)]
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return [i for i in candidates if keyword in self.funds[i]["name"]]
+
+    def search(self, keyword, limit=FUND_SEARCH_LIMIT):
+        keyword = keyword.strip()
+        upper = keyword.upper()
+        ranks = {}
+
+        def _rank(i, score):
+            if score < ranks.get(i, 99):
+                ranks[i] = score
+
+        if keyword.isdigit():
+            for key, i in self._prefix(self._code_keys, keyword):
+                _rank(i, 0 if key == keyword else 1)
+        if upper.isascii() and upper.isalnum():
+            for key, i in self._prefix(self._initials_keys, upper):
+                _rank(i, 2 if key == upper else 3)
+            for _, i in self._prefix(self._pinyin_keys, upper):
+                _rank(i, 5)
+        for i in self._name_matches(keyword):
+            _rank(i, 4 if self.funds[i]["name"].startswith(keyword) else 6)
+
+        best = heapq.nsmallest(limit, ranks, key=lambda i: (ranks[i], len(self.funds[i]["name"]), self.funds[i]["code"]))
+        return [
+            {
+                "code": self.funds[i]["code"],
+                "name": self.funds[i]["name"],
+                "type": self.funds[i]["type"],
+                "category": self.funds[i]["category"]
+            }
+            for i in best
+        ]
+
+
+def _fetch_fund_universe():
+    """天天基金全量基金代码表：[代码, 拼音首字母, 名称, 类型, 全拼]"""
+    url = "https://fund.eastmoney.com/js/fundcode_search.js"
+    resp = _http_get(url, timeout=15, verify=False, headers={"Referer": "https://fund.eastmoney.com/"})
+    text = resp.text.strip()
+    text = text[text.index("["):text.rindex("]") + 1]
+    funds = []
+    for item in json.loads(text):
+        if len(item) < 5:
+            continue
+        ftype = item[3] or ""
+        funds.append({
+            "code": item[0],
+            "initials": (item[1] or "").upper(),
+            "name": item[2] or "",
+            "type": ftype,
+            "category": ftype.split("-")[0],
+            "pinyin": (item[4] or "").upper(),
+        })
+    return funds
+
+
+class FundIndexManager:
+    """管理检索索引的加载、后台刷新与本地快照"""
+
+    def __init__(self, path, ttl=FUND_INDEX_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.index = None
+        self._loaded = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """返回当前索引（可能为 None）；未加载时读快照，过期时后台刷新"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load_snapshot()
+                    self._loaded = True
+        index = self.index
+        if index is None or time.time() - index.built_at > self.ttl:
+            self.refresh_async()
+        return index
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name="fund-index-refresh", daemon=True).start()
+
+    def refresh(self):
+        try:
+            funds = _fetch_fund_universe()
+            if funds:
+                self.index = FundSearchIndex(funds)
+                self._save_snapshot(funds)
+        except (requests.RequestException, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _load_snapshot(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            self.index = FundSearchIndex(stored["funds"], built_at=stored["built_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.index = None
+
+    def _save_snapshot(self, funds):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"built_at": self.index.built_at, "funds": funds}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+FUND_INDEX = FundIndexManager(os.path.join(CACHE_DIR, "fund_index.json"))
+
+
+def fund_search(keyword):
+    """搜索基金 - 只返回场外基金
+
+    优先查本地索引；索引未就绪，或按6位代码查不到（新发基金等）时回源 fundSearch。
+    """
+    index = FUND_INDEX.get()
+    if index is not None:
+        results = index.search(keyword)
+        if results or not (keyword.isdigit() and len(keyword) == 6):
+            return {"success": True, "data": results}
+    return _cached_call(f"search:{keyword}", CACHE_TTL, lambda: _load_fund_search(keyword))
+
+
+def _load_fund_search(keyword):
+    data, err = _tiantian_action(
+        "fundSearch",
+        {"m": "1", "key": keyword, "pageindex": "0", "pagesize": "50"},
+        timeout=6
+    )
+    if not data:
+        return {"success": False, "message": f"搜索失败: {err or '上游不可用'}"}
+
+    results = []
+    if data.get("Datas"):
+        for item in data["Datas"]:
+            fund_base = item.get("FundBaseInfo") or {}
+            category = item.get("CATEGORYDESC", "")
+            ftype = fund_base.get("FTYPE", "")
+            code = item.get("CODE", "")
+
+            # 只保留场外基金：有 FundBaseInfo 且不在排除类别
+            if not fund_base:
+                continue
+            if category in EXCLUDE_CATEGORIES:
+                continue
+            # 只保留6位代码的基金
+            if not code or len(code) != 6:
+                continue
+
+            if _is_money_fund(category, ftype, item.get("NAME", "")):
+                continue
+
+            results.append({
+                "code": code,
+                "name": item.get("NAME", ""),
+                "type": ftype,
+                "category": category
+            })
+
+            if len(results) >= FUND_SEARCH_LIMIT:
+                break
+
+    return {"success": True, "data": results}
+
+
+def fund_info(code):
+    """获取单只基金信息"""
+    return _cached_call(f"info:{code}", FUND_INFO_TTL, lambda: _load_fund_info(code), data_class="nav")
+
+
+def _fund_info_from_gz(code):
+    fund_data, err = _fetch_fund_gz(code)
+    if fund_data:
+        return {"success": True, "data": fund_data}
+    result = {"success": False, "message": f"获取失败: {err or '估值数据为空'}"}
+    if fund_data is not None:
+        result["missing"] = True
+    return result
+
+
+def _fetch_fund_mn_detail(code):
+    """基金详情接口，返回 (Datas, 错误信息)"""
+    detail_data, detail_err = _tiantian_action(
+        "fundMNDetailInformation",
+        {"FCODE": code},
+        timeout=6
+    )
+    datas = detail_data.get("Datas") if isinstance(detail_data, dict) else None
+    return datas or {}, detail_err or ("" if datas else "详情数据为空")
+
+
+def _info_from_mn_detail(code, datas):
+    return {
+        "code": datas.get("FCODE", code),
+        "name": datas.get("SHORTNAME", "") or datas.get("FULLNAME", ""),
+        "nav": datas.get("DWJZ", ""),
+        "nav_date": datas.get("FSRQ", ""),
+        "estimate_nav": "",
+        "estimate_change": "",
+        "estimate_time": "",
+    }
+
+
+def _fund_info_from_detail(code):
+    """兜底：使用基金详情接口获取基础信息"""
+    datas, detail_err = _fetch_fund_mn_detail(code)
+    if datas:
+        return {"success": True, "data": _info_from_mn_detail(code, datas)}
+    return {"success": False, "message": f"获取失败: {detail_err}"}
+
+
+FUND_INFO_CHAIN = FallbackChain("fund_info", [
+    ("fundgz", _fund_info_from_gz),
+    ("tiantian:fundMNDetailInformation", _fund_info_from_detail),
+])
+
+
+def _load_fund_info(code):
+    return FUND_INFO_CHAIN.run(code)
+
+
+def _fetch_fund_year_change(code):
+    return _cached_call(
+        f"fund_year_change:{code}", FUND_DETAIL_PART_TTL,
+        lambda: _load_fund_year_change(code), data_class="nav"
+    )
+
+
+def _load_fund_year_change(code):
+    inc_data, _ = _tiantian_action(
+        "fundMNPeriodIncrease",
+        {"FCODE": code},
+        timeout=6
+    )
+    if inc_data:
+        for item in inc_data.get("Datas", []):
+            title = item.get("title") or item.get("Title") or ""
+            if title in ("1N", "近1年", "Y"):
+                return item.get("syl", "")
+    return ""
+
+
+def _fetch_fund_sectors(code):
+    return _cached_call(
+        f"fund_sectors:{code}", FUND_DETAIL_PART_TTL,
+        lambda: _load_fund_sectors(code), data_class="daily"
+    )
+
+
+def _load_fund_sectors(code):
+    search_data, _ = _tiantian_action(
+        "fundSearch",
+        {"m": "1", "key": code},
+        timeout=6
+    )
+    if search_data and search_data.get("Datas"):
+        zt_info = search_data["Datas"][0].get("ZTJJInfo", [])
+        if zt_info:
+            return [{"name": zt.get("TTYPENAME", ""), "code": zt.get("TTYPE", "")} for zt in zt_info[:3]]
+    return []
+
+
+def _stock_secid(code):
+    code = str(code)
+    if len(code) == 5:
+        return f"116.{code}"  # 港股
+    market = "1" if code.startswith(("6", "9")) else "0"
+    return f"{market}.{code}"
+
+
+def _fetch_stock_quotes_raw(codes):
+    """一次 ulist 请求获取多只股票涨跌幅，返回 {code: change}"""
+    try:
+        url = "https://push2.eastmoney.com/api/qt/ulist.np/get"
+        params = {
+            "secids": ",".join(_stock_secid(code) for code in codes),
+            "fields": "f12,f14,f3",
+            "fltt": "2",
+            "invt": "2"
+        }
+        resp = _http_get(url, params=params, timeout=6, verify=False)
+        data = _safe_json(resp) or {}
+        diff = (data.get("data") or {}).get("diff") or []
+        result = {}
+        for item in diff:
+            code = item.get("f12")
+            change = item.get("f3")
+            if code is not None:
+                result[code] = change
+        return result
+    except requests.RequestException:
+        return {}
+
+
+class StockQuoteBatcher:
+    """个股实时涨跌：按股票短缓存，并把并发请求的未命中合并成一次 ulist 请求
+
+    第一个发现未命中的调用方等待 STOCK_QUOTE_BATCH_WINDOW 收集其他请求的代码，
+    再按 ULIST_MAX_SECIDS 分片查询；已在查询中的代码直接等待其结果。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._queue = []
+        self._flush_scheduled = False
+
+    def get_changes(self, codes):
+        result = {}
+        misses = []
+        for code in dict.fromkeys(c for c in codes if c):
+            cached = get_cache(f"quote:{code}", ttl=MARKET_CALENDAR.ttl("realtime", STOCK_QUOTE_TTL))
+            if cached is not None:
+                result[code] = cached
+            else:
+                misses.append(code)
+        if not misses:
+            return result
+
+        waits = {}
+        leader = False
+        with self._lock:
+            for code in misses:
+                future = self._pending.get(code)
+                if future is None:
+                    future = self._pending[code] = concurrent_futures.Future()
+                    self._queue.append(code)
+                waits[code] = future
+            if self._queue and not self._flush_scheduled:
+                self._flush_scheduled = leader = True
+        if leader:
+            time.sleep(STOCK_QUOTE_BATCH_WINDOW)
+            self._flush()
+
+        for code, future in waits.items():
+            try:
+                change = future.result(timeout=SINGLE_FLIGHT_TIMEOUT)
+            except Exception:
+                continue
+            if change is not None:
+                result[code] = change
+        return result
+
+    def _flush(self):
+        with self._lock:
+            codes, self._queue = self._queue, []
+            self._flush_scheduled = False
+        chunks = [codes[i:i + ULIST_MAX_SECIDS] for i in range(0, len(codes), ULIST_MAX_SECIDS)]
+        futures = [UPSTREAM.submit(_fetch_stock_quotes_raw, chunk) for chunk in chunks]
+        UPSTREAM.wait(futures)
+        for chunk, future in zip(chunks, futures):
+            error = future.exception()
+            changes = {} if error is not None else future.result()
+            with self._lock:
+                pending = [(code, self._pending.pop(code, None)) for code in chunk]
+            for code, waiter in pending:
+                change = changes.get(code)
+                if change is not None:
+                    set_cache(f"quote:{code}", change, ttl=MARKET_CALENDAR.ttl("realtime", STOCK_QUOTE_TTL))
+                if waiter is not None:
+                    waiter.set_result(change)
+
+
+STOCK_QUOTES = StockQuoteBatcher()
+
+
+def _fetch_stock_changes(codes):
+    if not codes:
+        return {}
+    return STOCK_QUOTES.get_changes(codes)
+
+
+def _fetch_fund_stocks(code):
+    """重仓股结构（代码/名称/占比），不含实时涨跌；上游请求失败时不缓存，返回空列表"""
+    return _cached_call(
+        f"fund_stocks:{code}", FUND_DETAIL_PART_TTL,
+        lambda: _load_fund_stocks(code), data_class="daily"
+    ) or []
+
+
+Holding = namedtuple("Holding", "rank code name weight")
+
+_HOLDING_ROW_RE = re.compile(r"<tr[^>]*>(.*?)</tr>", re.S)
+_HOLDING_CELL_RE = re.compile(r"<t[dh][^>]*>(.*?)</t[dh]>", re.S)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_HOLDING_CODE_RE = re.compile(r"^[0-9A-Z]{5,6}$")
+
+
+def _parse_fund_holdings(text, limit=10):
+    """解析 fundf10 jjcc 持仓页，只取最新一期（第一个表格）
+
+    按表头定位代码/名称/占净值比例列（最新一期比历史期多出最新价、涨跌幅两列），
+    单次遍历表格行，返回 Holding(rank, code, name, weight) 列表。
+    """
+    start = text.find("<table")
+    if start < 0:
+        return []
+    end = text.find("</table>", start)
+    table = text[start:end if end > 0 else len(text)]
+
+    code_col, name_col, weight_col = 1, 2, None
+    holdings = []
+    for row in _HOLDING_ROW_RE.findall(table):
+        cells = [_HTML_TAG_RE.sub("", cell).strip() for cell in _HOLDING_CELL_RE.findall(row)]
+        if not cells:
+            continue
+        if "股票代码" in cells:
+            code_col = cells.index("股票代码")
+            name_col = cells.index("股票名称") if "股票名称" in cells else code_col + 1
+            weight_col = next((i for i, c in enumerate(cells) if c.startswith("占净值")), None)
+            continue
+        if len(cells) <= max(code_col, name_col) or not _HOLDING_CODE_RE.match(cells[code_col]):
+            continue
+        if weight_col is not None and weight_col < len(cells):
+            weight_text = cells[weight_col]
+        else:
+            weight_text = next((c for c in cells if c.endswith("%")), "")
+        try:
+            weight = float(weight_text.rstrip("%").replace(",", ""))
+        except ValueError:
+            weight = 0.0
+        rank = int(cells[0]) if cells[0].isdigit() else len(holdings) + 1
+        holdings.append(Holding(rank, cells[code_col], cells[name_col], weight))
+        if len(holdings) >= limit:
+            break
+    return holdings
+
+
+def _load_fund_stocks(code):
+    try:
+        stocks_url = f"https://fundf10.eastmoney.com/FundArchivesDatas.aspx?type=jjcc&code={code}&topline=10"
+        stocks_resp = _http_get(
+            stocks_url,
+            timeout=8,
+            verify=False,
+            headers={"Referer": "https://fundf10.eastmoney.com/"}
+        )
+    except requests.RequestException:
+        return None
+
+    return [
+        {
+            "rank": str(h.rank),
+            "code": h.code,
+            "name": h.name,
+            "ratio": f"{h.weight:.2f}%",
+            "change": ""
+        }
+        for h in _parse_fund_holdings(stocks_resp.text)
+    ]
+
+
+def fund_detail(code):
+    """获取基金详细信息，包含重仓股；重仓股涨跌按个股短缓存在读取时刷新"""
+    result = _cached_call(f"detail:{code}", FUND_DETAIL_TTL, lambda: _load_fund_detail(code), data_class="nav")
+    return _with_live_quotes(result)
+
+
+def _with_live_quotes(result):
+    stocks = (result.get("data") or {}).get("stocks") if result.get("success") else None
+    if not stocks:
+        return result
+    changes = _fetch_stock_changes([s.get("code") for s in stocks])
+    if all(changes.get(s.get("code"), s.get("change")) == s.get("change") for s in stocks):
+        return result
+    result = dict(result)
+    result["data"] = dict(result["data"])
+    result["data"]["stocks"] = _merge_stock_changes(stocks, changes)
+    return result
+
+
+def _merge_stock_changes(stocks, changes):
+    """重仓股结构与实时涨跌在读取时合并，不修改缓存中的结构"""
+    merged = []
+    for stock in stocks:
+        stock = dict(stock)
+        if stock.get("code") in changes:
+            stock["change"] = changes[stock["code"]]
+        merged.append(stock)
+    return merged
+
+
+# 详情图的估值节点只走 fundgz（与 FUND_INFO_CHAIN 共用同一熔断器），详情接口兜底由图中的 mn_detail 节点提供
+FUND_ESTIMATE_CHAIN = FallbackChain("fund_estimate", [
+    ("fundgz", _fund_info_from_gz),
+])
+
+
+def _fund_info_for_detail(code):
+    """详情图的估值节点：与 fund_info 共用 info 缓存、single-flight 与 fundgz 熔断"""
+    return _cached_call(
+        f"info:{code}", FUND_INFO_TTL, lambda: FUND_ESTIMATE_CHAIN.run(code), data_class="nav"
+    )
+
+
+def _load_fund_detail(code):
+    """详情依赖图：估值、详情、重仓、近一年、关联板块在 t=0 并行，重仓行情依赖重仓结构
+
+    fundMNDetailInformation 在请求内只调用一次，同时作为估值兜底与详情字段来源。
+    """
+    graph = (
+        TaskGraph()
+        .add("info", lambda: _fund_info_for_detail(code))
+        .add("mn_detail", lambda: _fetch_fund_mn_detail(code))
+        .add("holdings", lambda: _fetch_fund_stocks(code))
+        .add("year_change", lambda: _fetch_fund_year_change(code))
+        .add("sectors", lambda: _fetch_fund_sectors(code))
+        .add("quotes", lambda stocks: _fetch_stock_changes([s.get("code") for s in stocks]), deps=["holdings"])
     )
-    datas = detail_data.get("Datas") if isinstance(detail_data, dict) else {}
+    results = graph.run()
+
+    def _value(name, default):
+        value = results[name]
+        return default if isinstance(value, Exception) else value
+
+    info_result = _value("info", {"success": False, "message": "获取失败"})
+    datas, detail_err = _value("mn_detail", ({}, "详情数据为空"))
+    if info_result.get("success"):
+        fund_data = info_result["data"].copy()
+    elif datas:
+        fund_data = _info_from_mn_detail(code, datas)
+    else:
+        return {"success": False, "message": f"获取失败: {detail_err or info_result.get('message', '')}"}
+
     if datas:
         fund_data.setdefault("name", datas.get("SHORTNAME", "") or datas.get("FULLNAME", ""))
         if not fund_data.get("nav"):
@@ -445,465 +2721,1829 @@ def fund_detail(code):
             fund_data["nav_date"] = datas.get("FSRQ", "")
         fund_data["perf_cmp"] = datas.get("PERFCMP", "")
         fund_data["inv_tgt"] = datas.get("INVTGT", "")
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        futures = {
-            "stocks": executor.submit(_fetch_fund_stocks, code),
-            "year_change": executor.submit(_fetch_fund_year_change, code),
-            "sectors": executor.submit(_fetch_fund_sectors, code)
+    fund_data["stocks"] = _merge_stock_changes(_value("holdings", []), _value("quotes", {}))
+    fund_data["year_change"] = _value("year_change", "") or fund_data.get("year_change", "")
+    fund_data["sectors"] = _value("sectors", [])
+
+    return {"success": True, "data": fund_data, "_graph": graph.timings()}
+
+
+def _clean_value(value):
+    """上游用 "--" 表示无数据，统一为空字符串"""
+    if value is None or value == "--":
+        return ""
+    return str(value)
+
+
+def _fetch_fund_estimates_bulk(codes):
+    """一次请求获取多只基金的净值与估值，返回 {code: fund_data}"""
+    data, _ = _tiantian_action(
+        "fundMNFInfo",
+        {
+            "pageIndex": "1",
+            "pageSize": str(len(codes)),
+            "plat": "Android",
+            "appType": "ttjj",
+            "product": "EFund",
+            "Version": "1",
+            "Fcodes": ",".join(codes)
+        },
+        timeout=8
+    )
+    wanted = set(codes)
+    results = {}
+    for item in (data or {}).get("Datas") or []:
+        code = item.get("FCODE", "")
+        if code not in wanted:
+            continue
+        results[code] = {
+            "code": code,
+            "name": item.get("SHORTNAME", ""),
+            "nav": _clean_value(item.get("NAV")),
+            "nav_date": _clean_value(item.get("PDATE")),
+            "estimate_nav": _clean_value(item.get("GSZ")),
+            "estimate_change": _clean_value(item.get("GSZZL")) or "0",
+            "estimate_time": _clean_value(item.get("GZTIME")),
+        }
+    return results
+
+
+def _fetch_fund_estimates_chunk(codes):
+    try:
+        return _fetch_fund_estimates_bulk(codes)
+    except Exception:
+        return {}
+
+
+def _refresh_fund_infos(codes, ttl):
+    """按 BULK_ESTIMATE_CHUNK 分片走批量估值接口并回填 info 缓存，返回 {code: result}
+
+    单个分片失败（超时、限流、HTTP 错误）时该分片的代码不出现在结果中，由调用方逐只兜底。
+    """
+    infos = {}
+    chunks = [codes[i:i + BULK_ESTIMATE_CHUNK] for i in range(0, len(codes), BULK_ESTIMATE_CHUNK)]
+    for bulk in UPSTREAM.map(_fetch_fund_estimates_chunk, chunks):
+        for code, fund_data in bulk.items():
+            result = {"success": True, "data": fund_data}
+            set_cache(
+                f"info:{code}", result,
+                ttl=ttl, stale_ttl=FUND_INFO_TTL * CACHE_STALE_RATIO
+            )
+            infos[code] = result
+    return infos
+
+
+def _load_fund_infos(codes, ttl):
+    """未命中的代码按 info:<代码> 逐只 single-flight：已有回源（fund_info 或其他批量请求）的代码等待其结果，
+    其余代码合并走批量估值接口；返回 {code: result}，失败的代码不在结果中"""
+
+    def _load(keys):
+        infos = _refresh_fund_infos([key.split(":", 1)[1] for key in keys], ttl)
+        return {f"info:{code}": result for code, result in infos.items()}
+
+    loaded = SINGLE_FLIGHT.do_many([f"info:{code}" for code in codes], _load)
+    return {key.split(":", 1)[1]: result for key, result in loaded.items()}
+
+
+def _schedule_info_refresh(codes, ttl):
+    """后台批量刷新软过期的 info 缓存，同一代码同时只有一个刷新"""
+    with _REFRESHING_LOCK:
+        codes = [code for code in codes if f"info:{code}" not in _REFRESHING]
+        _REFRESHING.update(f"info:{code}" for code in codes)
+    if not codes:
+        return
+
+    def _refresh():
+        try:
+            _load_fund_infos(codes, ttl)
+        except Exception:
+            pass
+        finally:
+            with _REFRESHING_LOCK:
+                _REFRESHING.difference_update(f"info:{code}" for code in codes)
+
+    _refresh_executor().submit(_refresh)
+
+
+def fund_batch(codes):
+    """批量获取基金信息
+
+    先读单只缓存（软过期的直接返回旧值并后台刷新），未命中的代码经 single-flight
+    按 BULK_ESTIMATE_CHUNK 分片走批量估值接口并回填 info 缓存，批量结果中仍缺失的代码再逐只兜底。
+    """
+    infos = {}
+    misses = []
+    stale = []
+    ttl = MARKET_CALENDAR.ttl("nav", FUND_INFO_TTL)
+    for code in dict.fromkeys(codes):
+        key = f"info:{code}"
+        entry = _peek_cache(key)
+        if entry is None:
+            METRICS.cache_event(key, "miss")
+            misses.append(code)
+            continue
+        data, age, entry_ttl = entry
+        infos[code] = data
+        if age < min(ttl, entry_ttl):
+            METRICS.cache_event(key, "hit")
+        else:
+            METRICS.cache_event(key, "stale")
+            stale.append(code)
+
+    if stale:
+        _schedule_info_refresh(stale, ttl)
+    if misses:
+        infos.update(_load_fund_infos(misses, ttl))
+
+    leftovers = [code for code in misses if code not in infos]
+    if leftovers:
+        futures = {code: UPSTREAM.submit(fund_info, code) for code in leftovers}
+        UPSTREAM.wait(futures.values())
+        for code, future in futures.items():
+            try:
+                infos[code] = future.result()
+            except Exception as e:
+                infos[code] = {"success": False, "message": str(e)}
+
+    results = []
+    for code in codes:
+        result = infos[code]
+        if result.get("success"):
+            results.append(result["data"])
+        else:
+            results.append({"code": code, "error": result.get("message", "未知错误")})
+
+    return {"success": True, "data": results}
+
+
+def fund_hot():
+    """获取热门基金"""
+    return _cached_call("hot_funds", FUND_HOT_TTL, _load_fund_hot, data_class="daily")
+
+
+def _hot_from_rank():
+    data, err = _tiantian_action(
+        "fundMNRank",
+        {
+            "FundType": "0",
+            "SortColumn": "SALESRANK_D",
+            "Sort": "desc",
+            "pageIndex": "1",
+            "pageSize": "20"
+        },
+        timeout=8
+    )
+    if data and data.get("Datas"):
+        results = []
+        for item in data["Datas"]:
+            code = item.get("FCODE", "")
+            name = item.get("SHORTNAME", "") or item.get("FULLNAME", "")
+            change = item.get("RZDF") or "0"
+            if not code or len(code) != 6:
+                continue
+            if "货币" in (name or ""):
+                continue
+            results.append({
+                "code": code,
+                "name": name,
+                "change": change,
+                "type": ""
+            })
+            if len(results) >= 20:
+                break
+        if results:
+            return {"success": True, "data": results}
+    return {"success": False, "message": f"获取热门失败: {err or '排行数据为空'}"}
+
+
+def _hot_from_rankhandler():
+    try:
+        url = "https://fund.eastmoney.com/data/rankhandler.aspx"
+        params = {
+            "op": "ph", "dt": "kf", "ft": "all", "rs": "", "gs": "0",
+            "sc": "rzdf", "st": "desc", "pi": "1", "pn": "20", "dx": "1"
+        }
+        headers = {
+            "Referer": "https://fund.eastmoney.com/",
+            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+        }
+        resp = _http_get(url, params=params, headers=headers, timeout=10, verify=False)
+
+        text = resp.text
+        match = re.search(r'datas:\[(.*?)\]', text)
+        if not match:
+            return {"success": False, "message": "解析数据失败"}
+
+        results = []
+        items = match.group(1).split('","')
+        for item in items[:20]:
+            parts = item.strip('"').split(',')
+            if len(parts) >= 7:
+                if "货币" in (parts[1] or ""):
+                    # 过滤货币型基金，避免进入详情页无有效数据
+                    continue
+                results.append({
+                    "code": parts[0],
+                    "name": parts[1],
+                    "change": parts[6] if parts[6] else "0",
+                    "type": "混合型"
+                })
+
+        return {"success": True, "data": results}
+    except requests.RequestException as e:
+        return {"success": False, "message": f"获取热门失败: {str(e)}"}
+
+
+FUND_HOT_CHAIN = FallbackChain("fund_hot", [
+    ("tiantian:fundMNRank", _hot_from_rank),
+    ("eastmoney:rankhandler", _hot_from_rankhandler),
+])
+
+
+def _load_fund_hot():
+    return FUND_HOT_CHAIN.run()
+
+
+# ==========================================
+# 历史净值模块
+# ==========================================
+
+# 文件头：魔数、已写入条数、每列容量、最近写入时间；其后依次为日期列（int32 yyyymmdd）、
+# 单位净值列与累计净值列（float64），各列按容量预留，追加时原地写入，最后更新条数
+_NAV_HEADER = struct.Struct("<4sIII")
+_NAV_MAGIC = b"NAV1"
+_NAV_RANGES = {"1m": 30, "3m": 91, "6m": 182, "1y": 365, "3y": 1096, "5y": 1826, "max": None}
+_PINGZHONG_SERIES = re.compile(r"var\s+(Data_netWorthTrend|Data_ACWorthTrend)\s*=\s*(\[.*?\])\s*;", re.S)
+
+
+def _nav_offsets(capacity):
+    """日期列、单位净值列、累计净值列的起始偏移；容量为偶数时 float64 列按 8 字节对齐"""
+    dates_at = _NAV_HEADER.size
+    navs_at = dates_at + 4 * capacity
+    return dates_at, navs_at, navs_at + 8 * capacity
+
+
+def _nav_capacity(count):
+    """预留约 25% 的追加空间（至少 64 条），扩容时整体重写"""
+    capacity = max(count + count // 4, count + 64)
+    return capacity + capacity % 2
+
+
+def _lock_file(f):
+    """多进程追加同一文件时加独占锁，不支持 flock 的平台跳过"""
+    try:
+        import fcntl
+    except ImportError:
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+class NavSeries:
+    """单只基金净值文件的只读映射，各列为零拷贝的 memoryview"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.key = os.fstat(f.fileno()).st_ino
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, capacity, _ = _NAV_HEADER.unpack_from(self._mm, 0)
+        dates_at, navs_at, accs_at = _nav_offsets(capacity)
+        if magic != _NAV_MAGIC or len(self._mm) < accs_at + 8 * capacity:
+            raise ValueError("净值文件格式错误")
+        view = memoryview(self._mm)
+        self.capacity = capacity
+        self._dates = view[dates_at:navs_at].cast("i")
+        self._navs = view[navs_at:accs_at].cast("d")
+        self._accs = view[accs_at:accs_at + 8 * capacity].cast("d")
+
+    def columns(self):
+        """返回 (日期, 单位净值, 累计净值)；条数每次从文件头读取，其他进程的追加即时可见"""
+        count = min(_NAV_HEADER.unpack_from(self._mm, 0)[1], self.capacity)
+        return self._dates[:count], self._navs[:count], self._accs[:count]
+
+
+class NavHistoryStore:
+    """基金历史净值的列式存储，每只基金一个文件
+
+    读取经 mmap 共享页缓存，多进程不重复占用内存；追加在文件锁内原地写入，
+    容量不足或需要全量重建时写临时文件后整体替换，已打开的映射不受影响。
+    """
+
+    def __init__(self, root, max_open=NAV_HISTORY_MAX_OPEN):
+        self.root = root
+        self.max_open = max_open
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, code):
+        return os.path.join(self.root, f"{code}.nav")
+
+    def get(self, code):
+        """当前映射，文件被替换后重新映射；不存在或损坏时返回 None"""
+        path = self.path(code)
+        try:
+            key = os.stat(path).st_ino
+        except OSError:
+            return None
+        with self._lock:
+            series = self._series.get(code)
+            if series is not None and series.key == key:
+                self._series.move_to_end(code)
+                return series
+        try:
+            series = NavSeries(path)
+        except (OSError, ValueError, struct.error):
+            return None
+        with self._lock:
+            self._series[code] = series
+            self._series.move_to_end(code)
+            # 淘汰时只丢弃引用，请求中仍在使用的视图保持有效
+            while len(self._series) > self.max_open:
+                self._series.popitem(last=False)
+        return series
+
+    def last_date(self, code):
+        series = self.get(code)
+        if series is None:
+            return None
+        dates = series.columns()[0]
+        return dates[-1] if len(dates) else None
+
+    def replace(self, code, rows):
+        """整体重写，rows 为按日期升序的 [(yyyymmdd, 单位净值, 累计净值)]"""
+        capacity = _nav_capacity(len(rows))
+        path = self.path(code)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_NAV_HEADER.pack(_NAV_MAGIC, len(rows), capacity, int(time.time())))
+            for column, typecode in enumerate("idd"):
+                values = array(typecode, (row[column] for row in rows))
+                f.write(values.tobytes())
+                f.write(bytes(values.itemsize * (capacity - len(rows))))
+        os.replace(tmp_path, path)
+
+    def append(self, code, rows):
+        """追加晚于最后一条的记录，返回追加条数；文件不存在时抛出 FileNotFoundError"""
+        path = self.path(code)
+        while True:
+            with open(path, "r+b") as f:
+                _lock_file(f)
+                # 等锁期间文件可能已被其他进程整体替换，需重新打开
+                if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                    continue
+                magic, count, capacity, _ = _NAV_HEADER.unpack(f.read(_NAV_HEADER.size))
+                if magic != _NAV_MAGIC:
+                    raise ValueError("净值文件格式错误")
+                columns = [array(typecode) for typecode in "idd"]
+                for column, offset in zip(columns, _nav_offsets(capacity)):
+                    f.seek(offset)
+                    column.frombytes(f.read(column.itemsize * count))
+                last = columns[0][-1] if count else 0
+                rows = [row for row in rows if row[0] > last]
+                if not rows:
+                    return 0
+                if count + len(rows) > capacity:
+                    self.replace(code, list(zip(*columns)) + rows)
+                    return len(rows)
+                for column, (typecode, offset) in enumerate(zip("idd", _nav_offsets(capacity))):
+                    values = array(typecode, (row[column] for row in rows))
+                    f.seek(offset + values.itemsize * count)
+                    f.write(values.tobytes())
+                f.flush()
+                f.seek(0)
+                f.write(_NAV_HEADER.pack(_NAV_MAGIC, count + len(rows), capacity, int(time.time())))
+                return len(rows)
+
+
+NAV_HISTORY = NavHistoryStore(os.path.join(CACHE_DIR, "nav"))
+
+
+def _fetch_nav_full(code):
+    """pingzhongdata 全量净值，返回按日期升序的 [(yyyymmdd, 单位净值, 累计净值)]
+
+    时间戳为北京时间零点的毫秒数；累计净值缺失时沿用上一日，序列开头缺失时取单位净值。
+    """
+    resp = _http_get(
+        f"https://fund.eastmoney.com/pingzhongdata/{code}.js",
+        timeout=15,
+        verify=False,
+        headers={"Referer": "https://fund.eastmoney.com/"}
+    )
+    series = dict(_PINGZHONG_SERIES.findall(resp.text))
+    navs = {}
+    for point in json.loads(series.get("Data_netWorthTrend") or "[]"):
+        nav = _to_float(point.get("y"), None) if isinstance(point, dict) else None
+        if nav is not None and point.get("x"):
+            navs[_cst_date(point["x"] / 1000)] = nav
+    accs = {}
+    for point in json.loads(series.get("Data_ACWorthTrend") or "[]"):
+        acc = _to_float(point[1], None) if isinstance(point, list) and len(point) >= 2 else None
+        if acc is not None and point[0]:
+            accs[_cst_date(point[0] / 1000)] = acc
+    rows = []
+    acc = None
+    for day in sorted(navs):
+        acc = accs.get(day, acc if acc is not None else navs[day])
+        rows.append((day, navs[day], acc))
+    return rows
+
+
+def _fetch_nav_recent(code):
+    """lsjz 最近 NAV_HISTORY_PAGE_SIZE 条净值，返回按日期升序的 [(yyyymmdd, 单位净值, 累计净值)]"""
+    resp = _http_get(
+        "https://api.fund.eastmoney.com/f10/lsjz",
+        params={"fundCode": code, "pageIndex": "1", "pageSize": str(NAV_HISTORY_PAGE_SIZE)},
+        timeout=8,
+        verify=False,
+        headers={"Referer": "https://fundf10.eastmoney.com/"}
+    )
+    items = ((resp.json() or {}).get("Data") or {}).get("LSJZList") or []
+    rows = []
+    for item in items:
+        nav = _to_float(item.get("DWJZ"), None)
+        try:
+            day = int((item.get("FSRQ") or "").replace("-", ""))
+        except ValueError:
+            continue
+        if nav is not None:
+            rows.append((day, nav, _to_float(item.get("LJJZ"), nav)))
+    rows.sort()
+    return rows
+
+
+def _sync_nav_history(code):
+    """已有序列时只拉最近一页追加，最近一页与已存序列接不上（断档超过一页）或尚无序列时全量拉取"""
+    try:
+        last = NAV_HISTORY.last_date(code)
+        if last is not None:
+            rows = _fetch_nav_recent(code)
+            if not rows:
+                # 上游偶发空页或节假日无新净值，保留已存序列，不重新全量拉取
+                return {"success": True, "data": {"added": 0}}
+            if rows[0][0] <= last or len(rows) < NAV_HISTORY_PAGE_SIZE:
+                return {"success": True, "data": {"added": NAV_HISTORY.append(code, rows)}}
+        rows = _fetch_nav_full(code)
+        if not rows:
+            return {"success": False, "message": "历史净值为空"}
+        NAV_HISTORY.replace(code, rows)
+        return {"success": True, "data": {"added": len(rows)}}
+    except (requests.RequestException, ValueError, OSError) as e:
+        return {"success": False, "message": f"获取历史净值失败: {str(e)}"}
+
+
+def _lttb(values, threshold):
+    """Largest-Triangle-Three-Buckets 降采样，返回保留点的下标
+
+    首尾点保留，其余点均分为 threshold - 2 个桶，每桶取与上一保留点、下一桶均值构成三角形面积最大的点；
+    横轴取序号（净值按交易日等间隔）。
+    """
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return range(n)
+    buckets = threshold - 2
+
+    def bound(i):
+        return n if i > buckets else 1 + i * (n - 2) // buckets
+
+    keep = [0]
+    a = 0
+    for i in range(buckets):
+        start, end, next_end = bound(i), bound(i + 1), bound(i + 2)
+        avg_x = (end + next_end - 1) / 2
+        avg_y = sum(values[end:next_end]) / (next_end - end)
+        ay = values[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((a - avg_x) * (values[j] - ay) - (a - j) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+def _parse_day(value):
+    """YYYY-MM-DD 或 yyyymmdd 转为整数日期，格式错误或日期不存在（如 2025-02-30）返回 None"""
+    value = (value or "").replace("-", "")
+    if len(value) != 8 or not value.isdigit():
+        return None
+    try:
+        _int_to_date(int(value))
+    except ValueError:
+        return None
+    return int(value)
+
+
+def _format_day(value):
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+def fund_history(code, start=None, end=None, period="1y", points=NAV_HISTORY_DEFAULT_POINTS, field="nav"):
+    """历史净值区间查询，区间内点数超过 points 时按 LTTB 降采样
+
+    未指定 start 时按 period 从 end（默认最新净值日）往前推；field 为 acc 时返回累计净值。
+    """
+    synced = _cached_call(
+        f"nav_sync:{code}", NAV_HISTORY_SYNC_TTL, lambda: _sync_nav_history(code), data_class="nav"
+    )
+    # 同步失败时仍返回已存序列
+    series = NAV_HISTORY.get(code)
+    dates, navs, accs = series.columns() if series is not None else ((), (), ())
+    if not len(dates):
+        return {"success": False, "message": synced.get("message") or "暂无历史净值"}
+
+    end = end or dates[-1]
+    if start is None:
+        days = _NAV_RANGES.get(period, _NAV_RANGES["1y"])
+        try:
+            start = int((_int_to_date(end) - timedelta(days=days)).strftime("%Y%m%d")) if days else 0
+        except OverflowError:
+            start = 0
+    lo = bisect.bisect_left(dates, start)
+    hi = bisect.bisect_right(dates, end)
+    dates = dates[lo:hi]
+    values = (accs if field == "acc" else navs)[lo:hi]
+    keep = _lttb(values, points)
+    return {"success": True, "data": {
+        "code": code,
+        "field": "acc" if field == "acc" else "nav",
+        "total": len(dates),
+        "dates": [_format_day(dates[i]) for i in keep],
+        "values": [values[i] for i in keep],
+    }}
+
+
+# ==========================================
+# 持仓估值模块
+# ==========================================
+
+def _to_float(value, default=0.0):
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return default
+    return result if math.isfinite(result) else default
+
+
+def _parse_holdings(raw):
+    """校验持仓列表 [{code, shares, cost, account}]，返回 (holdings, 错误信息)"""
+    if not isinstance(raw, list) or not raw:
+        return None, "请提供持仓列表"
+    if len(raw) > PORTFOLIO_MAX_HOLDINGS:
+        return None, f"持仓条数超过上限 {PORTFOLIO_MAX_HOLDINGS}"
+    holdings = []
+    for item in raw:
+        if not isinstance(item, dict):
+            return None, "持仓格式错误"
+        code = str(item.get("code", "")).strip()
+        if len(code) != 6 or not code.isdigit():
+            return None, f"基金代码错误: {code}"
+        holdings.append((
+            code,
+            _to_float(item.get("shares")),
+            _to_float(item.get("cost")),
+            str(item.get("account") or "默认账户")
+        ))
+    return holdings, None
+
+
+def _ratio(numerator, denominator):
+    return round(numerator / denominator * 100, 2) if denominator else 0.0
+
+
+def portfolio_value(raw_holdings, with_holdings=True):
+    """持仓估值：逐持仓、逐账户与总计的市值、当日估算收益和累计收益
+
+    cost 为单位持仓成本（成本净值）。基金估值复用 fund_batch，
+    计算按列存放在 array 中，每只基金的净值与估算涨跌只解析一次，
+    账户汇总按账户下标累加，避免逐行构造中间 dict。
+    """
+    holdings, err = _parse_holdings(raw_holdings)
+    if err:
+        return {"success": False, "message": err}
+
+    # 基金维度：每只基金一行
+    fund_index = {}
+    accounts = {}
+    fund_col = array("l")
+    account_col = array("l")
+    shares_col = array("d")
+    cost_col = array("d")
+    for code, shares, cost, account in holdings:
+        fund_col.append(fund_index.setdefault(code, len(fund_index)))
+        account_col.append(accounts.setdefault(account, len(accounts)))
+        shares_col.append(shares)
+        cost_col.append(cost)
+
+    codes = list(fund_index)
+    TRAFFIC.record(codes)
+    funds = fund_batch(codes)["data"]
+    names = [fund.get("name", "") for fund in funds]
+    nav_col = array("d", (_to_float(fund.get("nav")) for fund in funds))
+    estimate_col = array("d", (_to_float(fund.get("estimate_nav")) for fund in funds))
+    change_col = array("d", (_to_float(fund.get("estimate_change")) for fund in funds))
+    # 有估值用估值，否则用最新净值；当日每份收益 = 估值 - 昨日净值
+    price_col = array("d", (est if est > 0 else nav for est, nav in zip(estimate_col, nav_col)))
+    delta_col = array("d", (
+        est - nav if est > 0 and nav > 0 else 0.0 for est, nav in zip(estimate_col, nav_col)
+    ))
+    missing = [fund["code"] for fund in funds if fund.get("error") or not price_col[fund_index[fund["code"]]]]
+
+    # 持仓维度：市值 / 成本 / 当日收益
+    value_col = array("d", (shares * price_col[f] for shares, f in zip(shares_col, fund_col)))
+    # 取不到价格的持仓不计成本，避免拉低汇总收益
+    basis_col = array("d", (
+        shares * cost if price_col[f] > 0 else 0.0
+        for shares, cost, f in zip(shares_col, cost_col, fund_col)
+    ))
+    day_col = array("d", (shares * delta_col[f] for shares, f in zip(shares_col, fund_col)))
+
+    # 账户维度：按下标累加
+    account_count = len(accounts)
+    acc_value = array("d", bytes(8 * account_count))
+    acc_basis = array("d", bytes(8 * account_count))
+    acc_day = array("d", bytes(8 * account_count))
+    acc_count = array("l", bytes(account_col.itemsize * account_count))
+    for a, value, basis, day in zip(account_col, value_col, basis_col, day_col):
+        acc_value[a] += value
+        acc_basis[a] += basis
+        acc_day[a] += day
+        acc_count[a] += 1
+
+    def _summary(value, basis, day):
+        hold = value - basis
+        return {
+            "market_value": round(value, 2),
+            "cost": round(basis, 2),
+            "day_profit": round(day, 2),
+            "day_return": _ratio(day, value - day),
+            "hold_profit": round(hold, 2),
+            "hold_return": _ratio(hold, basis)
+        }
+
+    account_rows = []
+    for account, a in accounts.items():
+        row = {"account": account, "count": acc_count[a]}
+        row.update(_summary(acc_value[a], acc_basis[a], acc_day[a]))
+        account_rows.append(row)
+
+    data = {
+        "total": _summary(math.fsum(value_col), math.fsum(basis_col), math.fsum(day_col)),
+        "accounts": account_rows,
+        "missing": missing
+    }
+    if with_holdings:
+        account_names = list(accounts)
+        data["holdings"] = [
+            {
+                "code": codes[f],
+                "name": names[f],
+                "account": account_names[a],
+                "shares": shares,
+                "price": price_col[f],
+                "estimate_change": change_col[f],
+                "market_value": round(value, 2),
+                "day_profit": round(day, 2),
+                "hold_profit": round(value - basis, 2),
+                "hold_return": _ratio(value - basis, basis)
+            }
+            for f, a, shares, value, basis, day in zip(
+                fund_col, account_col, shares_col, value_col, basis_col, day_col
+            )
+        ]
+    return {"success": True, "data": data}
+
+
+# ==========================================
+# 市场模块
+# ==========================================
+
+def market_indices():
+    """获取主要指数"""
+    return _cached_call("indices", MARKET_INDICES_TTL, _load_market_indices, data_class="realtime")
+
+
+def _indices_from_push2():
+    try:
+        url = "https://push2.eastmoney.com/api/qt/ulist.np/get"
+        params = {
+            "fltt": "2",
+            "secids": "1.000001,0.399001,0.399006,1.000300",
+            "fields": "f2,f3,f4,f12,f14"
+        }
+        resp = _http_get(url, params=params, timeout=8, verify=False)
+        data = _safe_json(resp) or {}
+
+        indices = []
+        for item in data.get("data", {}).get("diff", []) or []:
+            change = item.get("f4", 0) or 0
+            change_pct = item.get("f3", 0) or 0
+            indices.append({
+                "name": item.get("f14", ""),
+                "value": str(item.get("f2", 0)),
+                "change": f"{'+' if change >= 0 else ''}{change}",
+                "change_percent": f"{'+' if change_pct >= 0 else ''}{change_pct}%"
+            })
+
+        if indices:
+            return {"success": True, "data": indices}
+    except requests.RequestException as e:
+        return {"success": False, "message": f"获取指数失败: {str(e)}"}
+    return {"success": False, "message": "获取指数失败: 指数数据为空"}
+
+
+def _indices_from_gtimg():
+    """备用方案：腾讯财经"""
+    try:
+        url = "https://qt.gtimg.cn/q=sh000001,sz399001,sz399006,sh000300"
+        resp = _http_get(url, timeout=8, verify=False)
+        text = resp.text
+
+        indices = []
+        names = ["上证指数", "深证成指", "创业板指", "沪深300"]
+        lines = text.strip().split('\n')
+
+        for i, line in enumerate(lines):
+            if '~' not in line:
+                continue
+            parts = line.split('~')
+            if len(parts) >= 35:
+                indices.append({
+                    "name": names[i] if i < len(names) else parts[1],
+                    "value": parts[3],
+                    "change": parts[31],
+                    "change_percent": f"{parts[32]}%"
+                })
+
+        if indices:
+            return {"success": True, "data": indices}
+    except requests.RequestException as e:
+        return {"success": False, "message": f"获取指数失败: {str(e)}"}
+    return {"success": False, "message": "获取指数失败: 指数数据为空"}
+
+
+MARKET_INDICES_CHAIN = FallbackChain("market_indices", [
+    ("push2:ulist", _indices_from_push2),
+    ("gtimg", _indices_from_gtimg),
+])
+
+
+def _load_market_indices():
+    return MARKET_INDICES_CHAIN.run()
+
+
+# ==========================================
+# 板块模块
+# ==========================================
+
+def sector_list():
+    """获取板块列表"""
+    return _cached_call("sector_list", SECTOR_LIST_TTL, _load_sector_list, data_class="realtime")
+
+
+def _load_sector_list():
+    try:
+        # 使用东方财富行业板块API - 使用URL编码的空格
+        url = "https://push2.eastmoney.com/api/qt/clist/get"
+        params = {
+            "fid": "f62",
+            "po": "1",
+            "pz": "100",
+            "pn": "1",
+            "np": "1",
+            "fltt": "2",
+            "invt": "2",
+            "ut": EASTMONEY_UT,
+            "fs": "m:90+t:2",
+            "fields": "f12,f14,f2,f3,f62,f184,f104,f105,f124"
         }
-        fund_data["stocks"] = futures["stocks"].result()
-        fund_data["year_change"] = futures["year_change"].result() or fund_data.get("year_change", "")
-        fund_data["sectors"] = futures["sectors"].result()
+        resp = _http_get(url, params=params, timeout=10, verify=False)
+        data = _safe_json(resp)
+        
+        sectors = []
+        if data and data.get("data", {}).get("diff"):
+            for item in data["data"]["diff"]:
+                change = item.get("f3", 0)
+                if change == "-" or change is None:
+                    change = 0
+                try:
+                    change_val = float(change)
+                except (ValueError, TypeError):
+                    change_val = 0
+                sectors.append({
+                    "name": item.get("f14", ""),
+                    "code": item.get("f12", ""),
+                    "change_percent": f"{'+' if change_val >= 0 else ''}{change_val}%",
+                    "up_count": item.get("f104", 0),
+                    "down_count": item.get("f105", 0),
+                    "price": item.get("f2"),
+                    "trade_date": _cst_date(item.get("f124")),
+                })
+        
+        if not sectors:
+            return {"success": False, "message": "板块数据为空"}
+
+        return {"success": True, "data": sectors}
+    except Exception as e:
+        return {"success": False, "message": f"获取板块失败: {str(e)}"}
+
+
+def _cst_date(timestamp=None):
+    """时间戳对应的北京时间日期（yyyymmdd 整数），无效时取当前日期"""
+    try:
+        timestamp = float(timestamp)
+    except (TypeError, ValueError):
+        timestamp = time.time()
+    if timestamp <= 0:
+        timestamp = time.time()
+    t = time.gmtime(timestamp + 8 * 3600)
+    return t.tm_year * 10000 + t.tm_mon * 100 + t.tm_mday
+
+
+def _int_to_date(value):
+    return date(value // 10000, value // 100 % 100, value % 100)
+
+
+def _has_trading_day_between(start, end):
+    """start 与 end（yyyymmdd）之间是否有被跳过的交易日，用于判断收盘价序列是否断档；节假日不算断档"""
+    day = _int_to_date(start) + timedelta(days=1)
+    end = _int_to_date(end)
+    while day < end:
+        if MARKET_CALENDAR.is_trading_day(day):
+            return True
+        day += timedelta(days=1)
+    return False
+
+
+def _fetch_sector_closes(sector_code):
+    """拉取板块最近日K，返回 [(yyyymmdd, close)]"""
+    url = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
+    params = {
+        "secid": f"90.{sector_code}",
+        "klt": "101",
+        "fqt": "1",
+        "lmt": str(SECTOR_HISTORY_DAYS),
+        "end": "20500101",
+        "fields1": "f1,f2,f3,f4,f5,f6",
+        "fields2": "f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61",
+        "ut": EASTMONEY_UT
+    }
+    resp = _http_get(url, params=params, timeout=10, verify=False)
+    data = resp.json()
+    bars = []
+    for item in (data.get("data") or {}).get("klines") or []:
+        parts = item.split(",")
+        if len(parts) >= 3:
+            try:
+                bars.append((int(parts[0].replace("-", "")), float(parts[2])))
+            except ValueError:
+                continue
+    return bars
+
+
+def _streak_from_closes(closes):
+    """从最新收盘价往前数连涨（正）/连跌（负）天数，持平即终止"""
+    streak = 0
+    last_sign = 0
+    for i in range(len(closes) - 1, 0, -1):
+        diff = closes[i] - closes[i - 1]
+        sign = 1 if diff > 0 else -1 if diff < 0 else 0
+        if sign == 0 or (last_sign and sign != last_sign):
+            break
+        last_sign = sign
+        streak += sign
+    return streak
+
+
+class SectorCloseStore:
+    """板块日收盘价序列（按板块存 array），持久化到本地
+
+    历史日K只在首次或序列断档时拉取一次；之后用 sector_list 的 clist 快照
+    追加/替换当日收盘价，所有板块的连涨天数在内存中一次算完。
+    """
+
+    def __init__(self, path, window=SECTOR_HISTORY_DAYS):
+        self.path = path
+        self.window = window
+        self._dates = {}
+        self._closes = {}
+        self._loaded = False
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        for code, (dates, closes) in stored.items():
+            self._dates[code] = array("i", dates)
+            self._closes[code] = array("d", closes)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            stored = {code: [list(self._dates[code]), list(self._closes[code])] for code in self._dates}
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def set_history(self, code, bars):
+        bars = bars[-self.window:]
+        with self._lock:
+            self._load()
+            self._dates[code] = array("i", (d for d, _ in bars))
+            self._closes[code] = array("d", (c for _, c in bars))
+            self._dirty = True
+
+    def apply_snapshot(self, code, trade_date, close):
+        """用快照价格更新最新一根K线；无历史或序列断档时返回 False，需要重新拉取"""
+        with self._lock:
+            self._load()
+            dates = self._dates.get(code)
+            if not dates:
+                return False
+            closes = self._closes[code]
+            last = dates[-1]
+            if trade_date == last:
+                if closes[-1] != close:
+                    closes[-1] = close
+                    self._dirty = True
+            elif trade_date > last:
+                if _has_trading_day_between(last, trade_date):
+                    return False
+                dates.append(trade_date)
+                closes.append(close)
+                if len(dates) > self.window:
+                    del dates[0]
+                    del closes[0]
+                self._dirty = True
+            return True
+
+    def streaks(self, codes):
+        with self._lock:
+            self._load()
+            return {code: _streak_from_closes(self._closes.get(code) or ()) for code in codes}
+
+
+SECTOR_CLOSES = SectorCloseStore(os.path.join(CACHE_DIR, "sector_closes.json"))
+
+
+def _sync_sector_closes(sectors):
+    """用板块快照更新收盘价序列，只为缺历史或断档的板块拉取日K"""
+    missing = {}
+    for sector in sectors:
+        try:
+            close = float(sector.get("price"))
+        except (TypeError, ValueError):
+            close = None
+        trade_date = sector.get("trade_date") or _cst_date()
+        if close is None or not SECTOR_CLOSES.apply_snapshot(sector["code"], trade_date, close):
+            missing[sector["code"]] = (trade_date, close)
+    if missing:
+        futures = {code: UPSTREAM.submit(_fetch_sector_closes, code) for code in missing}
+        UPSTREAM.wait(futures.values())
+        for code, future in futures.items():
+            if future.exception() is None and future.result():
+                SECTOR_CLOSES.set_history(code, future.result())
+                trade_date, close = missing[code]
+                if close is not None:
+                    SECTOR_CLOSES.apply_snapshot(code, trade_date, close)
+    SECTOR_CLOSES.save()
+
+
+def sector_streak(limit: int = None):
+    """获取板块连涨/连跌数据"""
+    limit_key = str(limit) if limit else "all"
+    return _cached_call(
+        f"sector_streak:{limit_key}", SECTOR_STREAK_TTL,
+        lambda: _load_sector_streak(limit), data_class="daily"
+    )
+
+
+def _load_sector_streak(limit):
+    try:
+        list_result = sector_list()
+        if not list_result.get("success"):
+            return list_result
+        
+        sectors = list_result["data"]
+        if limit:
+            sectors = sectors[:limit]
+        results = []
+
+        _sync_sector_closes(sectors)
+        streaks = SECTOR_CLOSES.streaks([s["code"] for s in sectors])
+        for sector in sectors:
+            sector = sector.copy()
+            sector["streak_days"] = streaks.get(sector["code"], 0)
+            results.append(sector)
+
+        return {"success": True, "data": results}
+    except Exception as e:
+        return {"success": False, "message": f"获取板块数据失败: {str(e)}"}
+
+
+def _fetch_sector_funds_by_code(sector_code):
+    url = "https://fund.eastmoney.com/data/FundGuideapi.aspx"
+    params = {
+        "dt": "4", "sd": "", "ed": "", "tp": sector_code,
+        "sc": "1n", "st": "desc", "pi": "1", "pn": "200",
+        "zf": "diy", "sh": "list", "rnd": str(random.random())
+    }
+    headers = {
+        "Referer": "https://fund.eastmoney.com/",
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+    }
+    resp = _http_get(url, params=params, headers=headers, timeout=15, verify=False)
+    text = resp.text.replace("var rankData =", "").strip()
+    if text.endswith(";"):
+        text = text[:-1]
+    data = json.loads(text)
+    funds = []
+    for item in data.get("datas", []):
+        parts = item.split(",")
+        if len(parts) >= 20:
+            funds.append({
+                "code": parts[0],
+                "name": parts[1],
+                "type": parts[3] if len(parts) > 3 else "",
+                "change": parts[16] if len(parts) > 16 and parts[16] else "0",
+                "year_change": parts[9] if len(parts) > 9 else "0"
+            })
+    return funds
+
+
+def sector_funds(sector_code, sector_name=""):
+    """获取板块内基金列表"""
+    return _cached_call(
+        f"sector_funds:{sector_code}", SECTOR_FUNDS_TTL,
+        lambda: _load_sector_funds(sector_code, sector_name), data_class="nav"
+    )
+
+
+def _load_sector_funds(sector_code, sector_name):
+    try:
+        funds = _fetch_sector_funds_by_code(sector_code)
+        if not funds and sector_name:
+            theme_code = _map_sector_to_theme_code(sector_name)
+            if theme_code and theme_code != sector_code:
+                funds = _fetch_sector_funds_by_code(theme_code)
+        
+        if not funds:
+            return {"success": False, "message": "板块基金数据为空"}
+
+        return {"success": True, "data": funds, "sector_name": sector_name}
+    except Exception as e:
+        return {"success": False, "message": f"获取板块基金失败: {str(e)}"}
+
+
+# ==========================================
+# 资讯模块
+# ==========================================
+
+def news_list():
+    """获取基金相关资讯"""
+    return _cached_call("news_list", NEWS_TTL, _load_news_list)
+
+
+def _load_news_list():
+    # 使用新浪财经滚动资讯
+    try:
+        url = "https://feed.mix.sina.com.cn/api/roll/get"
+        params = {"pageid": "153", "lid": "2517", "num": "20", "page": "1"}
+        resp = _http_get(url, params=params, timeout=10, verify=False)
+        data = resp.json()
+        
+        news = []
+        items = data.get("result", {}).get("data", [])
+        for item in items[:20]:
+            title = item.get("title", "")
+            summary = item.get("summary") or item.get("intro") or item.get("wapsummary") or ""
+            source = item.get("media_name", "新浪财经")
+            ctime = item.get("ctime") or item.get("intime")
+            try:
+                ts = int(ctime)
+                time_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
+            except Exception:
+                time_str = ""
+            url = item.get("url") or item.get("wapurl") or ""
+            if title:
+                news.append({
+                    "title": title,
+                    "summary": summary,
+                    "source": source,
+                    "time": time_str,
+                    "url": url
+                })
+        
+        if news:
+            return {"success": True, "data": news}
+    except Exception:
+        pass
+
+    return {"success": False, "message": "资讯数据获取失败"}
+
+
+# ==========================================
+# 实时推送模块（SSE）
+# ==========================================
 
-    result = {"success": True, "data": fund_data}
-    set_cache(cache_key, result, ttl=60)
+def _fetch_index_quotes(secids):
+    """ulist 批量获取指数行情，返回 {secid: {name, value, change, change_percent}}"""
+    result = {}
+    url = "https://push2.eastmoney.com/api/qt/ulist.np/get"
+    for i in range(0, len(secids), ULIST_MAX_SECIDS):
+        params = {
+            "fltt": "2",
+            "secids": ",".join(secids[i:i + ULIST_MAX_SECIDS]),
+            "fields": "f2,f3,f4,f12,f13,f14"
+        }
+        try:
+            resp = _http_get(url, params=params, timeout=8, verify=False)
+        except requests.RequestException:
+            continue
+        data = _safe_json(resp) or {}
+        for item in (data.get("data") or {}).get("diff") or []:
+            result[f"{item.get('f13')}.{item.get('f12')}"] = {
+                "name": item.get("f14", ""),
+                "value": item.get("f2"),
+                "change": item.get("f4"),
+                "change_percent": item.get("f3")
+            }
     return result
 
 
-def fund_batch(codes):
-    """批量获取基金信息"""
-    results = []
-    
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(fund_info, code): code for code in codes}
-        for future in as_completed(futures):
-            code = futures[future]
-            try:
-                result = future.result()
-                if result.get("success"):
-                    results.append(result["data"])
+class LiveHub:
+    """实时行情的发布/订阅中心
+
+    一个后台线程按所有连接订阅的代码并集轮询（基金走 fund_batch 共享缓存与批量接口，
+    指数走 ulist），上游请求量只与不同代码数有关。每个主题保存最新值，
+    变化时只发布改动的字段，事件编号单调递增并保留最近 LIVE_EVENT_LOG 条供续传。
+    """
+
+    def __init__(self):
+        # 事件编号带上进程标识，换实例续传时退回全量快照
+        self.epoch = f"{os.getpid():x}{int(time.time()) & 0xffff:04x}"
+        self._cond = threading.Condition()
+        self._log = deque(maxlen=LIVE_EVENT_LOG)
+        self._seq = 0
+        self._values = {}
+        self._refs = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self.polls = 0
+
+    # ---- 订阅 ----
+
+    def subscribe(self, topics):
+        with self._cond:
+            fresh = False
+            for topic in topics:
+                self._refs[topic] = self._refs.get(topic, 0) + 1
+                fresh = fresh or topic not in self._values
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="live-hub", daemon=True)
+                self._thread.start()
+        if fresh:
+            self._wake.set()
+
+    def unsubscribe(self, topics):
+        with self._cond:
+            for topic in topics:
+                count = self._refs.get(topic, 0) - 1
+                if count > 0:
+                    self._refs[topic] = count
                 else:
-                    results.append({"code": code, "error": result.get("message", "未知错误")})
-            except Exception as e:
-                results.append({"code": code, "error": str(e)})
-    
-    code_order = {code: i for i, code in enumerate(codes)}
-    results.sort(key=lambda x: code_order.get(x.get("code", ""), 999))
-    
-    return {"success": True, "data": results}
+                    self._refs.pop(topic, None)
 
+    def snapshot(self, topics):
+        with self._cond:
+            return self._seq, {topic: dict(self._values[topic]) for topic in topics if topic in self._values}
 
-def fund_hot():
-    """获取热门基金"""
-    cache_key = "hot_funds"
-    cached = get_cache(cache_key, ttl=FUND_HOT_TTL)
-    if cached:
-        return cached
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
 
-    data, err = _tiantian_action(
-        "fundMNRank",
-        {
-            "FundType": "0",
-            "SortColumn": "SALESRANK_D",
-            "Sort": "desc",
-            "pageIndex": "1",
-            "pageSize": "20"
-        },
-        timeout=8
-    )
-    if data and data.get("Datas"):
-        results = []
-        for item in data["Datas"]:
-            code = item.get("FCODE", "")
-            name = item.get("SHORTNAME", "") or item.get("FULLNAME", "")
-            change = item.get("RZDF") or "0"
-            if not code or len(code) != 6:
-                continue
-            if "货币" in (name or ""):
-                continue
-            results.append({
-                "code": code,
-                "name": name,
-                "change": change,
-                "type": ""
-            })
-            if len(results) >= 20:
-                break
-        if results:
-            result = {"success": True, "data": results}
-            set_cache(cache_key, result, ttl=FUND_HOT_TTL)
-            return result
+    def parse_event_id(self, value):
+        """解析 Last-Event-ID，不属于本实例时返回 None"""
+        epoch, _, seq = (value or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
 
-    try:
-        url = "https://fund.eastmoney.com/data/rankhandler.aspx"
-        params = {
-            "op": "ph", "dt": "kf", "ft": "all", "rs": "", "gs": "0",
-            "sc": "rzdf", "st": "desc", "pi": "1", "pn": "20", "dx": "1"
-        }
-        headers = {
-            "Referer": "https://fund.eastmoney.com/",
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
-        }
-        resp = SESSION.get(url, params=params, headers=headers, timeout=10, verify=False)
+    def wait(self, cursor, topics, timeout):
+        """等待 cursor 之后的事件；返回 (新 cursor, 事件列表)，事件已被日志淘汰时返回 (cursor, None)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > cursor, timeout=timeout)
+            if self._log and self._log[0][0] > cursor + 1:
+                return cursor, None
+            events = [event for event in self._log if event[0] > cursor and event[1] in topics]
+            return self._seq, events
 
-        text = resp.text
-        match = re.search(r'datas:\[(.*?)\]', text)
-        if not match:
-            return {"success": False, "message": "解析数据失败"}
+    # ---- 发布 ----
 
-        results = []
-        items = match.group(1).split('","')
-        for item in items[:20]:
-            parts = item.strip('"').split(',')
-            if len(parts) >= 7:
-                if "货币" in (parts[1] or ""):
-                    # 过滤货币型基金，避免进入详情页无有效数据
+    def publish(self, topic, values):
+        with self._cond:
+            old = self._values.get(topic, {})
+            changes = {key: value for key, value in values.items() if old.get(key) != value}
+            if not changes:
+                return
+            self._values[topic] = dict(values)
+            self._seq += 1
+            self._log.append((self._seq, topic, changes))
+            self._cond.notify_all()
+
+    def _poll(self, topics):
+        codes = [topic[5:] for topic in topics if topic.startswith("fund:")]
+        secids = [topic[6:] for topic in topics if topic.startswith("index:")]
+        if codes:
+            for fund in fund_batch(codes)["data"]:
+                if fund.get("error"):
                     continue
-                results.append({
-                    "code": parts[0],
-                    "name": parts[1],
-                    "change": parts[6] if parts[6] else "0",
-                    "type": "混合型"
+                self.publish(f"fund:{fund['code']}", {
+                    key: fund.get(key)
+                    for key in ("name", "nav", "nav_date", "estimate_nav", "estimate_change", "estimate_time")
                 })
+        if secids:
+            for secid, quote in _fetch_index_quotes(secids).items():
+                self.publish(f"index:{secid}", quote)
+        self.polls += 1
 
-        result = {"success": True, "data": results}
-        set_cache(cache_key, result, ttl=FUND_HOT_TTL)
-        return result
-    except requests.RequestException as e:
-        return {"success": False, "message": f"获取热门失败: {str(e)}"}
+    def _run(self):
+        idle_since = None
+        while True:
+            with self._cond:
+                topics = list(self._refs)
+                if not topics:
+                    idle_since = idle_since or time.time()
+                    if time.time() - idle_since > LIVE_IDLE_EXIT:
+                        self._thread = None
+                        return
+                else:
+                    idle_since = None
+            if topics:
+                try:
+                    self._poll(topics)
+                except Exception:
+                    pass
+            # 前后放宽 15 分钟，覆盖集合竞价与收盘后的估值修正
+            interval = LIVE_POLL_INTERVAL if MARKET_CALENDAR.is_open(margin=15) else LIVE_IDLE_POLL_INTERVAL
+            self._wake.wait(interval if topics else LIVE_HEARTBEAT)
+            self._wake.clear()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "topics": len(self._refs),
+                "subscribers": sum(self._refs.values()),
+                "seq": self._seq,
+                "polls": self.polls
+            }
+
+
+LIVE_HUB = LiveHub()
 
 
+def _sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def live_stream(codes, secids, last_event_id=None):
+    """SSE 推送订阅基金与指数的变化字段
+
+    连接时先发 snapshot（或按 Last-Event-ID 补发错过的 update），之后只发 update，
+    空闲时每 LIVE_HEARTBEAT 秒发注释行心跳；连接到 LIVE_MAX_DURATION 后由客户端自动重连续传。
+    """
+    topics = [f"fund:{code}" for code in codes] + [f"index:{secid}" for secid in secids]
+    topics = list(dict.fromkeys(topics))
+    if not topics:
+        return {"success": False, "message": "请提供基金代码或指数代码"}
+    if len(topics) > LIVE_MAX_TOPICS:
+        return {"success": False, "message": f"订阅数超过上限 {LIVE_MAX_TOPICS}"}
+
+    hub = LIVE_HUB
+    wanted = set(topics)
+
+    def _events():
+        deadline = time.time() + LIVE_MAX_DURATION
+        hub.subscribe(topics)
+        try:
+            yield b"retry: 3000\n\n"
+            cursor = hub.parse_event_id(last_event_id)
+            events = None
+            if cursor is not None:
+                cursor, events = hub.wait(cursor, wanted, timeout=0)
+            if events is None:
+                cursor, values = hub.snapshot(topics)
+                yield _sse("snapshot", values, hub.event_id(cursor))
+                events = []
+            last_sent = time.time()
+            while time.time() < deadline:
+                for seq, topic, changes in events:
+                    yield _sse("update", {"topic": topic, "changes": changes}, hub.event_id(seq))
+                    last_sent = time.time()
+                if time.time() - last_sent >= LIVE_HEARTBEAT:
+                    yield b": ping\n\n"
+                    last_sent = time.time()
+                timeout = min(LIVE_HEARTBEAT - (time.time() - last_sent), deadline - time.time())
+                cursor, events = hub.wait(cursor, wanted, timeout=max(timeout, 0))
+                if events is None:
+                    # 错过的事件已被淘汰，重发全量快照
+                    cursor, values = hub.snapshot(topics)
+                    yield _sse("snapshot", values, hub.event_id(cursor))
+                    last_sent = time.time()
+                    events = []
+        finally:
+            hub.unsubscribe(topics)
+
+    return StreamResponse(_events(), "text/event-stream; charset=utf-8")
 
 
 # ==========================================
-# 市场模块
+# 缓存预热
 # ==========================================
 
-def market_indices():
-    """获取主要指数"""
-    cache_key = "indices"
-    cached = get_cache(cache_key, ttl=30)
-    if cached:
-        return cached
+class TrafficTracker:
+    """按指数衰减计数统计基金代码的访问热度，供预热挑选 top-N"""
 
-    try:
-        url = "https://push2.eastmoney.com/api/qt/ulist.np/get"
-        params = {
-            "fltt": "2",
-            "secids": "1.000001,0.399001,0.399006,1.000300",
-            "fields": "f2,f3,f4,f12,f14"
-        }
-        resp = SESSION.get(url, params=params, timeout=8, verify=False)
-        data = _safe_json(resp) or {}
+    def __init__(self, path, half_life=TRAFFIC_HALF_LIFE, max_keys=TRAFFIC_MAX_KEYS):
+        self.path = path
+        self.half_life = half_life
+        self.max_keys = max_keys
+        self._scores = {}
+        self._loaded = False
+        self._lock = threading.Lock()
 
-        indices = []
-        for item in data.get("data", {}).get("diff", []) or []:
-            change = item.get("f4", 0) or 0
-            change_pct = item.get("f3", 0) or 0
-            indices.append({
-                "name": item.get("f14", ""),
-                "value": str(item.get("f2", 0)),
-                "change": f"{'+' if change >= 0 else ''}{change}",
-                "change_percent": f"{'+' if change_pct >= 0 else ''}{change_pct}%"
-            })
+    def _decayed(self, score, ts, now):
+        return score * 0.5 ** ((now - ts) / self.half_life)
 
-        if indices:
-            result = {"success": True, "data": indices}
-            set_cache(cache_key, result, ttl=30)
-            return result
-    except requests.RequestException as e:
-        last_error = str(e)
-    else:
-        last_error = "指数数据为空"
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            self._scores = {code: (float(score), float(ts)) for code, (score, ts) in stored.items()}
+        except (OSError, ValueError, TypeError):
+            self._scores = {}
 
-    # 备用方案：腾讯财经
-    try:
-        url = "https://qt.gtimg.cn/q=sh000001,sz399001,sz399006,sh000300"
-        resp = SESSION.get(url, timeout=8, verify=False)
-        text = resp.text
+    def record(self, codes):
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            for code in codes:
+                score, ts = self._scores.get(code, (0.0, now))
+                self._scores[code] = (self._decayed(score, ts, now) + 1, now)
+            if len(self._scores) > self.max_keys:
+                # 超限时丢掉热度较低的一半
+                keep = self.top(self.max_keys // 2, _locked=True)
+                self._scores = {code: self._scores[code] for code in keep}
 
-        indices = []
-        names = ["上证指数", "深证成指", "创业板指", "沪深300"]
-        lines = text.strip().split('\n')
+    def top(self, n, _locked=False):
+        now = time.time()
+        if not _locked:
+            with self._lock:
+                self._ensure_loaded()
+                items = list(self._scores.items())
+        else:
+            items = list(self._scores.items())
+        best = heapq.nlargest(n, items, key=lambda item: self._decayed(item[1][0], item[1][1], now))
+        return [code for code, _ in best]
 
-        for i, line in enumerate(lines):
-            if '~' not in line:
+    def save(self):
+        with self._lock:
+            if not self._loaded:
+                return
+            scores = dict(self._scores)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(scores, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+TRAFFIC = TrafficTracker(os.path.join(CACHE_DIR, "traffic.json"))
+atexit.register(TRAFFIC.save)
+
+# name, priority（越小越先）, cost（估算上游请求数）, cache key, 基础 ttl, 数据类别, loader
+WarmJob = namedtuple("WarmJob", "name priority cost key ttl data_class loader")
+
+WARM_JOBS = [
+    WarmJob("indices", 0, 1, "indices", MARKET_INDICES_TTL, "realtime", lambda: _load_market_indices()),
+    WarmJob("sector_list", 1, 1, "sector_list", SECTOR_LIST_TTL, "realtime", lambda: _load_sector_list()),
+    WarmJob("hot_funds", 2, 2, "hot_funds", FUND_HOT_TTL, "daily", lambda: _load_fund_hot()),
+    WarmJob(
+        "sector_streak", 2, 10, "sector_streak:all", SECTOR_STREAK_TTL, "daily",
+        lambda: _load_sector_streak(None)
+    ),
+    WarmJob("news", 3, 1, "news_list", NEWS_TTL, None, lambda: _load_news_list()),
+]
+
+
+class CacheWarmer:
+    """在热点 key 到期前主动刷新，用户请求尽量命中热缓存
+
+    每轮按优先级遍历注册的 key 与访问量 top-N 的基金：剩余新鲜时间低于 lead（带随机抖动）
+    的条目在 WARM_BUDGET 上游请求预算内刷新，超出预算的留到下一轮。
+    既可由 cron 调用 run_once，也可在常驻进程中 start 后台循环。
+    """
+
+    def __init__(self, jobs, interval=WARM_INTERVAL, budget=WARM_BUDGET):
+        self.jobs = jobs
+        self.interval = interval
+        self.budget = budget
+        self._thread = None
+        self._stop = threading.Event()
+        self.runs = 0
+
+    def _lead(self, ttl):
+        lead = max(ttl * WARM_LEAD_RATIO, self.interval * 1.5)
+        return lead * random.uniform(1, 1 + WARM_JITTER)
+
+    def _due(self, key, ttl):
+        remaining = CACHE.remaining(key)
+        if remaining is None:
+            # 内存中没有时再看共享缓存与磁盘（冷启动实例、其他进程已刷新），命中时回填内存
+            entry = _peek_cache(key)
+            if entry is not None:
+                _, age, entry_ttl = entry
+                remaining = entry_ttl - age
+        return remaining is None or remaining <= self._lead(ttl)
+
+    def _refresh(self, job):
+        ttl = MARKET_CALENDAR.ttl(job.data_class, job.ttl) if job.data_class else job.ttl
+        result = SINGLE_FLIGHT.do(
+            job.key, lambda: _load_and_store(job.key, ttl, job.loader, job.ttl * CACHE_STALE_RATIO)
+        )
+        return _is_cacheable(result)
+
+    def _fund_job(self):
+        ttl = MARKET_CALENDAR.ttl("nav", FUND_INFO_TTL)
+        codes = [code for code in TRAFFIC.top(WARM_TOP_FUNDS) if self._due(f"info:{code}", ttl)]
+        if not codes:
+            return None
+        cost = -(-len(codes) // BULK_ESTIMATE_CHUNK)
+        return WarmJob(
+            f"funds({len(codes)})", 1, cost, None, FUND_INFO_TTL, "nav",
+            lambda: bool(_refresh_fund_infos(codes, ttl))
+        )
+
+    def run_once(self):
+        """执行一轮预热，返回各 key 的处理结果"""
+        report = {"refreshed": [], "fresh": [], "deferred": [], "failed": []}
+        due = []
+        for job in self.jobs:
+            base = MARKET_CALENDAR.ttl(job.data_class, job.ttl) if job.data_class else job.ttl
+            if self._due(job.key, base):
+                due.append(job)
+            else:
+                report["fresh"].append(job.name)
+        fund_job = self._fund_job()
+        if fund_job:
+            due.append(fund_job)
+
+        budget = self.budget
+        selected = []
+        for job in sorted(due, key=lambda j: j.priority):
+            if job.cost > budget:
+                report["deferred"].append(job.name)
                 continue
-            parts = line.split('~')
-            if len(parts) >= 35:
-                indices.append({
-                    "name": names[i] if i < len(names) else parts[1],
-                    "value": parts[3],
-                    "change": parts[31],
-                    "change_percent": f"{parts[32]}%"
-                })
+            budget -= job.cost
+            selected.append(job)
+
+        def _run(job):
+            return job.loader() if job.key is None else self._refresh(job)
+
+        futures = {job.name: UPSTREAM.submit(_run, job) for job in selected}
+        UPSTREAM.wait(futures.values())
+        for name, future in futures.items():
+            try:
+                ok = future.result()
+            except Exception:
+                ok = False
+            report["refreshed" if ok else "failed"].append(name)
+        self.runs += 1
+        TRAFFIC.save()
+        return report
+
+    def start(self):
+        """常驻进程中启动后台预热循环"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                pass
+            self._stop.wait(self.interval * random.uniform(1 - WARM_JITTER / 2, 1 + WARM_JITTER / 2))
 
-        if indices:
-            result = {"success": True, "data": indices}
-            set_cache(cache_key, result, ttl=30)
-            return result
-    except requests.RequestException as e:
-        last_error = str(e)
 
-    return {"success": False, "message": f"获取指数失败: {last_error}"}
+WARMER = CacheWarmer(WARM_JOBS)
 
 
 # ==========================================
-# 板块模块
+# 响应序列化
 # ==========================================
 
-def sector_list():
-    """获取板块列表"""
-    cache_key = "sector_list"
-    cached = get_cache(cache_key, ttl=300)
-    if cached:
-        return cached
-    
-    try:
-        # 使用东方财富行业板块API - 使用URL编码的空格
-        url = "https://push2.eastmoney.com/api/qt/clist/get"
-        params = {
-            "fid": "f62",
-            "po": "1",
-            "pz": "100",
-            "pn": "1",
-            "np": "1",
-            "fltt": "2",
-            "invt": "2",
-            "ut": EASTMONEY_UT,
-            "fs": "m:90+t:2",
-            "fields": "f12,f14,f2,f3,f62,f184,f104,f105"
-        }
-        resp = SESSION.get(url, params=params, timeout=10, verify=False)
-        data = _safe_json(resp)
-        
-        sectors = []
-        if data and data.get("data", {}).get("diff"):
-            for item in data["data"]["diff"]:
-                change = item.get("f3", 0)
-                if change == "-" or change is None:
-                    change = 0
-                try:
-                    change_val = float(change)
-                except (ValueError, TypeError):
-                    change_val = 0
-                sectors.append({
-                    "name": item.get("f14", ""),
-                    "code": item.get("f12", ""),
-                    "change_percent": f"{'+' if change_val >= 0 else ''}{change_val}%",
-                    "up_count": item.get("f104", 0),
-                    "down_count": item.get("f105", 0),
-                })
-        
-        if not sectors:
-            return {"success": False, "message": "板块数据为空"}
+class Payload:
+    """一个结果对象的序列化形式：UTF-8 字节、弱 ETag 与按需生成的 gzip 前缀
+
+    `_ms` 每次请求都不同，不参与序列化和 ETag，输出时拼接到 JSON 末尾；
+    gzip 前缀的压缩器状态保存下来，每次只需 copy 后压缩这段尾巴。
+    """
+
+    def __init__(self, result):
+        raw = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        # 去掉结尾的 }，留给 render 拼接 _ms
+        self.head = raw[:-1]
+        self.sep = b", " if len(raw) > 2 else b""
+        self.etag = 'W/"%s"' % hashlib.blake2b(raw, digest_size=12).hexdigest()
+        self._gzip = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.head) + 1
+
+    def _tail(self, ms):
+        return b'%s"_ms": %d}' % (self.sep, ms)
+
+    def render(self, ms):
+        return self.head + self._tail(ms)
+
+    def render_gzip(self, ms):
+        if self._gzip is None:
+            with self._lock:
+                if self._gzip is None:
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                    self._gzip = (compressor.compress(self.head), compressor)
+        prefix, compressor = self._gzip
+        compressor = compressor.copy()
+        return prefix + compressor.compress(self._tail(ms)) + compressor.flush()
+
+
+# 当前上下文中最近一次 _cached_call 返回的缓存对象
+_CACHED_RESULT = contextvars.ContextVar("cached_result", default=None)
+
+
+class PayloadCache:
+    """按结果对象 id 缓存 Payload
+
+    缓存命中时路由返回的是同一个对象，据此复用序列化结果；
+    条目同时持有结果对象，保证 id 在条目存活期间不会被复用。
+    只有路由直接返回 _cached_call 结果时才入缓存，每次新建的结果（批量、搜索、持仓估值等）只序列化一次。
+    """
+
+    def __init__(self, max_entries=PAYLOAD_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, result):
+        # 软过期结果与失败结果每次都是新对象，不缓存
+        if (
+            "_age" in result or "_trace" in result or not result.get("success")
+            or _CACHED_RESULT.get() is not result
+        ):
+            return Payload(result)
+        key = id(result)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is result:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        payload = Payload(result)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (result, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+
+PAYLOADS = PayloadCache()
+
+# 各端点的 (数据类别, 缓存时长)，用于生成 Cache-Control；类别为 None 时不随交易时段变化
+ROUTE_TTLS = {
+    ("fund", "search"): (None, CACHE_TTL),
+    ("fund", "info"): ("nav", FUND_INFO_TTL),
+    ("fund", "detail"): ("nav", FUND_DETAIL_TTL),
+    ("fund", "batch"): ("nav", FUND_INFO_TTL),
+    ("fund", "hot"): ("daily", FUND_HOT_TTL),
+    ("fund", "history"): ("nav", NAV_HISTORY_SYNC_TTL),
+    ("market", "indices"): ("realtime", MARKET_INDICES_TTL),
+    ("sector", "list"): ("realtime", SECTOR_LIST_TTL),
+    ("sector", "streak"): ("daily", SECTOR_STREAK_TTL),
+    ("sector", "funds"): ("nav", SECTOR_FUNDS_TTL),
+    ("news", "list"): (None, NEWS_TTL),
+}
+
+
+def _cache_control(params, result, method="GET"):
+    """按端点 TTL 生成 Cache-Control；失败结果、追踪结果与 POST 不缓存
+
+    休市期间随服务端缓存一起延长，但不超过 BROWSER_MAX_AGE，靠 ETag 重新验证。
+    """
+    module = params.get('module', [''])[0] or 'fund'
+    action = params.get('action', [''])[0]
+    route = ROUTE_TTLS.get((module, action))
+    if method != "GET" or not route or not result.get("success") or "_trace" in result:
+        return "no-store"
+    data_class, base = route
+    ttl = min(MARKET_CALENDAR.ttl(data_class, base), BROWSER_MAX_AGE) if data_class else base
+    swr = int(base * CACHE_STALE_RATIO)
+    if result.get("_stale"):
+        return f"public, max-age=0, s-maxage=0, stale-while-revalidate={swr}"
+    return f"public, max-age={ttl}, s-maxage={ttl}, stale-while-revalidate={swr}"
+
+
+def _authorized(module, header):
+    """预热与指标端点的鉴权；Vercel Cron 以 Authorization: Bearer <CRON_SECRET> 调用，未配置密钥时不限制"""
+    secret = {"warm": CRON_SECRET, "metrics": METRICS_TOKEN}.get(module)
+    return not secret or header == f"Bearer {secret}"
+
 
-        result = {"success": True, "data": sectors}
-        set_cache(cache_key, result, ttl=300)
-        return result
-    except Exception as e:
-        return {"success": False, "message": f"获取板块失败: {str(e)}"}
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match 采用弱比较
+    opaque = etag[2:]
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
 
 
-def _calc_sector_streak_days(sector_code):
-    """根据最近日K计算板块连涨/连跌天数"""
-    # 单板块连涨结果缓存，减少重复K线请求
-    cache_key = f"sector_streak:{sector_code}"
-    cached = get_cache(cache_key, ttl=SECTOR_STREAK_ITEM_TTL)
-    if cached is not None:
-        return cached
-    url = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
-    params = {
-        "secid": f"90.{sector_code}",
-        "klt": "101",
-        "fqt": "1",
-        "lmt": "10",
-        "end": "20500101",
-        "fields1": "f1,f2,f3,f4,f5,f6",
-        "fields2": "f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61",
-        "ut": EASTMONEY_UT
-    }
-    resp = SESSION.get(url, params=params, timeout=10, verify=False)
-    data = resp.json()
-    if not data.get("data", {}).get("klines"):
-        return 0
+class StreamResponse:
+    """流式响应：handler 不做序列化缓存，逐块写出 chunks 产生的字节"""
 
-    klines = data["data"]["klines"]
-    if len(klines) < 2:
-        return 0
+    def __init__(self, chunks, content_type):
+        self.chunks = chunks
+        self.content_type = content_type
 
-    closes = []
-    for item in klines:
-        parts = item.split(",")
-        if len(parts) >= 3:
-            try:
-                closes.append(float(parts[2]))
-            except ValueError:
-                continue
 
-    if len(closes) < 2:
-        return 0
+# ==========================================
+# 组合请求模块
+# ==========================================
 
-    streak = 0
-    last_sign = 0
-    for i in range(len(closes) - 1, 0, -1):
-        diff = closes[i] - closes[i - 1]
-        sign = 1 if diff > 0 else -1 if diff < 0 else 0
-        if sign == 0:
-            break
-        if last_sign == 0:
-            last_sign = sign
-            streak = 1 if sign > 0 else -1
-            continue
-        if sign == last_sign:
-            streak = streak + 1 if sign > 0 else streak - 1
+def _parse_sub_requests(raw):
+    """子请求列表：每项为参数 dict 或查询串，转换为 handle_request 的参数格式"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return None, "子请求格式错误"
+    if not isinstance(raw, list) or not raw:
+        return None, "请提供子请求列表"
+    if len(raw) > MULTI_MAX_REQUESTS:
+        return None, f"子请求数超过上限 {MULTI_MAX_REQUESTS}"
+    subs = []
+    for i, item in enumerate(raw):
+        if isinstance(item, str):
+            params = parse_qs(item.lstrip("?"))
+        elif isinstance(item, dict):
+            params = {
+                key: [str(v) for v in value] if isinstance(value, list) else [str(value)]
+                for key, value in item.items()
+            }
         else:
-            break
-    set_cache(cache_key, streak, ttl=SECTOR_STREAK_ITEM_TTL)
-    return streak
+            return None, "子请求格式错误"
+        module = params.get('module', [''])[0]
+        if module == 'multi':
+            return None, "子请求不能嵌套组合请求"
+        # 预热与指标端点的鉴权只在 handler 入口检查，不能经组合请求绕过
+        if module in ('warm', 'metrics'):
+            return None, f"子请求不支持 {module} 模块"
+        sub_id = params.pop('id', [str(i)])[0]
+        subs.append((sub_id, params))
+    return subs, None
 
 
-def sector_streak(limit: int = None):
-    """获取板块连涨/连跌数据"""
-    limit_key = str(limit) if limit else "all"
-    cache_key = f"sector_streak:{limit_key}"
-    cached = get_cache(cache_key, ttl=SECTOR_STREAK_TTL)
-    if cached:
-        return cached
-    
+def _run_sub_request(sub_id, params):
+    start = time.perf_counter()
     try:
-        list_result = sector_list()
-        if not list_result.get("success"):
-            return list_result
-        
-        sectors = list_result["data"]
-        if limit:
-            sectors = sectors[:limit]
-        results = []
+        result = handle_request(params)
+        if isinstance(result, StreamResponse):
+            result = {"success": False, "message": "组合请求不支持流式子请求"}
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+    # 结果可能直接来自缓存，复制后再附加字段
+    item = {"id": sub_id}
+    item.update(result)
+    item["_ms"] = round((time.perf_counter() - start) * 1000)
+    return item
 
-        max_workers = min(12, max(1, len(sectors)))
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(_calc_sector_streak_days, s["code"]): s for s in sectors}
-            for future in as_completed(futures):
-                sector = futures[future]
-                try:
-                    streak = future.result()
-                except Exception:
-                    streak = 0
-                sector = sector.copy()
-                sector["streak_days"] = streak
-                results.append(sector)
 
-        code_order = {s["code"]: i for i, s in enumerate(sectors)}
-        results.sort(key=lambda x: code_order.get(x.get("code", ""), 999))
+def _iter_completed(futures):
+    """按完成顺序产出 future；线程池繁忙时由当前线程代跑尚未开始的任务"""
+    remaining = list(futures)
+    while remaining:
+        done, _ = concurrent_futures.wait(remaining, timeout=0.05, return_when=concurrent_futures.FIRST_COMPLETED)
+        if not done:
+            for future in remaining:
+                UPSTREAM.run_pending(future)
+                if future.done():
+                    break
+            continue
+        for future in done:
+            remaining.remove(future)
+            yield future
 
-        result = {"success": True, "data": results}
-        set_cache(cache_key, result, ttl=SECTOR_STREAK_TTL)
-        return result
-    except Exception as e:
-        return {"success": False, "message": f"获取板块数据失败: {str(e)}"}
 
+def multi_request(raw, stream=False):
+    """组合请求：子请求在共享上游执行器上并发执行，单项失败不影响其他项
 
-def _fetch_sector_funds_by_code(sector_code):
-    url = "https://fund.eastmoney.com/data/FundGuideapi.aspx"
-    params = {
-        "dt": "4", "sd": "", "ed": "", "tp": sector_code,
-        "sc": "1n", "st": "desc", "pi": "1", "pn": "200",
-        "zf": "diy", "sh": "list", "rnd": str(random.random())
-    }
-    headers = {
-        "Referer": "https://fund.eastmoney.com/",
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
-    }
-    resp = SESSION.get(url, params=params, headers=headers, timeout=15, verify=False)
-    text = resp.text.replace("var rankData =", "").strip()
-    if text.endswith(";"):
-        text = text[:-1]
-    data = json.loads(text)
-    funds = []
-    for item in data.get("datas", []):
-        parts = item.split(",")
-        if len(parts) >= 20:
-            funds.append({
-                "code": parts[0],
-                "name": parts[1],
-                "type": parts[3] if len(parts) > 3 else "",
-                "change": parts[16] if len(parts) > 16 and parts[16] else "0",
-                "year_change": parts[9] if len(parts) > 9 else "0"
-            })
-    return funds
+    外层 success 只表示组合请求本身有效，各项以自身 success 标记成败；
+    stream 时以 NDJSON 按完成顺序逐行返回，最后一行为 {"done": true, "failed": n}。
+    """
+    subs, err = _parse_sub_requests(raw)
+    if err:
+        return {"success": False, "message": err}
 
+    start = time.perf_counter()
+    futures = [UPSTREAM.submit(_run_sub_request, sub_id, params) for sub_id, params in subs]
 
-def sector_funds(sector_code, sector_name=""):
-    """获取板块内基金列表"""
-    cache_key = f"sector_funds:{sector_code}"
-    cached = get_cache(cache_key, ttl=SECTOR_FUNDS_TTL)
-    if cached:
-        return cached
-    
-    try:
-        funds = _fetch_sector_funds_by_code(sector_code)
-        if not funds and sector_name:
-            theme_code = _map_sector_to_theme_code(sector_name)
-            if theme_code and theme_code != sector_code:
-                funds = _fetch_sector_funds_by_code(theme_code)
-        
-        if not funds:
-            return {"success": False, "message": "板块基金数据为空"}
+    if not stream:
+        UPSTREAM.wait(futures)
+        items = [future.result() for future in futures]
+        return {"success": True, "data": items}
 
-        result = {"success": True, "data": funds, "sector_name": sector_name}
-        set_cache(cache_key, result, ttl=SECTOR_FUNDS_TTL)
-        return result
-    except Exception as e:
-        return {"success": False, "message": f"获取板块基金失败: {str(e)}"}
+    def _lines():
+        failed = 0
+        for future in _iter_completed(futures):
+            item = future.result()
+            failed += not item.get("success")
+            yield json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n"
+        tail = {"done": True, "failed": failed, "_ms": round((time.perf_counter() - start) * 1000)}
+        yield json.dumps(tail).encode("utf-8") + b"\n"
+
+    return StreamResponse(_lines(), "application/x-ndjson; charset=utf-8")
 
 
 # ==========================================
-# 资讯模块
+# 路由处理
 # ==========================================
 
-def news_list():
-    """获取基金相关资讯"""
-    cache_key = "news_list"
-    cached = get_cache(cache_key, ttl=300)
-    if cached:
-        return cached
-    
-    # 使用新浪财经滚动资讯
+def handle_request(params, body=None):
+    """根据参数路由到不同的处理函数，body 为 POST 的 JSON 请求体
+
+    debug=trace 时在结果中附带 _trace 调用瀑布；按 TRACE_SAMPLE_RATE 采样的请求只记录最慢的若干条。
+    debug 请求不参与采样、不写入追踪文件，避免客户端刷满磁盘。
+    """
+    debug = params.get('debug', [''])[0] == 'trace'
+    sampled = not debug and TRACE_SAMPLER.sampled()
+    if not debug and not sampled:
+        return _route(params, body)
+
+    trace = Trace()
+    token = _TRACE.set(trace)
     try:
-        url = "https://feed.mix.sina.com.cn/api/roll/get"
-        params = {"pageid": "153", "lid": "2517", "num": "20", "page": "1"}
-        resp = SESSION.get(url, params=params, timeout=10, verify=False)
-        data = resp.json()
-        
-        news = []
-        items = data.get("result", {}).get("data", [])
-        for item in items[:20]:
-            title = item.get("title", "")
-            summary = item.get("summary") or item.get("intro") or item.get("wapsummary") or ""
-            source = item.get("media_name", "新浪财经")
-            ctime = item.get("ctime") or item.get("intime")
-            try:
-                ts = int(ctime)
-                time_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
-            except Exception:
-                time_str = ""
-            url = item.get("url") or item.get("wapurl") or ""
-            if title:
-                news.append({
-                    "title": title,
-                    "summary": summary,
-                    "source": source,
-                    "time": time_str,
-                    "url": url
-                })
-        
-        if news:
-            result = {"success": True, "data": news}
-            set_cache(cache_key, result, ttl=300)
-            return result
-    except Exception:
-        pass
+        result = _route(params, body)
+    finally:
+        _TRACE.reset(token)
+    if sampled:
+        route = MetricsRegistry.route_name(params.get('module', [''])[0], params.get('action', [''])[0])
+        TRACE_SAMPLER.offer(route, params, trace)
+    if debug and isinstance(result, dict):
+        result = dict(result)
+        result["_trace"] = trace.tree()
+    return result
 
-    return {"success": False, "message": "资讯数据获取失败"}
 
+TRACE_SAMPLER = TraceSampler(os.path.join(CACHE_DIR, "traces.jsonl"))
 
-# ==========================================
-# 路由处理
-# ==========================================
 
-def handle_request(params):
-    """根据参数路由到不同的处理函数"""
+def _route(params, body=None):
     module = params.get('module', [''])[0]
     action = params.get('action', [''])[0]
     
@@ -918,12 +4558,14 @@ def handle_request(params):
         elif action == 'info':
             code = params.get('code', [''])[0]
             if code and len(code) == 6:
+                TRAFFIC.record([code])
                 return fund_info(code)
             return {"success": False, "message": "请输入6位基金代码"}
         
         elif action == 'detail':
             code = params.get('code', [''])[0]
             if code and len(code) == 6:
+                TRAFFIC.record([code])
                 return fund_detail(code)
             return {"success": False, "message": "请输入6位基金代码"}
         
@@ -932,12 +4574,65 @@ def handle_request(params):
             if codes_str:
                 codes = [c.strip() for c in codes_str.split(',') if c.strip() and len(c.strip()) == 6]
                 if codes:
+                    TRAFFIC.record(codes)
                     return fund_batch(codes)
             return {"success": False, "message": "请提供基金代码列表"}
         
         elif action == 'hot':
             return fund_hot()
 
+        elif action == 'history':
+            code = params.get('code', [''])[0]
+            if not code or len(code) != 6:
+                return {"success": False, "message": "请输入6位基金代码"}
+            start = params.get('start', [''])[0]
+            end = params.get('end', [''])[0]
+            if (start and _parse_day(start) is None) or (end and _parse_day(end) is None):
+                return {"success": False, "message": "日期格式应为 YYYY-MM-DD"}
+            try:
+                points = int(params.get('points', [NAV_HISTORY_DEFAULT_POINTS])[0])
+            except ValueError:
+                points = NAV_HISTORY_DEFAULT_POINTS
+            TRAFFIC.record([code])
+            return fund_history(
+                code, _parse_day(start), _parse_day(end), params.get('range', ['1y'])[0],
+                max(3, min(points, NAV_HISTORY_MAX_POINTS)), params.get('field', ['nav'])[0]
+            )
+
+    # 运行指标（Prometheus 文本）
+    if module == 'metrics':
+        return StreamResponse(iter([METRICS.render().encode("utf-8")]), "text/plain; version=0.0.4; charset=utf-8")
+
+    # 缓存预热（cron 触发）
+    if module == 'warm':
+        return {"success": True, "data": WARMER.run_once()}
+
+    # 实时推送模块
+    if module == 'live':
+        codes = [c.strip() for c in params.get('codes', [''])[0].split(',') if len(c.strip()) == 6]
+        secids = [s.strip() for s in params.get('secids', [''])[0].split(',') if '.' in s]
+        return live_stream(codes, secids, params.get('last_event_id', [''])[0])
+
+    # 组合请求模块
+    if module == 'multi':
+        raw = body.get("requests") if isinstance(body, dict) else None
+        if raw is None:
+            raw = params.get('requests', [''])[0]
+        stream = params.get('stream', ['0'])[0] == '1'
+        return multi_request(raw, stream)
+
+    # 持仓估值模块
+    if module == 'portfolio':
+        if action == 'value':
+            raw = (body or {}).get("holdings") if isinstance(body, dict) else None
+            if raw is None and params.get('holdings'):
+                try:
+                    raw = json.loads(params['holdings'][0])
+                except ValueError:
+                    return {"success": False, "message": "持仓格式错误"}
+            with_holdings = params.get('detail', ['1'])[0] != '0'
+            return portfolio_value(raw, with_holdings)
+
     # 市场模块
     if module == 'market':
         if action == 'indices':
@@ -979,26 +4674,513 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def do_GET(self):
+        self._respond()
+
+    def _respond(self, body=None):
         start_time = time.time()
         parsed = urlparse(self.path)
         params = parse_qs(parsed.query)
+        method = self.command
+        if self.headers.get('Last-Event-ID'):
+            params['last_event_id'] = [self.headers['Last-Event-ID']]
         
+        module = params.get('module', [''])[0]
         try:
-            result = handle_request(params)
+            if not _authorized(module, self.headers.get('Authorization')):
+                result = {"success": False, "message": "未授权"}
+            else:
+                result = handle_request(params, body)
         except Exception as e:
             result = {"success": False, "message": str(e)}
+        route = MetricsRegistry.route_name(module, params.get('action', [''])[0])
+        ok = isinstance(result, StreamResponse) or bool(result.get("success"))
+        METRICS.observe_route(route, time.time() - start_time, ok)
+
+        if isinstance(result, StreamResponse):
+            self._stream(result)
+            return
         
-        result["_ms"] = round((time.time() - start_time) * 1000)
+        # 缓存命中时复用已序列化的响应体
+        payload = PAYLOADS.get(result)
+        elapsed = round((time.time() - start_time) * 1000)
+        not_modified = method == "GET" and _etag_matches(self.headers.get('If-None-Match'), payload.etag)
+        use_gzip = (
+            not not_modified
+            and len(payload) >= GZIP_MIN_BYTES
+            and "gzip" in (self.headers.get('Accept-Encoding') or "")
+        )
         
-        self.send_response(200)
+        self.send_response(304 if not_modified else 200)
         self.send_header('Content-Type', 'application/json; charset=utf-8')
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Cache-Control', 'public, max-age=30, s-maxage=60')
+        self.send_header('Cache-Control', _cache_control(params, result, method))
+        self.send_header('ETag', payload.etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Server-Timing', f'app;dur={elapsed}')
+        if "_age" in result:
+            self.send_header('Age', str(result["_age"]))
+        if not_modified:
+            self.end_headers()
+            return
+        data = payload.render_gzip(elapsed) if use_gzip else payload.render(elapsed)
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
         self.end_headers()
-        self.wfile.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+        self.wfile.write(data)
     
+    def _stream(self, response):
+        """逐块写出流式响应，以关闭连接标记结束"""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        try:
+            for chunk in response.chunks:
+                self.wfile.write(chunk)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            close = getattr(response.chunks, "close", None)
+            if close:
+                close()
+
+    def _send_error(self, status, message):
+        """请求本身不合法时直接返回错误 JSON，不进入路由"""
+        data = json.dumps({"success": False, "message": message}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > REQUEST_MAX_BODY:
+            # 未读取的请求体会污染 keep-alive 连接上的下一个请求
+            self.close_connection = True
+            if length < 0:
+                self._send_error(400, "Content-Length 无效")
+            else:
+                self._send_error(413, f"请求体超过上限 {REQUEST_MAX_BODY} 字节")
+            return
+        body = None
+        if length > 0:
+            try:
+                body = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                body = None
+        self._respond(body)
+
+
+# ==========================================
+# 自托管服务
+# ==========================================
+
+# 与 vercel.json 的 rewrites 一致：/fund、/api/fund 等价于 /api/index?module=fund
+API_REWRITES = {"fund", "sector", "news", "portfolio", "multi", "live", "market"}
+
+
+class StaticFiles:
+    """public/ 静态文件：按 mtime 缓存文件内容与 gzip 结果"""
+
+    COMPRESSIBLE = ("text/", "application/javascript", "application/json", "application/manifest+json", "image/svg+xml")
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, url_path):
+        """URL 路径映射为 public/ 下的文件，越界或不存在返回 None"""
+        rel = url_path.lstrip("/") or "index.html"
+        path = os.path.realpath(os.path.join(self.root, rel))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        return path if os.path.isfile(path) else None
+
+    def get(self, path):
+        """返回 (content_type, etag, data, gzip_data)，gzip_data 为 None 表示不压缩"""
+        st = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == (st.st_mtime_ns, st.st_size):
+            return entry[1]
+        with open(path, "rb") as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        gzipped = None
+        if len(data) >= GZIP_MIN_BYTES and content_type.startswith(self.COMPRESSIBLE):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            gzipped = compressor.compress(data) + compressor.flush()
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        etag = 'W/"%x-%x"' % (st.st_size, st.st_mtime_ns)
+        result = (content_type, etag, data, gzipped)
+        if st.st_size <= SERVE_STATIC_MAX_BYTES:
+            with self._lock:
+                self._entries[path] = ((st.st_mtime_ns, st.st_size), result)
+        return result
+
+
+STATIC = StaticFiles(PUBLIC_DIR)
+
+
+class ServeHandler(handler):
+    """自托管模式：HTTP/1.1 keep-alive，按 vercel.json 改写路由并托管 public/"""
+
+    protocol_version = "HTTP/1.1"
+    timeout = SERVE_KEEPALIVE_TIMEOUT
+    # 响应头与响应体分两次写出，keep-alive 下 Nagle 与延迟 ACK 叠加会让每个请求多等约 40ms
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        # 排空阶段不再等待空闲连接上的下一个请求
+        if self.server.mark_idle(self.connection, True):
+            self.close_connection = True
+            return
+        super().handle_one_request()
+
+    def parse_request(self):
+        self.server.mark_idle(self.connection, False)
+        return super().parse_request()
+
+    def end_headers(self):
+        if self.server.draining and not self.close_connection:
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def do_GET(self):
+        if self._rewrite():
+            self._respond()
+        else:
+            self._static()
+
     def do_POST(self):
-        self.do_GET()
+        if self._rewrite():
+            super().do_POST()
+        else:
+            self.close_connection = True
+            self.send_error(405)
+
+    def _rewrite(self):
+        """API 路径改写为 /api/index?module=...，非 API 路径返回 False"""
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip("/")
+        if path in ("/api", "/api/index"):
+            return True
+        name = path.rsplit("/", 1)[-1]
+        if name in API_REWRITES and path in (f"/{name}", f"/api/{name}"):
+            query = f"module={name}&{parsed.query}" if parsed.query else f"module={name}"
+            self.path = f"/api/index?{query}"
+            return True
+        return False
+
+    def _static(self):
+        path = STATIC.resolve(urlparse(self.path).path)
+        if path is None:
+            self.send_error(404)
+            return
+        try:
+            content_type, etag, data, gzipped = STATIC.get(path)
+        except OSError:
+            self.send_error(404)
+            return
+        if _etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        if gzipped is not None and "gzip" in (self.headers.get('Accept-Encoding') or ""):
+            data = gzipped
+            encoding = "gzip"
+        else:
+            encoding = None
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        # 与 Vercel 静态资源默认策略一致：每次经 ETag 重新验证
+        self.send_header('Cache-Control', 'public, max-age=0, must-revalidate')
+        self.send_header('ETag', etag)
+        if gzipped is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class APIServer(ThreadingHTTPServer):
+    """每连接一个线程，超过 max_connections 时停止 accept，由内核 listen 队列排队
+
+    drain() 停止接收新连接，关闭空闲的 keep-alive 连接，并等待处理中的请求完成。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, handler_class=ServeHandler, queue_size=SERVE_QUEUE_SIZE,
+                 max_connections=SERVE_MAX_CONNECTIONS, reuse_port=False, access_log=False):
+        self.request_queue_size = queue_size
+        self.reuse_port = reuse_port
+        self.access_log = access_log
+        self.draining = False
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._connections = {}  # socket -> 是否空闲
+        self._cond = threading.Condition()
+        super().__init__(address, handler_class)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        while not self._slots.acquire(timeout=0.5):
+            if self.draining:
+                self.shutdown_request(request)
+                return
+        with self._cond:
+            self._connections[request] = False
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._release(request)
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._release(request)
+
+    def _release(self, request):
+        with self._cond:
+            self._connections.pop(request, None)
+            self._cond.notify_all()
+        self._slots.release()
+
+    def mark_idle(self, request, idle):
+        """标记连接是否在等待下一个请求，返回是否处于排空阶段"""
+        with self._cond:
+            if request in self._connections:
+                self._connections[request] = idle
+            return self.draining
+
+    def active_connections(self):
+        with self._cond:
+            return len(self._connections)
+
+    def drain(self, timeout=SERVE_DRAIN_TIMEOUT):
+        """需在 serve_forever 之外的线程调用；返回排空后仍未结束的连接数"""
+        self.draining = True
+        self.shutdown()
+        self.socket.close()
+        with self._cond:
+            for request, idle in self._connections.items():
+                if idle:
+                    try:
+                        request.shutdown(socket.SHUT_RD)
+                    except OSError:
+                        pass
+            self._cond.wait_for(lambda: not self._connections, timeout)
+            return len(self._connections)
+
+
+def _serve_worker(host, port, reuse_port, options, warm=False):
+    """单个工作进程：SIGTERM/SIGINT 时排空后退出"""
+    server = APIServer((host, port), reuse_port=reuse_port, **options)
+    stopping = threading.Event()
+
+    def _stop(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.drain, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+    if UPSTREAM_PREWARM:
+        prewarm_upstream()
+    if warm:
+        WARMER.start()
+    try:
+        server.serve_forever()
+    finally:
+        if warm:
+            WARMER.stop()
+    # 等待 drain 线程关闭剩余连接
+    deadline = time.time() + SERVE_DRAIN_TIMEOUT + 1
+    while server.active_connections() and time.time() < deadline:
+        time.sleep(0.1)
+
+
+def serve(host=SERVE_HOST, port=SERVE_PORT, workers=SERVE_WORKERS, warm=False, shared_cache=True, **options):
+    """启动自托管服务
+
+    workers > 1 时 fork 出多个工作进程，各自以 SO_REUSEPORT 绑定同一端口，由内核分发连接；
+    主进程只负责转发信号与拉起异常退出的进程。shared_cache 为真且未配置 SHARED_CACHE_SOCKET 时
+    另起一个共享缓存守护进程，工作进程间共享缓存条目与回源租约，所有工作进程退出后再停止。
+    预热只在第一个工作进程中运行。
+    """
+    global SHARED_CACHE
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and not (hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")):
+        print("当前平台不支持 fork/SO_REUSEPORT，以单进程运行")
+        workers = 1
+    if workers == 1:
+        print(f"养小基 API 监听 http://{host}:{port}（静态目录 {PUBLIC_DIR}）", flush=True)
+        _serve_worker(host, port, False, options, warm)
+        return
+
+    # SO_REUSEPORT 下同一用户的另一个实例也能绑定成功并分走连接，先探测端口是否已在服务
+    try:
+        socket.create_connection(("127.0.0.1" if host in ("", "0.0.0.0") else host, port), timeout=0.5).close()
+    except OSError:
+        pass
+    else:
+        raise SystemExit(f"端口 {port} 已被占用")
+    print(f"养小基 API 监听 http://{host}:{port}（{workers} 个进程，静态目录 {PUBLIC_DIR}）", flush=True)
+
+    children = {}  # pid -> (序号, 启动时间)，共享缓存守护进程的序号为 "cache"
+    stopping = False
+    cache_path = None
+    if shared_cache and SHARED_CACHE is None:
+        cache_path = os.path.join(CACHE_DIR, f"shared-{port}.sock")
+        SHARED_CACHE = SharedCache(cache_path)
+
+    def _spawn(index):
+        # 子进程装好自己的信号处理前屏蔽信号，避免执行主进程的 _stop
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                if index == "cache":
+                    run_shared_cache(cache_path)
+                else:
+                    _serve_worker(host, port, True, options, warm and index == 0)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+        children[pid] = (index, time.time())
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        # 工作进程排空期间仍要读写共享缓存，守护进程最后停止
+        workers_alive = [pid for pid, (index, _) in children.items() if index != "cache"]
+        for pid in workers_alive or list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    if cache_path:
+        _spawn("cache")
+        deadline = time.time() + 2
+        while not os.path.exists(cache_path) and time.time() < deadline:
+            time.sleep(0.01)
+    for index in range(workers):
+        _spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index, started = children.pop(pid, (None, 0))
+        if stopping:
+            _stop(signal.SIGTERM, None)
+            continue
+        if index is None:
+            continue
+        # 启动即退出（如端口被占用）时不再重试，避免反复 fork
+        if time.time() - started < 1:
+            print(f"子进程 {pid}（{index}）启动失败，退出", flush=True)
+            _stop(signal.SIGTERM, None)
+            continue
+        print(f"子进程 {pid}（{index}）异常退出（status={status}），重新拉起", flush=True)
+        _spawn(index)
+
+
+# ==========================================
+# 命令行入口
+# ==========================================
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="养小基 API")
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm = commands.add_parser("warm", help="预热热点缓存（可由 cron 调用）")
+    warm.add_argument("--loop", action="store_true", help="常驻循环，每 WARM_INTERVAL 秒一轮")
+    srv = commands.add_parser("serve", help="自托管 HTTP 服务（含 public/ 静态文件）")
+    srv.add_argument("--host", default=SERVE_HOST)
+    srv.add_argument("--port", type=int, default=SERVE_PORT)
+    srv.add_argument("--workers", type=int, default=SERVE_WORKERS, help="工作进程数，0 表示 CPU 核数")
+    srv.add_argument("--queue-size", type=int, default=SERVE_QUEUE_SIZE, help="listen 队列长度")
+    srv.add_argument("--max-connections", type=int, default=SERVE_MAX_CONNECTIONS, help="单进程同时处理的连接数")
+    srv.add_argument("--warm", action="store_true", help="在第一个工作进程中运行缓存预热")
+    srv.add_argument("--access-log", action="store_true", help="输出访问日志")
+    srv.add_argument("--no-shared-cache", action="store_true", help="多进程时不启动共享缓存守护进程")
+    daemon = commands.add_parser("cache-daemon", help="单独运行进程间共享缓存守护进程")
+    daemon.add_argument("--socket", default=SHARED_CACHE_SOCKET or os.path.join(CACHE_DIR, "shared.sock"))
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(
+            args.host, args.port, args.workers, warm=args.warm, shared_cache=not args.no_shared_cache,
+            queue_size=args.queue_size, max_connections=args.max_connections, access_log=args.access_log
+        )
+        return
+    if args.command == "cache-daemon":
+        print(f"共享缓存监听 {args.socket}，工作进程设置 SHARED_CACHE_SOCKET={args.socket}", flush=True)
+        run_shared_cache(args.socket)
+        return
+
+    if args.command == "warm":
+        if args.loop:
+            WARMER.start()
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                WARMER.stop()
+        else:
+            print(json.dumps(WARMER.run_once(), ensure_ascii=False))
+
+
+# Serverless 冷启动：模块导入后即开始预热，与平台初始化、请求解析并行；
+# 作为脚本运行时（serve 会 fork）不在导入阶段启动线程
+if UPSTREAM_PREWARM and __name__ != "__main__":
+    prewarm_upstream()
+
+
+if __name__ == "__main__":
+    main()
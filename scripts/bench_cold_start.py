@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+冷启动基准：用 `python -X importtime` 统计 api/index.py 的导入耗时
+
+每轮在新的解释器进程中导入 index，取 index 的累计导入时间（不含解释器自身启动与 site），
+多轮取中位数与最大值，并列出耗时最多的直接依赖；同时检查 requests 等重型模块没有在导入阶段加载。
+中位数超过 --budget-ms 或重型模块被提前导入时以非零状态退出，可在 CI 中执行。
+
+用法：python scripts/bench_cold_start.py [--runs 15] [--budget-ms 80] [--json]
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(ROOT, "..", "api")
+
+# 应在首次使用时才导入的模块
+LAZY_MODULES = ("requests", "urllib3", "charset_normalizer", "sqlite3", "concurrent.futures", "logging", "argparse")
+
+
+def _env():
+    env = dict(os.environ)
+    env.update({
+        "DISK_CACHE": "0",
+        "UPSTREAM_PREWARM": "0",
+        "CACHE_DIR": tempfile.mkdtemp(prefix="yangxiaoji-cold-"),
+    })
+    # 允许生成字节码缓存，默认测量的是已有 .pyc 时的导入耗时
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def parse_importtime(stderr):
+    """返回 (index 累计耗时 µs, {直接依赖: 累计耗时 µs})"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        # 跳过表头 "self [us] | cumulative | imported package"
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        # 名称前固定一个空格，之后每层嵌套缩进两个空格
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), int(fields[1])))
+    # importtime 先输出子模块、后输出父模块；index 之前、缩进更深一级的行即其直接依赖
+    total = None
+    children = {}
+    for i, (depth, name, cumulative) in enumerate(rows):
+        if name != "index":
+            continue
+        total = cumulative
+        for child_depth, child, child_cumulative in reversed(rows[:i]):
+            if child_depth <= depth:
+                break
+            if child_depth == depth + 1:
+                children[child] = child_cumulative
+        break
+    return total, children
+
+
+def run_once(env, no_pyc=False):
+    if no_pyc:
+        # 删除 index 的字节码缓存，模拟只读文件系统上每次冷启动都要重新编译
+        for pyc in glob.glob(os.path.join(API_DIR, "__pycache__", "index.*.pyc")):
+            os.remove(pyc)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import index"],
+        cwd=API_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return parse_importtime(proc.stderr)
+
+
+def eager_modules(env):
+    code = f"import json, sys, index; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=API_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=80.0, help="index 导入耗时中位数上限（毫秒）")
+    parser.add_argument("--top", type=int, default=10, help="列出耗时最多的直接依赖数")
+    parser.add_argument("--no-pyc", action="store_true", help="不使用 index.py 的字节码缓存，计入编译耗时")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    env = _env()
+    # 先跑一轮，生成标准库与 index 的字节码并预热文件系统缓存
+    run_once(env)
+    totals = []
+    children = {}
+    for _ in range(args.runs):
+        total, deps = run_once(env, args.no_pyc)
+        totals.append(total / 1000)
+        for name, cumulative in deps.items():
+            children.setdefault(name, []).append(cumulative / 1000)
+    eager = eager_modules(env)
+
+    median = statistics.median(totals)
+    top = sorted(((statistics.median(v), k) for k, v in children.items()), reverse=True)[:args.top]
+    ok = median <= args.budget_ms and not eager
+    if args.json:
+        print(json.dumps({
+            "runs": args.runs,
+            "median_ms": round(median, 1),
+            "max_ms": round(max(totals), 1),
+            "budget_ms": args.budget_ms,
+            "top_imports": [{"module": name, "ms": round(ms, 1)} for ms, name in top],
+            "eager_modules": eager,
+            "ok": ok,
+        }, ensure_ascii=False, indent=2))
+    else:
+        print(f"index 导入耗时：中位数 {median:.1f}ms，最大 {max(totals):.1f}ms（{args.runs} 轮，预算 {args.budget_ms:.0f}ms）")
+        print(f"\n{'module':<28} {'ms':>8}")
+        for ms, name in top:
+            print(f"{name:<28} {ms:>8.1f}")
+        if eager:
+            print(f"\n导入阶段加载了应延迟导入的模块：{', '.join(eager)}")
+        print("\n通过" if ok else "\n未通过")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+端到端基准测试：经 HTTP handler 压测各 action，上游由回放桩提供
+
+启动回放桩（scripts/upstream_stub.py）与本地 handler 服务，按 SCENARIOS 逐个 action
+并发请求，分别统计冷缓存（内存与序列化缓存容量置 0、共享与磁盘层关闭，每次回源）
+与热缓存下的吞吐与 p50/p95/p99。
+默认使用仓库内的 fixtures/upstream；需要真实响应时用 `python scripts/upstream_stub.py record` 联网重新录制。
+
+用法：python scripts/bench_e2e.py [--requests 200] [--concurrency 16] [--latency 0.05] [--error-rate 0]
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import upstream_stub  # noqa: E402
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class Client:
+    """每个压测线程复用一个连接，服务端关闭时重建"""
+
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def get(self, path):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            body = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            return False
+        if resp.getheader("Connection", "").lower() == "close":
+            conn.close()
+            self._local.conn = None
+        try:
+            return bool(json.loads(body).get("success"))
+        except ValueError:
+            return False
+
+
+def run_phase(client, path, total, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def _one(_):
+        nonlocal errors
+        start = time.perf_counter()
+        ok = client.get(path)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(_one, range(total)))
+    wall = time.perf_counter() - start
+    return {
+        "rps": total / wall if wall else 0.0,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=upstream_stub.FIXTURE_DIR)
+    parser.add_argument("--requests", type=int, default=200, help="每个 action 每种模式的请求数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="回放桩模拟的上游延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--actions", default="", help="只测指定 action，逗号分隔，如 fund.info,sector.streak")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    stub, store = upstream_stub.make_server(0, args.fixtures, args.latency, error_rate=args.error_rate)
+    if not len(store):
+        sys.exit(f"没有 fixture：先运行 python scripts/upstream_stub.py record（目录 {args.fixtures}）")
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    # 必须在导入 index 之前设置
+    os.environ["UPSTREAM_OVERRIDES"] = f"*=http://127.0.0.1:{stub.server_address[1]}"
+    os.environ["DISK_CACHE"] = "0"
+    os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="yangxiaoji-bench-")
+    sys.path.insert(0, os.path.join(ROOT, "..", "api"))
+    import index
+
+    server = upstream_stub.BenchServer(("127.0.0.1", 0), index.handler)
+    index.handler.log_message = lambda *a: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = Client(server.server_address[1])
+
+    wanted = {name for name in args.actions.split(",") if name}
+    results = []
+    tiers = (index.CACHE.max_entries, index.PAYLOADS.max_entries, index.SHARED_CACHE, index.DISK_CACHE)
+    for name, params in upstream_stub.SCENARIOS:
+        if wanted and name not in wanted:
+            continue
+        path = "/api/index?" + urlencode(params)
+        # 冷：内存缓存与序列化缓存不保留任何条目，共享与磁盘层关闭，每个请求都回源
+        # （并发相同 key 仍会被 single-flight 合并）
+        index.CACHE.max_entries = 0
+        index.CACHE.clear()
+        index.PAYLOADS.max_entries = 0
+        index.SHARED_CACHE = None
+        index.DISK_CACHE = None
+        cold = run_phase(client, path, args.requests, args.concurrency)
+        # 热：恢复各层缓存，先预热一次再压测
+        index.CACHE.max_entries, index.PAYLOADS.max_entries, index.SHARED_CACHE, index.DISK_CACHE = tiers
+        client.get(path)
+        warm = run_phase(client, path, args.requests, args.concurrency)
+        results.append({"action": name, "cold": cold, "warm": warm})
+
+    if args.json:
+        print(json.dumps({"results": results, "fixture_misses": sorted(set(store.misses))}, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'action':<16} {'mode':<5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for row in results:
+        for mode in ("cold", "warm"):
+            r = row[mode]
+            print(
+                f"{row['action']:<16} {mode:<5} {r['rps']:>8.1f} {r['p50']:>8.1f} "
+                f"{r['p95']:>8.1f} {r['p99']:>8.1f} {r['errors']:>7}"
+            )
+    if store.misses:
+        print(f"\n未命中 fixture 的上游路径：{', '.join(sorted(set(store.misses)))}")
+
+
+if __name__ == "__main__":
+    main()
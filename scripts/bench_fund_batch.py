@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+fund_batch 基准测试：逐只请求 vs 批量估值接口
+
+用模拟上游（固定延迟）替换 SESSION.get，统计 10/50/200 只基金一次刷新的
+上游请求次数与耗时。
+
+用法：python scripts/bench_fund_batch.py [--latency 0.08]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+os.environ.setdefault("DISK_CACHE", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index  # noqa: E402
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeUpstream:
+    """按 URL 返回构造数据，记录调用次数"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        params = params or {}
+        if "fundgz" in url:
+            code = url.rsplit("/", 1)[-1].split(".")[0]
+            body = {
+                "fundcode": code, "name": f"基金{code}", "jzrq": "2026-01-01", "dwjz": "1.0000",
+                "gsz": "1.0100", "gszzl": "1.00", "gztime": "2026-01-02 15:00"
+            }
+            return _FakeResponse(f"jsonpgz({json.dumps(body, ensure_ascii=False)});")
+        if params.get("action_name") == "fundMNFInfo":
+            datas = [{
+                "FCODE": code, "SHORTNAME": f"基金{code}", "PDATE": "2026-01-01", "NAV": "1.0000",
+                "GSZ": "1.0100", "GSZZL": "1.00", "GZTIME": "2026-01-02 15:00"
+            } for code in params["Fcodes"].split(",")]
+            return _FakeResponse(json.dumps({"Datas": datas, "ErrCode": 0}))
+        return _FakeResponse("{}")
+
+
+def legacy_fund_batch(codes):
+    """改造前的实现：每只基金一次 fundgz 请求"""
+    results = []
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = {executor.submit(index.fund_info, code): code for code in codes}
+        for future in as_completed(futures):
+            result = future.result()
+            if result.get("success"):
+                results.append(result["data"])
+    return {"success": True, "data": results}
+
+
+def run(fn, codes, upstream):
+    index.CACHE.clear()
+    upstream.calls = 0
+    start = time.perf_counter()
+    result = fn(codes)
+    elapsed = (time.perf_counter() - start) * 1000
+    assert len(result["data"]) == len(codes)
+    return upstream.calls, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.08, help="模拟上游单次延迟（秒）")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.latency)
+    index.SESSION.get = upstream.get
+
+    print(f"{'codes':>6} | {'legacy calls':>12} {'legacy ms':>10} | {'bulk calls':>10} {'bulk ms':>8}")
+    for size in (10, 50, 200):
+        codes = [f"{i:06d}" for i in range(1, size + 1)]
+        legacy_calls, legacy_ms = run(legacy_fund_batch, codes, upstream)
+        bulk_calls, bulk_ms = run(index.fund_batch, codes, upstream)
+        print(f"{size:>6} | {legacy_calls:>12} {legacy_ms:>10.0f} | {bulk_calls:>10} {bulk_ms:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+重仓股解析微基准：旧正则 vs _parse_fund_holdings
+
+样本为 scripts/fixtures/jjcc_*.html（fundf10 FundArchivesDatas.aspx?type=jjcc 响应）。
+
+用法：python scripts/bench_holdings_parser.py
+"""
+
+import glob
+import os
+import re
+import sys
+import timeit
+
+os.environ.setdefault("DISK_CACHE", "0")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+import index  # noqa: E402
+
+
+def legacy_parse(text):
+    """改造前 _fetch_fund_stocks 的解析逻辑（每次调用重新编译正则）"""
+    stocks = []
+    table_pattern = r'<tr[^>]*>.*?<td[^>]*>(\d+)</td>.*?<td[^>]*>(\d{6})</td>.*?<td[^>]*><a[^>]*>([^<]+)</a></td>.*?<td[^>]*>([^<]*)</td>'
+    for match in re.finditer(table_pattern, text, re.DOTALL):
+        stocks.append({"code": match.group(2), "name": match.group(3).strip(), "ratio": match.group(4).strip() + "%"})
+    if not stocks:
+        simple_pattern = r'<a[^>]*>(\d{6})</a>.*?<a[^>]*>([^<]+)</a>.*?(\d+\.\d+)%'
+        for match in re.finditer(simple_pattern, text, re.DOTALL):
+            stocks.append({"code": match.group(1), "name": match.group(2).strip(), "ratio": match.group(3) + "%"})
+    return stocks[:10]
+
+
+def per_call(fn):
+    """自动选择循环次数（总耗时 >= 0.2s），返回单次调用秒数"""
+    number, elapsed = timeit.Timer(fn).autorange()
+    return elapsed / number
+
+
+def main():
+    print(f"{'sample':<22} {'bytes':>8} | {'legacy us':>10} {'parser us':>10} {'speedup':>8}")
+    for path in sorted(glob.glob(os.path.join(ROOT, "scripts", "fixtures", "jjcc_*.html"))):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        new_codes = [h.code for h in index._parse_fund_holdings(text)]
+        legacy_codes = [s["code"] for s in legacy_parse(text)]
+        if [c for c in new_codes if len(c) == 6][:len(legacy_codes)] != legacy_codes[:len(new_codes)]:
+            print(f"  结果不一致: {os.path.basename(path)} {legacy_codes} != {new_codes}")
+        legacy = per_call(lambda: legacy_parse(text))
+        parsed = per_call(lambda: index._parse_fund_holdings(text))
+        print(f"{os.path.basename(path):<22} {len(text.encode('utf-8')):>8} | "
+              f"{legacy * 1e6:>10.1f} {parsed * 1e6:>10.1f} {legacy / parsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+上游录制 / 回放桩
+
+record：联网执行一组典型请求（SCENARIOS），把经过 SESSION.get 的上游响应
+        （fundgz、天天基金 action、ulist/clist/kline、jjcc、pingzhongdata、FundGuideapi、新浪滚动新闻等）
+        存为 fixtures/upstream/<host>/<hash>.json
+        仓库内提交的是一组按上游格式构造的最小样例（覆盖 SCENARIOS 冷缓存下的全部请求），
+        联网 record 会按相同 key 覆盖为真实响应
+serve： 本地 HTTP 服务按 主机 + 路径 + 查询参数 回放，可配置延迟与错误注入
+
+回放时设置 UPSTREAM_OVERRIDES="*=http://127.0.0.1:8600"，index.py 的上游请求
+都会改写为 http://127.0.0.1:8600/<host><path>?<query>。
+
+用法：
+  python scripts/upstream_stub.py record
+  python scripts/upstream_stub.py serve --port 8600 --latency 0.05 --error-rate 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(ROOT, "fixtures", "upstream")
+
+# 每次请求都会变化、不影响响应内容的参数
+IGNORED_PARAMS = {"_", "cb", "rt", "v", "callback", "rnd"}
+
+# 录制与压测共用的典型请求
+SCENARIOS = [
+    ("fund.search", {"module": "fund", "action": "search", "keyword": "白酒"}),
+    ("fund.info", {"module": "fund", "action": "info", "code": "161725"}),
+    ("fund.detail", {"module": "fund", "action": "detail", "code": "161725"}),
+    ("fund.batch", {"module": "fund", "action": "batch", "codes": "161725,000001,110011,005827,012414,003096"}),
+    ("fund.hot", {"module": "fund", "action": "hot"}),
+    ("fund.history", {"module": "fund", "action": "history", "code": "161725", "range": "3y"}),
+    ("market.indices", {"module": "market", "action": "indices"}),
+    ("sector.list", {"module": "sector", "action": "list"}),
+    ("sector.streak", {"module": "sector", "action": "streak", "limit": "10"}),
+    ("sector.funds", {"module": "sector", "action": "funds", "code": "BK000054", "name": "半导体"}),
+    ("news.list", {"module": "news", "action": "list"}),
+]
+
+
+def fixture_key(host, path, query):
+    """主机 + 路径 + 排序后的查询参数（去掉易变参数）"""
+    items = sorted((k, v) for k, v in query if k not in IGNORED_PARAMS)
+    return f"{host}{path}?{urlencode(items)}"
+
+
+def fixture_path(key, fixture_dir=FIXTURE_DIR):
+    host = key.split("/", 1)[0]
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(fixture_dir, host, f"{name}.json")
+
+
+def scenario_params(params):
+    """转为 handle_request 使用的 parse_qs 格式"""
+    return {key: [value] for key, value in params.items()}
+
+
+# ==========================================
+# 录制
+# ==========================================
+
+def record(fixture_dir):
+    os.environ["DISK_CACHE"] = "0"
+    # 使用空的本地目录，保证板块收盘价、基金检索索引等都从上游拉取
+    os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="yangxiaoji-record-")
+    sys.path.insert(0, os.path.join(ROOT, "..", "api"))
+    import index
+
+    real_get = index.SESSION.get
+    saved = {}
+    lock = threading.Lock()
+
+    def recording_get(url, params=None, **kwargs):
+        resp = real_get(url, params=params, **kwargs)
+        parsed = urlparse(url)
+        query = parse_qsl(parsed.query, keep_blank_values=True) + list((params or {}).items())
+        key = fixture_key(parsed.hostname, parsed.path, query)
+        fixture = {
+            "key": key,
+            "url": url,
+            "status": resp.status_code,
+            "content_type": (resp.headers.get("Content-Type") or "text/plain").split(";")[0],
+            "body": resp.text,
+        }
+        path = fixture_path(key, fixture_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False)
+        with lock:
+            saved[key] = resp.status_code
+        return resp
+
+    index.SESSION.get = recording_get
+    for name, params in SCENARIOS:
+        # 每个场景从空缓存开始，录下的请求与压测冷阶段一致（如批量估值的 Fcodes 不受前序场景缓存影响）
+        index.CACHE.clear()
+        start = time.perf_counter()
+        result = index.handle_request(scenario_params(params))
+        ok = result.get("success") if isinstance(result, dict) else True
+        print(f"{name:<16} success={ok} {(time.perf_counter() - start) * 1000:.0f}ms")
+    # 历史净值首次为全量拉取，清空缓存后再请求一次，录制增量同步用的 lsjz
+    index.CACHE.clear()
+    index.handle_request(scenario_params(dict(SCENARIOS)["fund.history"]))
+    # 基金检索索引在后台线程构建，这里同步拉取一次
+    index.FUND_INDEX.refresh()
+    print(f"录制 {len(saved)} 个上游响应 -> {fixture_dir}")
+
+
+# ==========================================
+# 回放
+# ==========================================
+
+class FixtureStore:
+    def __init__(self, fixture_dir=FIXTURE_DIR):
+        self.fixtures = {}
+        for dirpath, _, filenames in os.walk(fixture_dir):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    with open(os.path.join(dirpath, filename), "r", encoding="utf-8") as f:
+                        fixture = json.load(f)
+                    self.fixtures[fixture["key"]] = fixture
+        self.hits = 0
+        self.misses = []
+
+    def __len__(self):
+        return len(self.fixtures)
+
+    def lookup(self, host, path, query):
+        fixture = self.fixtures.get(fixture_key(host, path, query))
+        if fixture is None:
+            self.misses.append(f"{host}{path}")
+        else:
+            self.hits += 1
+        return fixture
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+    latency = 0.0
+    jitter = 0.5
+    error_rate = 0.0
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        host, _, path = parsed.path.lstrip("/").partition("/")
+        delay = self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            if random.random() < 0.5:
+                # 连接重置
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b"\x01\x00\x00\x00\x00\x00\x00\x00")
+                self.close_connection = True
+                self.connection.close()
+                return
+            self._send(502, "text/plain", "stub injected error")
+            return
+
+        fixture = self.store.lookup(host, "/" + path, parse_qsl(parsed.query, keep_blank_values=True))
+        if fixture is None:
+            self._send(404, "text/plain", "fixture not found")
+            return
+        self._send(fixture["status"], fixture["content_type"], fixture["body"])
+
+    def _send(self, status, content_type, body):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchServer(ThreadingHTTPServer):
+    """加大监听队列，避免并发建连时 SYN 重传带来的 1s 长尾"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def make_server(port=0, fixture_dir=FIXTURE_DIR, latency=0.0, jitter=0.5, error_rate=0.0):
+    """创建回放服务（未启动），返回 (server, store)"""
+    store = FixtureStore(fixture_dir)
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "store": store, "latency": latency, "jitter": jitter, "error_rate": error_rate
+    })
+    return BenchServer(("127.0.0.1", port), handler), store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="fixture 目录")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("record", help="联网录制上游响应")
+    serve = commands.add_parser("serve", help="启动回放服务")
+    serve.add_argument("--port", type=int, default=8600)
+    serve.add_argument("--latency", type=float, default=0.0, help="模拟上游延迟（秒）")
+    serve.add_argument("--jitter", type=float, default=0.5, help="延迟随机浮动比例")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="注入错误（502/连接重置）的比例")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.fixtures)
+        return
+
+    server, store = make_server(args.port, args.fixtures, args.latency, args.jitter, args.error_rate)
+    print(f"回放 {len(store)} 个 fixture：UPSTREAM_OVERRIDES=\"*=http://127.0.0.1:{server.server_address[1]}\"")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""fund_batch：批量估值接口失败时逐只兜底、并发请求合并回源、软过期旧值后台刷新"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+os.environ["DISK_CACHE"] = "0"
+os.environ["UPSTREAM_PREWARM"] = "0"
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="yangxiaoji-test-")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index  # noqa: E402
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _fake_get(url, params=None, **kwargs):
+    """fundgz 按代码返回估值，其余上游返回空"""
+    if "fundgz" in url:
+        code = url.rsplit("/", 1)[-1].split(".")[0]
+        body = {
+            "fundcode": code, "name": f"基金{code}", "jzrq": "2026-01-01", "dwjz": "1.0000",
+            "gsz": "1.0100", "gszzl": "1.00", "gztime": "2026-01-02 15:00"
+        }
+        return _FakeResponse(f"jsonpgz({json.dumps(body, ensure_ascii=False)});")
+    return _FakeResponse("{}")
+
+
+class FundBatchTest(unittest.TestCase):
+    def setUp(self):
+        index.CACHE.clear()
+        for breaker in index.BREAKERS.values():
+            breaker.record_success()
+
+    def test_bulk_failure_falls_back_per_code(self):
+        with mock.patch.object(index.SESSION, "get", _fake_get, create=True), \
+                mock.patch.object(index, "_fetch_fund_estimates_bulk", side_effect=RuntimeError("bulk down")):
+            result = index.fund_batch(["000001", "000002"])
+        self.assertTrue(result["success"])
+        self.assertEqual([fund["code"] for fund in result["data"]], ["000001", "000002"])
+        self.assertTrue(all(fund.get("estimate_nav") == "1.0100" for fund in result["data"]))
+
+    def test_failed_chunk_does_not_affect_other_chunks(self):
+        codes = [f"{i:06d}" for i in range(1, index.BULK_ESTIMATE_CHUNK + 3)]
+
+        def bulk(chunk):
+            if "000001" in chunk:
+                raise RuntimeError("chunk down")
+            return {code: {"code": code, "name": "bulk", "estimate_nav": "2.0"} for code in chunk}
+
+        with mock.patch.object(index.SESSION, "get", _fake_get, create=True), \
+                mock.patch.object(index, "_fetch_fund_estimates_bulk", side_effect=bulk):
+            result = index.fund_batch(codes)
+        by_code = {fund["code"]: fund for fund in result["data"]}
+        self.assertEqual(len(by_code), len(codes))
+        # 失败分片逐只走 fund_info，成功分片使用批量结果
+        self.assertEqual(by_code["000001"]["estimate_nav"], "1.0100")
+        self.assertEqual(by_code[codes[-1]]["name"], "bulk")
+
+    def test_concurrent_batches_share_bulk_requests(self):
+        calls = []
+        release = threading.Event()
+
+        def bulk(chunk):
+            calls.append(tuple(chunk))
+            release.wait(2)
+            return {code: {"code": code, "name": "bulk"} for code in chunk}
+
+        results = []
+        with mock.patch.object(index, "_fetch_fund_estimates_bulk", side_effect=bulk):
+            threads = [
+                threading.Thread(target=lambda c=c: results.append(index.fund_batch(c)))
+                for c in (["000001", "000002"], ["000002", "000001"], ["000001"])
+            ]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(fund["name"] == "bulk" for result in results for fund in result["data"]))
+
+    def test_stale_entries_served_and_refreshed_in_background(self):
+        stale = {"success": True, "data": {"code": "000001", "name": "old"}}
+        ttl = index.FUND_INFO_TTL
+        index.CACHE.set("info:000001", stale, ttl=ttl, stale_ttl=ttl * 4, ts=time.time() - ttl - 1)
+        refreshed = threading.Event()
+
+        def bulk(chunk):
+            refreshed.set()
+            return {code: {"code": code, "name": "new"} for code in chunk}
+
+        with mock.patch.object(index.MARKET_CALENDAR, "ttl", return_value=ttl), \
+                mock.patch.object(index, "_fetch_fund_estimates_bulk", side_effect=bulk):
+            result = index.fund_batch(["000001"])
+            self.assertEqual(result["data"][0]["name"], "old")
+            self.assertTrue(refreshed.wait(2))
+        for _ in range(50):
+            if index.CACHE.peek("info:000001")[0]["data"]["name"] == "new":
+                break
+            time.sleep(0.02)
+        self.assertEqual(index.CACHE.peek("info:000001")[0]["data"]["name"], "new")
+
+
+if __name__ == "__main__":
+    unittest.main()